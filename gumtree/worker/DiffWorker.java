@@ -0,0 +1,133 @@
+import com.github.gumtreediff.actions.Diff;
+import com.github.gumtreediff.client.Run;
+import com.github.gumtreediff.io.ActionsIoUtils;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.io.StringWriter;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.util.List;
+import java.util.stream.Collectors;
+
+/**
+ * GumTreeを常駐させて差分を計算するワーカー
+ *
+ * serve: 標準入力から "srcのバイト数 destのバイト数\n" に続くコード本体を受け取り，
+ *        "OK バイト数\n" (失敗時は "ERR バイト数\n") に続けてtextdiffと同じJSONを返す
+ * batch: 指定ディレクトリ直下の各サブディレクトリのsrc.py/dest.pyを差分し，
+ *        同じ場所にdiff.json (失敗時はerror.txt) を書き出す
+ */
+public class DiffWorker {
+
+    public static void main(String[] args) throws Exception {
+        // GumTree内部のログがプロトコルに混ざらないよう，標準出力を退避してからstderrへ向ける
+        OutputStream protocol = new BufferedOutputStream(new FileOutputStream(FileDescriptor.out));
+        System.setOut(System.err);
+
+        Run.initGenerators();
+        String mode = args.length > 0 ? args[0] : "serve";
+        Path scratch = createScratchDir();
+        try {
+            if (mode.equals("serve")) {
+                serve(new DataInputStream(new BufferedInputStream(System.in)), protocol, scratch);
+            } else if (mode.equals("batch") && args.length > 1) {
+                batch(Paths.get(args[1]));
+            } else {
+                System.err.println("Unknown mode: " + mode);
+                System.exit(2);
+            }
+        } finally {
+            deleteRecursively(scratch);
+        }
+    }
+
+    static String diff(Path src, Path dest) throws Exception {
+        Diff diff = Diff.compute(src.toString(), dest.toString());
+        StringWriter writer = new StringWriter();
+        ActionsIoUtils.toJson(diff.src, diff.editScript, diff.mappings).writeTo(writer);
+        return writer.toString();
+    }
+
+    static void serve(DataInputStream in, OutputStream out, Path scratch) throws IOException {
+        // ワーカー1つにつき作業ファイルは1組だけ使い回す
+        Path src = scratch.resolve("src.py");
+        Path dest = scratch.resolve("dest.py");
+        String header;
+        while ((header = readLine(in)) != null) {
+            String[] sizes = header.trim().split(" ");
+            byte[] srcBytes = new byte[Integer.parseInt(sizes[0])];
+            in.readFully(srcBytes);
+            byte[] destBytes = new byte[Integer.parseInt(sizes[1])];
+            in.readFully(destBytes);
+            Files.write(src, srcBytes);
+            Files.write(dest, destBytes);
+
+            String status = "OK";
+            byte[] body;
+            try {
+                body = diff(src, dest).getBytes(StandardCharsets.UTF_8);
+            } catch (Exception e) {
+                status = "ERR";
+                body = String.valueOf(e).getBytes(StandardCharsets.UTF_8);
+            }
+            out.write((status + " " + body.length + "\n").getBytes(StandardCharsets.UTF_8));
+            out.write(body);
+            out.flush();
+        }
+    }
+
+    static void batch(Path workDir) throws IOException {
+        List<Path> pairDirs;
+        try (var paths = Files.list(workDir)) {
+            pairDirs = paths.filter(Files::isDirectory).sorted().collect(Collectors.toList());
+        }
+        for (Path pairDir : pairDirs) {
+            try {
+                String json = diff(pairDir.resolve("src.py"), pairDir.resolve("dest.py"));
+                Files.write(pairDir.resolve("diff.json"), json.getBytes(StandardCharsets.UTF_8));
+            } catch (Exception e) {
+                Files.write(pairDir.resolve("error.txt"), String.valueOf(e).getBytes(StandardCharsets.UTF_8));
+            }
+        }
+    }
+
+    static String readLine(InputStream in) throws IOException {
+        ByteArrayOutputStream buffer = new ByteArrayOutputStream();
+        int b;
+        while ((b = in.read()) != -1) {
+            if (b == '\n') {
+                return buffer.toString(StandardCharsets.UTF_8);
+            }
+            buffer.write(b);
+        }
+        return buffer.size() == 0 ? null : buffer.toString(StandardCharsets.UTF_8);
+    }
+
+    static Path createScratchDir() throws IOException {
+        // tmpfsがあればメモリ上に作業ファイルを置く
+        Path shm = Paths.get("/dev/shm");
+        if (Files.isDirectory(shm) && Files.isWritable(shm)) {
+            return Files.createTempDirectory(shm, "gumtree-worker");
+        }
+        return Files.createTempDirectory("gumtree-worker");
+    }
+
+    static void deleteRecursively(Path dir) throws IOException {
+        if (!Files.exists(dir)) {
+            return;
+        }
+        try (var paths = Files.walk(dir)) {
+            paths.sorted(java.util.Comparator.reverseOrder()).forEach(p -> p.toFile().delete());
+        }
+    }
+}
@@ -1,19 +1,14 @@
-import os
 import re
-import tokenize
 from enum import Enum
-
-from codetokenizer.tokenizer import TokeNizer
+from functools import lru_cache
 
 from abstractor.loder import IdentifierDict
 from exception import TokenizationError
+from gumtree.pool import GumTreePool
+from gumtree.py_differ import run_tree_diff, run_tree_diff_batch
 from models.diff import DiffHunk
-from models.gumtree import GumTreeResponse
-
-if os.path.isfile("/.dockerenv"):
-    from gumtree.runner_in_docker import run_GumTree
-else:
-    from gumtree.runner import run_GumTree
+from models.gumtree import AbstractionResult, GumTreeResponse
+from utils.token_cache import tokenize_line
 
 
 class Abstraction(Enum):
@@ -22,20 +17,37 @@ class Abstraction(Enum):
     NUMBER = 3
 
 
+# 抽象化の種類ごとのプレースホルダの接頭辞
+PLACEHOLDER_PREFIXES = {Abstraction.VAR: "VAR", Abstraction.STRING: "STRING", Abstraction.NUMBER: "NUBER"}
+# マッチごとにEnumをハッシュしないよう，よく使う接頭辞は取り出しておく
+_VAR_PREFIX = PLACEHOLDER_PREFIXES[Abstraction.VAR]
+_STRING_PREFIX = PLACEHOLDER_PREFIXES[Abstraction.STRING]
+_NUMBER_PREFIX = PLACEHOLDER_PREFIXES[Abstraction.NUMBER]
+
+
+# 抽象化しない一般的なメソッド名の辞書．hunkごとに作り直さずに使い回す
+IDENTIFIERS = IdentifierDict()
+
+# 置換対象になりうるトークン(文字列リテラル・識別子・数値)を切り出す正規表現．hunkごとにコンパイルし直さない
+# 文字列の接頭辞はPythonで有効な組み合わせ(r・u・f・b・fr・rf・br・rb)だけを文字列の一部とする
+_STRING_PATTERN = (
+    r"(?:(?<![A-Za-z0-9_])(?:[rR][bBfF]?|[bBfF][rR]?|[uU]))?"
+    r"(?:'{3}(?:[^\\]|\\.)*?'{3}|\"{3}(?:[^\\]|\\.)*?\"{3}|'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")"
+)
+_TOKEN_PATTERN = re.compile(_STRING_PATTERN + r"|[A-Za-z_][A-Za-z0-9_]*" + r"|[0-9][0-9A-Za-z_.]*")
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+
+
 def tokenize_code(code_line: str) -> list[str]:
     LANGUAGE = "Python"
-    TN = TokeNizer(LANGUAGE)
-    try:
-        return TN.getPureTokens(code_line)
-    except tokenize.TokenError as e:
-        raise TokenizationError(f"Failed to tokenize code: {str(e)}") from e
+    return list(tokenize_line(LANGUAGE, code_line, stage="abstraction"))
 
 
 def replace_name(line: str, old_name: str, new_name: str) -> str:
     """行内の関数名を置換"""
-    # 関数定義のパターン
-    pattern = re.escape(old_name)
-    return re.sub(pattern, f"{new_name}", line)
+    # 他の識別子の一部は置換しないよう，識別子の境界で区切る
+    pattern = rf"(?<![A-Za-z0-9_]){re.escape(old_name)}(?![A-Za-z0-9_])"
+    return re.sub(pattern, new_name, line)
 
 
 def abstract_function_names(diff_hunk: DiffHunk) -> DiffHunk:
@@ -69,100 +81,166 @@ def abstract_function_names(diff_hunk: DiffHunk) -> DiffHunk:
 
 
 def abstract_code(diff_hunk: DiffHunk) -> DiffHunk:
-    name_mapping = {}
-    ID = IdentifierDict()
-    var_count = str_count = num_count = 1
+    return abstract_code_with_response(diff_hunk).diff_hunk
 
+
+def abstract_code_with_response(diff_hunk: DiffHunk) -> AbstractionResult:
+    """抽象化したhunkを，抽象化に使ったGumTreeの入力・出力とあわせて返す"""
     # 関数名だけ先に抽象化
     diff_hunk = abstract_function_names(diff_hunk)
 
     # gumtreeで抽象構文木で分析
-    response: GumTreeResponse = run_GumTree(diff_hunk.condition, diff_hunk.consequent)
+    response: GumTreeResponse = run_tree_diff(diff_hunk.condition, diff_hunk.consequent, stage="abstraction")
 
-    # 抽象化を行う関数
-    def _abstract_name(src_code: list[str], target_token: str, match: Abstraction):
-        nonlocal name_mapping, var_count, str_count, num_count
-        abstracted_code = []
-        for line in src_code:
-            if target_token not in line:
-                abstracted_code.append(line)
-                continue
-            if target_token not in name_mapping:
-                if match == Abstraction.VAR:
-                    name_mapping[target_token] = f"VAR_{var_count}"
-                    var_count += 1
-                elif match == Abstraction.STRING:
-                    name_mapping[target_token] = f"STRING_{str_count}"
-                    str_count += 1
-                elif match == Abstraction.NUMBER:
-                    name_mapping[target_token] = f"NUBER_{num_count}"
-                    num_count += 1
-
-            abstracted_code.append(replace_name(line, target_token, name_mapping[target_token]))
-        return abstracted_code
+    return AbstractionResult(apply_abstraction(diff_hunk, response), diff_hunk, response)
 
-    # 文字列のトークン特定用
-    def _extract_string_literal(src_code: list, start: int, end: int) -> str:
-        joined_code = "\n".join(src_code)
-        return joined_code[start:end]
 
-    for match in response.matches:
-        if "identifier:" in match.src:
-            # matchしたトークンの特定
-            try:
-                src_token = match.src.split(":")[1].split("[")[0].strip()
-                dest_token = match.dest.split(":")[1].split("[")[0].strip()
+def abstract_code_batch(diff_hunks: list[DiffHunk], pool: GumTreePool | None = None) -> list[AbstractionResult | None]:
+    """複数のhunkを抽象化する．GumTreeの起動はまとめて1回で済ませる(poolを指定すればプールのワーカーで並行に処理する)
 
-                # 一般的なメソッド名などではないか判定
-                if ID.should_preserve(src_token):
-                    continue
+    Returns:
+        list[AbstractionResult | None]: 入力順の抽象化結果．GumTreeが失敗したhunkはNone
+    """
+    # 関数名だけ先に抽象化
+    prepared = [abstract_function_names(diff_hunk) for diff_hunk in diff_hunks]
 
-                if "FUNCTION" in src_token or "FUCTION" in dest_token:
-                    continue
+    responses = run_tree_diff_batch(
+        [(diff_hunk.condition, diff_hunk.consequent) for diff_hunk in prepared], stage="abstraction", pool=pool
+    )
 
-                diff_hunk = DiffHunk(
-                    _abstract_name(diff_hunk.condition, src_token, Abstraction.VAR),
-                    _abstract_name(diff_hunk.consequent, dest_token, Abstraction.VAR),
-                )
-            except IndexError:
-                print(match)
-                continue
+    return [
+        None if response is None else AbstractionResult(apply_abstraction(diff_hunk, response), diff_hunk, response)
+        for diff_hunk, response in zip(prepared, responses)
+    ]
 
-        if "integer:" in match.src:
-            try:
-                src_token = match.src.split(":")[1].split("[")[0].strip()
-                dest_token = match.dest.split(":")[1].split("[")[0].strip()
-
-                diff_hunk = DiffHunk(
-                    _abstract_name(diff_hunk.condition, src_token, Abstraction.NUMBER),
-                    _abstract_name(diff_hunk.consequent, dest_token, Abstraction.NUMBER),
-                )
-            except IndexError:
-                print(match)
-                continue
 
-        if match.src.startswith("string ["):
-            try:
-                # 変更前の文字列の位置情報を取得
-                src_pos = match.src.split("[")[1].split("]")[0]
-                src_start, src_end = map(int, src_pos.split(","))
-
-                # 変更後の文字列の位置情報を取得
-                dest_pos = match.dest.split("[")[1].split("]")[0]
-                dest_start, dest_end = map(int, dest_pos.split(","))
-
-                src_token = _extract_string_literal(diff_hunk.condition, src_start, src_end)
-                dest_token = _extract_string_literal(diff_hunk.consequent, dest_start, dest_end)
-
-                diff_hunk = DiffHunk(
-                    _abstract_name(diff_hunk.condition, src_token, Abstraction.STRING),
-                    _abstract_name(diff_hunk.consequent, dest_token, Abstraction.STRING),
-                )
-            except IndexError:
-                print(match)
-                continue
+def apply_abstraction(diff_hunk: DiffHunk, response: GumTreeResponse) -> DiffHunk:
+    """GumTreeのマッチ結果をもとに変数名・文字列・数値を抽象化する
+
+    先に全マッチから「トークン→プレースホルダ」の対応表を作り，各行をトークン単位で1回だけ走査して置換する．
+    識別子は丸ごと一致した場合のみ置換するため，VAR_1がtest_VAR_1のように他の識別子を壊すことはない．
+    """
+    condition_mapping, consequent_mapping = _build_name_mapping(diff_hunk, response)
+    return DiffHunk(
+        _substitute(diff_hunk.condition, condition_mapping),
+        _substitute(diff_hunk.consequent, consequent_mapping),
+    )
+
+
+def _token_label(node: str) -> str:
+    """「identifier: name [0,4]」のようなノード表記からラベルを取り出す"""
+    return node.split(":")[1].split("[")[0].strip()
+
+
+def _token_position(node: str) -> tuple[int, int]:
+    """「string [0,4]」のようなノード表記から位置情報を取り出す"""
+    start, end = map(int, node.split("[")[1].split("]")[0].split(","))
+    return start, end
+
 
-    return diff_hunk
+def _build_name_mapping(diff_hunk: DiffHunk, response: GumTreeResponse) -> tuple[dict[str, str], dict[str, str]]:
+    """変更前・変更後それぞれで置換するトークンとプレースホルダの対応表を作る
+
+    プレースホルダの採番はマッチの順に変更前→変更後の順で行い，同じトークンには同じプレースホルダを振る
+    """
+    name_mapping: dict[str, str] = {}
+    counts = dict.fromkeys(PLACEHOLDER_PREFIXES.values(), 1)
+
+    condition_text = "\n".join(diff_hunk.condition)
+    consequent_text = "\n".join(diff_hunk.consequent)
+    condition_mapping: dict[str, str] = {}
+    consequent_mapping: dict[str, str] = {}
+
+    def _register(side_mapping: dict[str, str], side_text: str, token: str, prefix: str) -> None:
+        if not token or token in side_mapping or token not in side_text:
+            return
+        if token not in name_mapping:
+            name_mapping[token] = f"{prefix}_{counts[prefix]}"
+            counts[prefix] += 1
+        side_mapping[token] = name_mapping[token]
+
+    for match in response.matches:
+        try:
+            if "identifier:" in match.src:
+                src_token = _token_label(match.src)
+                dest_token = _token_label(match.dest)
+
+                # 一般的なメソッド名などではないか判定
+                if IDENTIFIERS.should_preserve(src_token):
+                    continue
+                if "FUNCTION" in src_token or "FUNCTION" in dest_token:
+                    continue
+                prefix = _VAR_PREFIX
+
+            elif "integer:" in match.src:
+                src_token = _token_label(match.src)
+                dest_token = _token_label(match.dest)
+                prefix = _NUMBER_PREFIX
+
+            elif match.src.startswith("string ["):
+                # 文字列は位置情報からGumTreeに渡したコード上のリテラルを特定する
+                src_start, src_end = _token_position(match.src)
+                dest_start, dest_end = _token_position(match.dest)
+                src_token = condition_text[src_start:src_end]
+                dest_token = consequent_text[dest_start:dest_end]
+                prefix = _STRING_PREFIX
+
+            else:
+                continue
+        except (IndexError, ValueError):
+            print(match)
+            continue
+
+        _register(condition_mapping, condition_text, src_token, prefix)
+        _register(consequent_mapping, consequent_text, dest_token, prefix)
+
+    return condition_mapping, consequent_mapping
+
+
+def _substitute(src_code: list[str], mapping: dict[str, str]) -> list[str]:
+    """各行を1回だけ走査し，対応表にあるトークンをプレースホルダに置き換える"""
+    if not mapping:
+        return list(src_code)
+    tokens = tuple(mapping)
+
+    def _replace(m: re.Match) -> str:
+        token = m.group(0)
+        return mapping.get(token, token)
+
+    # 引用符のない行では対応表の識別子・数値だけを探せばよく，トークンが1つならコールバックも要らない
+    replacement = mapping[tokens[0]] if len(tokens) == 1 else _replace
+    abstracted_code = []
+    for line in src_code:
+        if not any(token in line for token in tokens):
+            abstracted_code.append(line)
+        elif "'" in line or '"' in line:
+            abstracted_code.append(_compile_mapping(tokens, True).sub(_replace, line))
+        else:
+            abstracted_code.append(_compile_mapping(tokens, False).sub(replacement, line))
+    return abstracted_code
+
+
+@lru_cache(maxsize=1024)
+def _compile_mapping(tokens: tuple[str, ...], with_strings: bool) -> re.Pattern:
+    """対応表のトークンだけにマッチする正規表現を作る
+
+    with_stringsの場合は文字列リテラルを丸ごと読み飛ばし，他のリテラルの中にある識別子や部分文字列は置換しない．
+    1トークンとして切り出せない文字列(暗黙の連結など)は，リテラルより先に長い順で試す
+    """
+    alternatives = []
+    if with_strings:
+        literals = [token for token in tokens if not _TOKEN_PATTERN.fullmatch(token)]
+        alternatives = [re.escape(token) for token in sorted(literals, key=len, reverse=True)]
+        alternatives.append(_STRING_PATTERN)
+    for token in sorted(tokens, key=len, reverse=True):
+        # 境界の判定はトークンの後ろに置き，正規表現エンジンがトークンの文字列で候補位置を絞れるようにする
+        escaped = re.escape(token)
+        if token[0].isdigit() and _TOKEN_PATTERN.fullmatch(token):
+            # 数値は1.5の1のように，より長い数値の一部にはマッチさせない
+            alternatives.append(rf"{escaped}(?<![A-Za-z0-9_.]{escaped})(?![0-9A-Za-z_.])")
+        elif _IDENTIFIER_PATTERN.fullmatch(token):
+            alternatives.append(rf"{escaped}(?<![A-Za-z0-9_]{escaped})(?![A-Za-z0-9_])")
+    return re.compile("|".join(alternatives))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+"""apply_abstractionの置換処理を，マッチごとに全行を置換し直す従来の方式と比較する
+
+GumTreeの応答はdiff_pythonで作るため，JVMなしで抽象化部分だけを計測できる
+
+$ python src/benchmark/abstraction.py [diffのファイル] [hunk数]
+"""
+
+import re
+import sys
+import time
+from itertools import cycle, islice
+from pathlib import Path
+
+from abstractor.abstraction import IDENTIFIERS, apply_abstraction
+from constants import path
+from gumtree.py_differ import diff_python
+from models.diff import DiffHunk
+from models.gumtree import GumTreeResponse
+from utils.diff_handler import DiffDataHandler
+from utils.file_processor import load_from_json
+
+# パターンの例．diffのファイルを指定しない場合は，この変更前後のトークンから作ったhunkを使う
+SAMPLE_PATH = path.ROOT / "output" / "pattern_sample.json"
+
+
+def pattern_to_hunk(pattern: list[str]) -> DiffHunk:
+    """パターンのトークンを空白で連結し，変更前("="・"-")と変更後("="・"+")の1行ずつのhunkにする"""
+    condition = " ".join(token[1:] for token in pattern if token[0] in "=-")
+    consequent = " ".join(token[1:] for token in pattern if token[0] in "=+")
+    return DiffHunk([condition], [consequent])
+
+
+def load_hunks(diff_path: Path | None, size: int) -> list[DiffHunk]:
+    if diff_path is None:
+        hunks = [pattern_to_hunk(item["pattern"]) for item in load_from_json(SAMPLE_PATH)]
+        return list(islice(cycle(hunks), size))
+    items = islice(DiffDataHandler.stream(diff_path), size)
+    return [DiffHunk(item.diff_hunk.condition, item.diff_hunk.consequent) for item in items]
+
+
+def legacy_apply_abstraction(diff_hunk: DiffHunk, response: GumTreeResponse) -> DiffHunk:
+    """従来の方式: マッチごとに全行を走査して置換する(識別子の境界は考慮しない)"""
+    name_mapping: dict[str, str] = {}
+    counts = {"VAR": 1, "STRING": 1, "NUBER": 1}
+    condition_text = "\n".join(diff_hunk.condition)
+    consequent_text = "\n".join(diff_hunk.consequent)
+
+    def _abstract_name(src_code: list[str], target_token: str, prefix: str) -> list[str]:
+        abstracted_code = []
+        for line in src_code:
+            if target_token not in line:
+                abstracted_code.append(line)
+                continue
+            if target_token not in name_mapping:
+                name_mapping[target_token] = f"{prefix}_{counts[prefix]}"
+                counts[prefix] += 1
+            abstracted_code.append(re.sub(re.escape(target_token), name_mapping[target_token], line))
+        return abstracted_code
+
+    for match in response.matches:
+        if "identifier:" in match.src or "integer:" in match.src:
+            src_token = match.src.split(":")[1].split("[")[0].strip()
+            dest_token = match.dest.split(":")[1].split("[")[0].strip()
+            if IDENTIFIERS.should_preserve(src_token):
+                continue
+            prefix = "VAR" if "identifier:" in match.src else "NUBER"
+        elif match.src.startswith("string ["):
+            src_start, src_end = map(int, match.src.split("[")[1].split("]")[0].split(","))
+            dest_start, dest_end = map(int, match.dest.split("[")[1].split("]")[0].split(","))
+            src_token = condition_text[src_start:src_end]
+            dest_token = consequent_text[dest_start:dest_end]
+            prefix = "STRING"
+        else:
+            continue
+        diff_hunk = DiffHunk(
+            _abstract_name(diff_hunk.condition, src_token, prefix),
+            _abstract_name(diff_hunk.consequent, dest_token, prefix),
+        )
+    return diff_hunk
+
+
+def measure(name: str, run, inputs, repeat: int = 5) -> float:
+    # 他のプロセスの影響を減らすため，repeat回計測して最も速い値をとる
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for diff_hunk, response in inputs:
+            run(diff_hunk, response)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f"{name:>6}: total={elapsed * 1000:8.2f}ms per hunk={elapsed / len(inputs) * 1e6:8.2f}us")
+    return elapsed
+
+
+def main():
+    diff_path = Path(sys.argv[1]) if len(sys.argv) > 1 else None
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    inputs = []
+    for diff_hunk in load_hunks(diff_path, size):
+        # 構文として解析できないhunkは除く
+        response = diff_python(diff_hunk.condition, diff_hunk.consequent)
+        if response is not None:
+            inputs.append((diff_hunk, response))
+    if not inputs:
+        print("no hunks to measure")
+        return
+    print(f"hunks={len(inputs)}")
+
+    measure("legacy", legacy_apply_abstraction, inputs)
+    measure("single", apply_abstraction, inputs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""GumTreeへのコードの渡し方ごとに1hunkあたりのレイテンシを計測する
+
+file: 呼び出しごとに一時ディレクトリを作ってファイルで渡す(従来の方式)
+pipe: 呼び出しごとにワーカーを起動し，標準入力で渡す(ディレクトリを作らない)
+client: 常駐ワーカーに標準入力で渡し続ける
+
+$ python src/benchmark/gumtree_transport.py [diffのJSONファイル] [hunk数]
+"""
+
+import os
+import statistics
+import sys
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Callable
+
+from gumtree.client import GumTreeClient
+from utils.diff_handler import DiffDataHandler
+
+if os.path.isfile("/.dockerenv"):
+    from gumtree.runner_in_docker import run_GumTree
+else:
+    from gumtree.runner import run_GumTree
+
+SAMPLE_PAIRS = [
+    (["ASSERT_EQ(expected, actual);"], ["EXPECT_EQ(expected, actual);"]),
+    (["image_meta={}"], ["image_meta=objects.ImageMeta.from_dict(self.test_image_meta)"]),
+    (["str(uuid.uuid4())"], ["uuidutils.generate_uuid()"]),
+    (["a = dic['key']", "b = 1"], ["a = dic.get('key')", "b = 2"]),
+]
+
+
+def load_pairs(diff_path: Path | None, size: int) -> list[tuple[list[str], list[str]]]:
+    if diff_path is None:
+        return list(islice((SAMPLE_PAIRS * (size // len(SAMPLE_PAIRS) + 1)), size))
+    items = DiffDataHandler.load(diff_path)
+    return [(item.diff_hunk.condition, item.diff_hunk.consequent) for item in items[:size]]
+
+
+def measure(name: str, run: Callable[[list[str], list[str]], object], pairs) -> list[float]:
+    latencies = []
+    for src_code, dest_code in pairs:
+        start = time.perf_counter()
+        run(src_code, dest_code)
+        latencies.append(time.perf_counter() - start)
+
+    ms = [latency * 1000 for latency in latencies]
+    print(
+        f"{name:>6}: mean={statistics.mean(ms):8.2f}ms median={statistics.median(ms):8.2f}ms "
+        f"max={max(ms):8.2f}ms (n={len(ms)})"
+    )
+    return latencies
+
+
+def main():
+    diff_path = Path(sys.argv[1]) if len(sys.argv) > 1 else None
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    pairs = load_pairs(diff_path, size)
+
+    measure("file", lambda src, dest: run_GumTree(src, dest, transport="file"), pairs)
+    measure("pipe", lambda src, dest: run_GumTree(src, dest, transport="pipe"), pairs)
+    with GumTreeClient() as client:
+        # 起動直後の1回はJVMのウォームアップとして計測から除く
+        client.diff(*pairs[0])
+        measure("client", client.diff, pairs)
+
+
+if __name__ == "__main__":
+    main()
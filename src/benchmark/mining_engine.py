@@ -0,0 +1,43 @@
+"""年ごとのnovaの系列で，マイニングのエンジン(PrefixSpan・Spade)の実行時間と結果を比較する
+
+single_processと同じ条件(min_support=10，変更トークンの制約)で実行し，
+結果がパターン・support・順序とも一致するかを確認する．系列のファイルがない年は飛ばす
+
+$ python src/benchmark/mining_engine.py [開始年] [終了年] [min_support]
+"""
+
+import sys
+import time
+
+from constants import path
+from pattern.miner import ENGINES, create_miner
+from utils.file_processor import load_from_json
+
+
+def main():
+    start_year = int(sys.argv[1]) if len(sys.argv) > 1 else 2016
+    end_year = int(sys.argv[2]) if len(sys.argv) > 2 else 2025
+    min_support = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    for year in range(start_year, end_year):
+        sequence_path = path.INTERMEDIATE / "openstack" / f"{year}to{year + 1}" / "nova.json"
+        if not sequence_path.exists():
+            print(f"{year}to{year + 1}: {sequence_path} not found")
+            continue
+        sequences = load_from_json(sequence_path)
+
+        results = {}
+        for engine in ENGINES:
+            miner = create_miner(engine, min_support, year, require_change=True)
+            start = time.perf_counter()
+            results[engine] = miner.fit(sequences)
+            elapsed = time.perf_counter() - start
+            print(f"{year}to{year + 1} {engine:>10}: patterns={len(results[engine])} time={elapsed:8.2f}s")
+
+        patterns = list(results.values())
+        same = all(result == patterns[0] for result in patterns[1:])
+        print(f"{year}to{year + 1}: sequences={len(sequences)} same={same}")
+
+
+if __name__ == "__main__":
+    main()
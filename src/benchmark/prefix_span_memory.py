@@ -0,0 +1,108 @@
+"""PrefixSpanの最大RSS(ピークメモリ)と実行時間を，接尾辞をコピーする従来の実装と比較する
+
+それぞれの実装を別プロセスで実行し，子プロセスのru_maxrssを計測する
+
+$ python src/benchmark/prefix_span_memory.py [系列のJSONファイル] [min_support]
+"""
+
+import random
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from constants import path
+from pattern.prefix_span import PrefixSpan
+from utils.file_processor import dump_to_json, load_from_json
+
+TOKENS = [sign + token for sign in "-+=" for token in ["VAR_1", "VAR_2", "(", ")", ".", "get", "[", "]", "STRING_1"]]
+
+
+class SliceProjectionPrefixSpan:
+    """従来の実装: 投影DBごとに接尾辞のタプルをコピーする"""
+
+    def __init__(self, min_support, start_year):
+        self.min_support = min_support
+        self.start_year = start_year
+        self.frequent_patterns = []
+
+    def fit(self, sequences):
+        self.sequences = [tuple(seq) for seq in sequences]
+        self.prefix_span([], self.sequences)
+        return self.frequent_patterns
+
+    def prefix_span(self, prefix, projected_db):
+        for item, support in self.get_frequent_items(projected_db):
+            new_prefix = prefix + [item]
+            self.frequent_patterns.append((new_prefix, support))
+            new_projected_db = self.build_projected_db(projected_db, item)
+            if new_projected_db:
+                self.prefix_span(new_prefix, new_projected_db)
+
+    def get_frequent_items(self, sequences):
+        items = {}
+        too_long_sequences = []
+        for sequence in sequences:
+            if not sequence:
+                continue
+            if len(sequence) > 15:
+                too_long_sequences.append(sequence)
+                continue
+            for item in set(sequence):
+                items[item] = items.get(item, 0) + 1
+
+        dump_to_json(too_long_sequences, path.INTERMEDIATE / f"{self.start_year}_too_long_sequences.json")
+        return sorted(
+            [(item, support) for item, support in items.items() if support >= self.min_support],
+            key=lambda x: (-x[1], x[0]),
+        )
+
+    def build_projected_db(self, projected_db, item):
+        new_projected_db = []
+        for sequence in projected_db:
+            for i, current_item in enumerate(sequence):
+                if current_item == item and i + 1 < len(sequence):
+                    new_projected_db.append(sequence[i + 1 :])
+                    break
+        return new_projected_db
+
+
+def load_sequences(sequence_path: str) -> list[list[str]]:
+    if sequence_path != "-":
+        return load_from_json(Path(sequence_path))
+    # 同じ変更が繰り返し現れる実データに近づけるため，少数のテンプレートに雑音を混ぜて系列を作る
+    rng = random.Random(0)
+    templates = [[rng.choice(TOKENS) for _ in range(12)] for _ in range(20)]
+    sequences = []
+    for _ in range(50000):
+        sequence = [token for token in rng.choice(templates) if rng.random() < 0.9]
+        sequence.insert(rng.randint(0, len(sequence)), rng.choice(TOKENS))
+        sequences.append(sequence[:15])
+    return sequences
+
+
+def run_single(engine: str, sequence_path: str, min_support: int) -> None:
+    """子プロセス側: 1つの実装を実行して結果を1行で出力する"""
+    sequences = load_sequences(sequence_path)
+    miner_class = PrefixSpan if engine == "pseudo" else SliceProjectionPrefixSpan
+    start = time.perf_counter()
+    patterns = miner_class(min_support, "benchmark").fit(sequences)
+    elapsed = time.perf_counter() - start
+    # Linuxではru_maxrssの単位はKiB
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{engine:>6}: patterns={len(patterns)} time={elapsed:8.2f}s max_rss={max_rss / 1024:8.1f}MiB")
+
+
+def main():
+    sequence_path = sys.argv[1] if len(sys.argv) > 1 else "-"
+    min_support = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for engine in ["slice", "pseudo"]:
+        subprocess.run([sys.executable, __file__, "--single", engine, sequence_path, str(min_support)], check=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--single":
+        run_single(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main()
@@ -0,0 +1,74 @@
+"""rq1.term.remove_subset_patternsの実行時間を，残した全てのパターンと比べる従来の実装と比較する
+
+同じ変更から多数の部分パターンが得られる実データに近づけるため，少数のテンプレートの部分列としてパターンを作る．
+従来の実装はパターン数の2乗で遅くなるため，baseline_limit以下のパターン数でだけ実行して結果の一致を確認する．
+候補をシャードに分けてn_jobsのプロセスで判定するremove_subset_patterns_shardedもあわせて計測する
+
+$ python src/benchmark/subset_removal.py [パターン数(カンマ区切り)] [baseline_limit] [n_jobs]
+"""
+
+import random
+import sys
+import time
+
+from models.pattern import PatternWithSupport
+from pattern.vocabulary import Vocabulary
+from rq1.term import is_subsequence, remove_subset_patterns, remove_subset_patterns_sharded
+
+TOKENS = [sign + f"VAR_{i}" for sign in "-+=" for i in range(300)] + [
+    sign + token for sign in "-+=" for token in ["(", ")", ".", "get", "[", "]", "STRING_1", "NUMBER_1", ":"]
+]
+
+
+def remove_subset_patterns_by_scan(patterns: list[PatternWithSupport]) -> list[PatternWithSupport]:
+    """従来の実装: 候補ごとに残した全てのパターンと部分列の判定をする"""
+    patterns.sort(key=lambda x: sum(len(token) for token in x.pattern), reverse=True)
+    vocabulary = Vocabulary.from_sequences(pattern.pattern for pattern in patterns)
+
+    unique_patterns = []
+    unique_encoded: list[tuple[int, ...]] = []
+    for pattern in patterns:
+        encoded = tuple(vocabulary.encode(pattern.pattern))
+        if not any(is_subsequence(encoded, other) for other in unique_encoded):
+            unique_patterns.append(PatternWithSupport(pattern.pattern, pattern.support))
+            unique_encoded.append(encoded)
+    return unique_patterns
+
+
+def generate_patterns(n_patterns: int) -> list[PatternWithSupport]:
+    rng = random.Random(0)
+    # 記号のトークンほど多くのパターンに現れるよう，重みを偏らせる
+    weights = [1 / (rank + 1) for rank in range(len(TOKENS))]
+    tokens = TOKENS[-27:] + TOKENS[:-27]
+    templates = [rng.choices(tokens, weights, k=rng.randint(6, 15)) for _ in range(max(1, n_patterns // 50))]
+    patterns = []
+    for _ in range(n_patterns):
+        pattern = [token for token in rng.choice(templates) if rng.random() < 0.7]
+        patterns.append(PatternWithSupport(pattern or [rng.choice(tokens)], rng.randint(10, 1000)))
+    return patterns
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1].split(",")] if len(sys.argv) > 1 else [100000, 1000000]
+    baseline_limit = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    n_jobs = int(sys.argv[3]) if len(sys.argv) > 3 else -1
+    for n_patterns in sizes:
+        patterns = generate_patterns(n_patterns)
+        start = time.perf_counter()
+        indexed = remove_subset_patterns(list(patterns))
+        elapsed = time.perf_counter() - start
+        print(f"{n_patterns:>8} patterns: indexed kept={len(indexed)} time={elapsed:8.2f}s")
+        start = time.perf_counter()
+        sharded = remove_subset_patterns_sharded(list(patterns), n_jobs=n_jobs)
+        elapsed = time.perf_counter() - start
+        print(f"{n_patterns:>8} patterns: sharded kept={len(sharded)} time={elapsed:8.2f}s same={indexed == sharded}")
+        if n_patterns > baseline_limit:
+            continue
+        start = time.perf_counter()
+        scanned = remove_subset_patterns_by_scan(list(patterns))
+        elapsed = time.perf_counter() - start
+        print(f"{n_patterns:>8} patterns: scan    kept={len(scanned)} time={elapsed:8.2f}s same={indexed == scanned}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""GumTreeの実行に関する定数
+"""
+
+IMAGE = "tomoya0318/gumtree"
+VERSION = "4.0.0-beta2"
+# GumTree本体と常駐ワーカー(gumtree-worker.jar)を含むクラスパス
+CLASSPATH = "/opt/gumtree/lib/*"
+WORKER_CLASS = "DiffWorker"
@@ -15,7 +15,7 @@ from constants import path
 from diff.file_diff import get_diff
 from models.diff import DiffHunk
 from models.gerrit import ChangeData, DiffData, MetaData, Revision, FileData, MetaDataWithFile
-from utils.diff_handler import DiffDataHandler
+from utils.diff_handler import DIFF_SUFFIX, DiffDataHandler
 from utils.file_processor import base64_encode, dump_to_json, load_from_json
 from utils.lang_identifiyer import identify_lang_from_file
 
@@ -338,7 +338,8 @@ class OpenStackAnalyzer:
         if not output_path.parent.exists():
             output_path.parent.mkdir()
 
-        Dh.dump_to_json(diff_data, output_path)
+        # JSON Linesなので，既存の内容を読み直さずに末尾へ追記する
+        Dh.append(diff_data, output_path)
 
     def _create_save_path(self, owner: str, repo: str) -> Path:
         base_path = path.RESOURCE / owner
@@ -356,7 +357,7 @@ class OpenStackAnalyzer:
             year_part = ""
 
         # パスを構築
-        return base_path / year_part / f"{repo}.json"
+        return base_path / year_part / f"{repo}{DIFF_SUFFIX}"
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import orjson
+
+from constants import path
+from constants.gumtree import VERSION
+from gumtree.client import run_GumTree, run_GumTree_batch
+from gumtree.pool import GumTreePool
+from gumtree.protocol import parse_response
+from models.gumtree import GumTreeResponse
+
+DEFAULT_CACHE_PATH = path.INTERMEDIATE / "gumtree_cache.sqlite3"
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+class GumTreeCache:
+    """GumTreeの結果をソースコードのハッシュをキーにSQLiteへ保存するキャッシュ
+
+    キーは変更前後のコードとGumTreeのバージョンから計算するため，同じhunkは年度や再実行をまたいで再利用される．
+    保存量がmax_bytesを超えると，最後に参照された時刻が古いものから削除する．
+
+    ヒットしたキーの参照時刻とヒット数・ミス数・GumTreeを使わずに済んだ数(gumtree.py_differの高速経路)はメモリに貯め，FLUSH_INTERVAL回の参照ごと・FLUSH_SECONDS秒ごと・
+    close時に1つのトランザクションでまとめて書き込む(ヒットのたびに全ワーカーで共有する書き込みロックを取らない)．
+    """
+
+    EVICT_INTERVAL = 1000
+    FLUSH_INTERVAL = 1000
+    FLUSH_SECONDS = 5.0
+
+    def __init__(self, db_path: Path = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+        self._puts = 0
+        # まだDBに書き込んでいない参照時刻と，ステージごとの[ヒット数, ミス数, 高速経路の数]
+        self._accessed: dict[str, float] = {}
+        self._pending: dict[str, list[int]] = {}
+        self._lookups = 0
+        self._flushed_at = time.monotonic()
+
+        os.makedirs(db_path.parent, exist_ok=True)
+        # joblibの各ワーカーから同時に書き込まれるためWALモードで開く
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats (stage TEXT PRIMARY KEY, "
+            "hits INTEGER NOT NULL, misses INTEGER NOT NULL, fast_path INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(stats)")]
+        if "fast_path" not in columns:
+            # 高速経路の数を記録する前に作られたキャッシュ
+            self.conn.execute("ALTER TABLE stats ADD COLUMN fast_path INTEGER NOT NULL DEFAULT 0")
+
+    @staticmethod
+    def make_key(src_code: list[str], dest_code: list[str]) -> str:
+        joined = "\0".join([VERSION, "\n".join(src_code), "\n".join(dest_code)])
+        return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, stage: str = "default") -> GumTreeResponse | None:
+        row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        hit = row is not None
+        if hit:
+            self.hits[stage] += 1
+            self._accessed[key] = time.time()
+        else:
+            self.misses[stage] += 1
+        self._record(stage, hit)
+        return parse_response(zlib.decompress(row[0])) if hit else None
+
+    def put(self, key: str, response: GumTreeResponse) -> None:
+        value = zlib.compress(orjson.dumps(response))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time()),
+        )
+        self._puts += 1
+        if self._puts % self.EVICT_INTERVAL == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        """保存量がmax_bytesの9割に収まるまで古いものから削除し，削除件数を返す"""
+        # 参照時刻の順に削除するため，貯めている参照時刻を先に書き込む
+        self.flush()
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+
+        target = total - int(self.max_bytes * 0.9)
+        removed = freed = 0
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if freed >= target:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            freed += size
+            removed += 1
+        return removed
+
+    def _record(self, stage: str, hit: bool) -> None:
+        counts = self._pending.setdefault(stage, [0, 0, 0])
+        counts[0 if hit else 1] += 1
+        self._lookups += 1
+        self._flush_if_due()
+
+    def record_fast_path(self, stage: str, count: int = 1) -> None:
+        """GumTreeを呼ばずにPythonで差分をとれたhunkの数を積算する"""
+        if count:
+            self._pending.setdefault(stage, [0, 0, 0])[2] += count
+            self._flush_if_due()
+
+    def _flush_if_due(self) -> None:
+        if self._lookups >= self.FLUSH_INTERVAL or time.monotonic() - self._flushed_at >= self.FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self) -> None:
+        """貯めた参照時刻とヒット数・ミス数を1つのトランザクションで書き込む
+
+        ワーカープロセスをまたいで集計できるよう，ヒット数・ミス数はDBに積算する
+        """
+        self._lookups = 0
+        self._flushed_at = time.monotonic()
+        if not self._accessed and not self._pending:
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._accessed.items()],
+            )
+            self.conn.executemany(
+                "INSERT INTO stats (stage, hits, misses, fast_path) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(stage) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses, "
+                "fast_path = fast_path + excluded.fast_path",
+                [(stage, *counts) for stage, counts in self._pending.items()],
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self._accessed.clear()
+        self._pending.clear()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """全プロセス分のステージごとのヒット数・ミス数・高速経路の数を返す(他のプロセスがまだ書き込んでいない分は含まない)"""
+        self.flush()
+        return {
+            stage: {"hits": hits, "misses": misses, "fast_path": fast_path}
+            for stage, hits, misses, fast_path in self.conn.execute(
+                "SELECT stage, hits, misses, fast_path FROM stats ORDER BY stage"
+            )
+        }
+
+    def reset_stats(self) -> None:
+        self.hits.clear()
+        self.misses.clear()
+        self._pending.clear()
+        self.conn.execute("DELETE FROM stats")
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+
+_cache: GumTreeCache | None = None
+_cache_pid: int | None = None
+
+
+def get_cache() -> GumTreeCache:
+    """プロセスごとに1つの接続を使い回す"""
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = GumTreeCache()
+        _cache_pid = os.getpid()
+    return _cache
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    """ワーカーの終了時に，貯めている参照時刻とヒット数を書き込む
+
+    forkで親の_cacheを引き継いだプロセスでは，親の分を二重に書き込まないよう何もしない
+    """
+    if _cache is not None and _cache_pid == os.getpid():
+        _cache.flush()
+
+
+def cached_run_GumTree(src_code: list, dest_code: list, stage: str = "default") -> GumTreeResponse:
+    """キャッシュを確認してからrun_GumTreeを呼び出す"""
+    cache = get_cache()
+    key = cache.make_key(src_code, dest_code)
+    response = cache.get(key, stage)
+    if response is None:
+        response = run_GumTree(src_code, dest_code)
+        cache.put(key, response)
+    return response
+
+
+def cached_run_GumTree_batch(
+    pairs: list[tuple[list[str], list[str]]], stage: str = "default", pool: GumTreePool | None = None
+) -> list[GumTreeResponse | None]:
+    """キャッシュに無いペアだけをまとめてGumTreeへ渡す
+
+    poolを指定した場合はプールの常駐ワーカーで並行に，指定しなければrun_GumTree_batchの1回の起動で処理する
+    """
+    cache = get_cache()
+    keys = [cache.make_key(src_code, dest_code) for src_code, dest_code in pairs]
+    responses = [cache.get(key, stage) for key in keys]
+
+    missing = [index for index, response in enumerate(responses) if response is None]
+    missing_pairs = [pairs[index] for index in missing]
+    computed = run_GumTree_batch(missing_pairs) if pool is None else pool.run(missing_pairs)
+    for index, response in zip(missing, computed):
+        responses[index] = response
+        if response is not None:
+            cache.put(keys[index], response)
+    return responses
+
+
+if __name__ == "__main__":
+    for stage, counts in get_cache().stats().items():
+        total = counts["hits"] + counts["misses"]
+        rate = counts["hits"] / total if total else 0.0
+        print(
+            f"{stage}: hits={counts['hits']} misses={counts['misses']} hit_rate={rate:.1%} "
+            f"fast_path={counts['fast_path']}"
+        )
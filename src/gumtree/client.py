@@ -0,0 +1,103 @@
+import atexit
+import os
+import subprocess
+
+from constants.gumtree import CLASSPATH, IMAGE, WORKER_CLASS
+from gumtree.protocol import encode_request, read_response
+from gumtree.runner import docker_run
+from models.gumtree import GumTreeResponse
+
+# 常駐ワーカーを使わずにまとめて処理する場合のバッチAPI
+if os.path.isfile("/.dockerenv"):
+    from gumtree.runner_in_docker import run_GumTree_batch  # noqa: F401
+else:
+    from gumtree.runner import run_GumTree_batch  # noqa: F401
+
+
+def worker_command(container: str | None = None) -> list[str]:
+    """常駐ワーカーを起動するコマンドを返す．containerはdockerの外で起動する場合のコンテナ名"""
+    command = ["java", "-cp", CLASSPATH, WORKER_CLASS, "serve"]
+    if os.path.isfile("/.dockerenv"):
+        return command
+    # dockerコンテナ内でワーカーを常駐させる用
+    return [*docker_run(container, interactive=True), IMAGE, *command]
+
+
+class GumTreeClient:
+    """常駐させたGumTreeワーカーと標準入出力でやり取りするクライアント
+
+    JVMとコンテナの起動は最初の1回だけで，以降は同じプロセスに(src, dest)のペアを流し込む
+    """
+
+    def __init__(self, command: list[str] | None = None):
+        self.command = command or worker_command()
+        self.process: subprocess.Popen | None = None
+
+    def start(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            return
+        try:
+            self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError as e:
+            raise OSError(f"Failed to start GumTree worker: {str(e)}")
+
+    def diff(self, src_code: list[str], dest_code: list[str]) -> GumTreeResponse:
+        self.start()
+        assert self.process is not None and self.process.stdin and self.process.stdout
+
+        try:
+            self.process.stdin.write(encode_request(src_code, dest_code))
+            self.process.stdin.flush()
+            return read_response(self.process.stdout)
+        except (BrokenPipeError, EOFError) as e:
+            # ワーカーが落ちた場合は次回の呼び出しで再起動させる
+            self.close()
+            raise subprocess.SubprocessError(f"GumTree worker terminated: {str(e)}")
+        except RuntimeError as e:
+            raise subprocess.SubprocessError(str(e))
+
+    def close(self) -> None:
+        if self.process is None:
+            return
+        if self.process.stdin:
+            self.process.stdin.close()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process = None
+
+    def __enter__(self) -> "GumTreeClient":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+_client: GumTreeClient | None = None
+_client_pid: int | None = None
+
+
+def _get_client() -> GumTreeClient:
+    """プロセスごとに1つのクライアントを使い回す(joblibのワーカーごとにJVMが1つ)"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = GumTreeClient()
+        _client_pid = os.getpid()
+        atexit.register(_client.close)
+    return _client
+
+
+def run_GumTree(src_code: list, dest_code: list) -> GumTreeResponse:
+    """runner.run_GumTreeと同じ結果を常駐ワーカー経由で返す"""
+    return _get_client().diff(src_code, dest_code)
+
+
+if __name__ == "__main__":
+    condition = ["ASSERT_EQ(expected, actual);", "ASSERT_EQ(expected2, actual2);", "ASSERT_EQ(expected3, actual3);"]
+
+    consequent = ["EXPECT_EQ(expected, actual);", "EXPECT_EQ(expected2, actual2);", "EXPECT_EQ(expected3, actual3);"]
+
+    with GumTreeClient() as client:
+        print(client.diff(condition, consequent))
@@ -1,24 +1,17 @@
-from models.gumtree import Action, UpdateChange
+from models.gumtree import AbstractionResult, Action, UpdateChange
 
 
-def extract_update_code_changes(
-    condition: list[str], consequent: list[str], actions: list[Action]
-) -> list[UpdateChange]:
-    """update-nodeのアクションに対応する行全体を変更前後のコードから抽出する
+def find_update_lines(condition: list[str], actions: list[Action]) -> list[int]:
+    """update-nodeのアクションが指す変更前コードの行番号を返す
 
     Args:
-        condition (str): 変更前のコード全体
-        consequent (str): 変更後のコード全体
-        actions (list[dict]): GumTreeのアクション情報
+        condition (list[str]): GumTreeに渡した変更前のコード
+        actions (list[Action]): GumTreeのアクション情報
 
     Returns:
-        list[dict]: 変更情報のリスト。各要素は以下の形式：
-            {
-                "before": str,  # 変更前のコード行
-                "after": str,   # 変更後のコード行
-            }
+        list[int]: update-nodeごとの行番号(同じ行に複数のアクションがあれば重複する)
     """
-    update_changes = []
+    line_indices = []
 
     # 各行の開始位置を計算
     condition_positions = []
@@ -40,11 +33,47 @@ def extract_update_code_changes(
                     condition_positions[i + 1] if i + 1 < len(condition_positions) else len("".join(condition))
                 )
                 if line_start <= start < next_line_start:
-                    before_line = condition[i]
-                    after_line = consequent[i]
-                    update_changes.append(UpdateChange(before=before_line, after=after_line))
+                    line_indices.append(i)
                     break
 
+    return line_indices
+
+
+def extract_update_code_changes(
+    condition: list[str], consequent: list[str], actions: list[Action]
+) -> list[UpdateChange]:
+    """update-nodeのアクションに対応する行全体を変更前後のコードから抽出する
+
+    Args:
+        condition (str): 変更前のコード全体
+        consequent (str): 変更後のコード全体
+        actions (list[dict]): GumTreeのアクション情報
+
+    Returns:
+        list[dict]: 変更情報のリスト。各要素は以下の形式：
+            {
+                "before": str,  # 変更前のコード行
+                "after": str,   # 変更後のコード行
+            }
+    """
+    return [UpdateChange(before=condition[i], after=consequent[i]) for i in find_update_lines(condition, actions)]
+
+
+def derive_update_code_changes(result: AbstractionResult) -> list[UpdateChange]:
+    """抽象化時のGumTreeの結果から，抽象化後のコードの変更行を導出する
+
+    抽象化は行単位の置換なので，抽象化前のupdate-nodeが指す行は抽象化後も同じ行番号にある．
+    抽象化後のコードに対してGumTreeをもう一度実行する代わりに使う．
+    抽象化によって変更前後が同じになった行(変数名の変更のみなど)は含めない．
+    """
+    condition = result.diff_hunk.condition
+    consequent = result.diff_hunk.consequent
+
+    update_changes = []
+    for i in find_update_lines(result.source.condition, result.response.actions):
+        if i >= len(consequent) or condition[i] == consequent[i]:
+            continue
+        update_changes.append(UpdateChange(before=condition[i], after=consequent[i]))
     return update_changes
 
 
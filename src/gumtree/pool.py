@@ -0,0 +1,199 @@
+import asyncio
+import os
+import subprocess
+
+from gumtree.client import worker_command
+from gumtree.runner import container_name
+from gumtree.protocol import decode_body, encode_request, parse_header
+from models.gumtree import GumTreeResponse
+
+
+def _worker_command() -> tuple[list[str], str | None]:
+    """(ワーカーを起動するコマンド, コンテナ名)を返す
+
+    dockerの外では起動のたびにコンテナへ名前をつけ，停止するときにdocker killで止められるようにする
+    """
+    if os.path.isfile("/.dockerenv"):
+        return worker_command(), None
+    container = container_name()
+    return worker_command(container), container
+
+
+class _AsyncWorker:
+    """常駐ワーカー1つ分のasyncio用ラッパー．commandを指定しなければ_worker_commandで起動する"""
+
+    def __init__(self, command: list[str] | None = None):
+        self.command = command
+        self.container: str | None = None
+        self.process: asyncio.subprocess.Process | None = None
+
+    async def start(self) -> None:
+        if self.process is not None and self.process.returncode is None:
+            return
+        if self.command is None:
+            command, self.container = _worker_command()
+        else:
+            command, self.container = self.command, None
+        self.process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+
+    async def diff(self, src_code: list[str], dest_code: list[str]) -> GumTreeResponse:
+        await self.start()
+        assert self.process is not None and self.process.stdin and self.process.stdout
+
+        self.process.stdin.write(encode_request(src_code, dest_code))
+        await self.process.stdin.drain()
+        status, size = parse_header(await self.process.stdout.readline())
+        return decode_body(status, await self.process.stdout.readexactly(size))
+
+    async def kill(self) -> None:
+        """応答しないワーカーを止める．次のdiffで再起動される"""
+        if self.process is None:
+            return
+        if self.container is not None:
+            # docker runのクライアントだけを止めるとコンテナ内のJVMが残るため，コンテナごと止める
+            docker_kill = await asyncio.create_subprocess_exec(
+                "docker", "kill", self.container, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+            )
+            await docker_kill.wait()
+        if self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+        self.process = None
+
+    async def close(self) -> None:
+        if self.process is None:
+            return
+        if self.process.stdin:
+            self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            await self.kill()
+        self.process = None
+
+
+class GumTreePool:
+    """GumTreeワーカーを上限つきで並行実行するプール
+
+    - concurrency: 同時に動かすJVMの数(メモリ使用量の上限)
+    - timeout: 1ペアあたりの制限時間．超えたワーカーは停止して再起動する
+    - retries / backoff: ワーカーの異常終了・タイムアウト時の再試行回数と待ち時間(指数的に延ばす)
+    - max_pending: diff_manyで同時に抱える未完了タスクの上限(バックプレッシャー)
+
+    非同期APIはdiff/diff_many，同期APIはrunを使う．
+    withで開いた場合はrunの呼び出しをまたいでワーカーを使い回す(withの外のrunは呼び出しごとに起動・停止する)
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        timeout: float = 30.0,
+        retries: int = 2,
+        backoff: float = 0.5,
+        max_pending: int | None = None,
+        command: list[str] | None = None,
+    ):
+        if concurrency < 1:
+            raise ValueError("concurrency must be a positive integer")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_pending = max_pending or concurrency * 4
+        # Noneなら，ワーカーごとに_worker_commandで起動する
+        self.command = command
+        self._workers: list[_AsyncWorker] = []
+        self._idle: asyncio.Queue[_AsyncWorker] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def __aenter__(self) -> "GumTreePool":
+        self._workers = [_AsyncWorker(self.command) for _ in range(self.concurrency)]
+        self._idle = asyncio.Queue()
+        for worker in self._workers:
+            self._idle.put_nowait(worker)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await asyncio.gather(*(worker.close() for worker in self._workers))
+        self._workers = []
+        self._idle = None
+
+    async def diff(self, src_code: list[str], dest_code: list[str]) -> GumTreeResponse:
+        if self._idle is None:
+            raise RuntimeError("GumTreePool must be used with 'async with'")
+
+        last_error: Exception | None = None
+        for attempt in range(self.retries + 1):
+            # 空いているワーカーを待つことで同時実行数を制限する
+            worker = await self._idle.get()
+            try:
+                return await asyncio.wait_for(worker.diff(src_code, dest_code), self.timeout)
+            except RuntimeError as e:
+                # GumTreeが入力を処理できなかった場合は再試行しても結果は変わらない
+                raise subprocess.SubprocessError(str(e))
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, EOFError, OSError) as e:
+                last_error = e
+                await worker.kill()
+            finally:
+                self._idle.put_nowait(worker)
+            await asyncio.sleep(self.backoff * 2**attempt)
+
+        raise subprocess.SubprocessError(f"GumTree failed after {self.retries + 1} attempts: {last_error!r}")
+
+    async def diff_many(self, pairs: list[tuple[list[str], list[str]]]) -> list[GumTreeResponse | None]:
+        """複数のペアを並行に処理する．失敗したペアはNoneとなる"""
+        results: list[GumTreeResponse | None] = [None] * len(pairs)
+        pending = asyncio.Semaphore(self.max_pending)
+
+        async def _run(index: int, src_code: list[str], dest_code: list[str]) -> None:
+            try:
+                results[index] = await self.diff(src_code, dest_code)
+            except subprocess.SubprocessError as e:
+                print(f"GumTree failed on pair {index}: {e}")
+            finally:
+                pending.release()
+
+        tasks = []
+        for index, (src_code, dest_code) in enumerate(pairs):
+            # 未完了のタスクが上限に達したら，空きが出るまで新しいタスクを作らない
+            await pending.acquire()
+            tasks.append(asyncio.create_task(_run(index, src_code, dest_code)))
+        await asyncio.gather(*tasks)
+        return results
+
+    def __enter__(self) -> "GumTreePool":
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self.__aenter__())
+        return self
+
+    def __exit__(self, *exc) -> None:
+        assert self._loop is not None
+        try:
+            self._loop.run_until_complete(self.__aexit__(*exc))
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    def run(self, pairs: list[tuple[list[str], list[str]]]) -> list[GumTreeResponse | None]:
+        """diff_manyの同期版"""
+        if self._loop is not None:
+            return self._loop.run_until_complete(self.diff_many(pairs))
+
+        async def _main() -> list[GumTreeResponse | None]:
+            async with self:
+                return await self.diff_many(pairs)
+
+        return asyncio.run(_main())
+
+
+if __name__ == "__main__":
+    condition = ["ASSERT_EQ(expected, actual);", "ASSERT_EQ(expected2, actual2);", "ASSERT_EQ(expected3, actual3);"]
+
+    consequent = ["EXPECT_EQ(expected, actual);", "EXPECT_EQ(expected2, actual2);", "EXPECT_EQ(expected3, actual3);"]
+
+    print(GumTreePool(concurrency=2).run([(condition, consequent)] * 4))
@@ -0,0 +1,82 @@
+import json
+import os
+from pathlib import Path
+from typing import IO
+
+from models.gumtree import Action, GumTreeResponse, Match
+
+
+def parse_response(raw: str | bytes) -> GumTreeResponse:
+    """GumTreeのJSON出力をGumTreeResponseに変換する"""
+    response_dict = json.loads(raw)
+    return GumTreeResponse(
+        matches=[Match(**match) for match in response_dict.get("matches", [])],
+        actions=[Action(**action) for action in response_dict.get("actions", [])],
+    )
+
+
+def encode_request(src_code: list[str], dest_code: list[str]) -> bytes:
+    """ワーカーへ送る1件分のリクエストを作成する
+
+    形式: "srcのバイト数 destのバイト数\\n" + src + dest
+    """
+    src = "\n".join(src_code).encode("utf-8")
+    dest = "\n".join(dest_code).encode("utf-8")
+    return f"{len(src)} {len(dest)}\n".encode("utf-8") + src + dest
+
+
+def read_response(stream: IO[bytes]) -> GumTreeResponse:
+    """ワーカーから1件分のレスポンスを読み込む
+
+    形式: "OK バイト数\\n" + JSON (失敗時は "ERR バイト数\\n" + エラーメッセージ)
+
+    Raises:
+        EOFError: ワーカーが終了していた場合
+        RuntimeError: ワーカー側で差分計算に失敗した場合
+    """
+    status, size = parse_header(stream.readline())
+    return decode_body(status, stream.read(size))
+
+
+def parse_header(header: bytes) -> tuple[str, int]:
+    """レスポンスのヘッダ行を(ステータス, 本体のバイト数)に分解する"""
+    if not header:
+        raise EOFError("GumTree worker closed the stream")
+    status, size = header.decode("utf-8").split()
+    return status, int(size)
+
+
+def decode_body(status: str, body: bytes) -> GumTreeResponse:
+    if status != "OK":
+        raise RuntimeError(f"GumTree worker failed: {body.decode('utf-8')}")
+    return parse_response(body)
+
+
+def write_batch(work_dir: Path, pairs: list[tuple[list[str], list[str]]]) -> None:
+    """バッチ処理用に各ペアを work_dir/{連番}/src.py, dest.py へ書き出す"""
+    for index, (src_code, dest_code) in enumerate(pairs):
+        pair_dir = work_dir / f"{index:08d}"
+        os.makedirs(pair_dir, exist_ok=True)
+        with open(pair_dir / "src.py", "w", encoding="utf-8") as f:
+            f.write("\n".join(src_code))
+        with open(pair_dir / "dest.py", "w", encoding="utf-8") as f:
+            f.write("\n".join(dest_code))
+
+
+def read_batch(work_dir: Path, size: int) -> list[GumTreeResponse | None]:
+    """ワーカーのbatchモードが書き出したdiff.jsonを入力順に読み込む
+
+    差分計算に失敗したペアはNoneとなる
+    """
+    responses: list[GumTreeResponse | None] = []
+    for index in range(size):
+        pair_dir = work_dir / f"{index:08d}"
+        result_path = pair_dir / "diff.json"
+        if not result_path.exists():
+            error_path = pair_dir / "error.txt"
+            message = error_path.read_text(encoding="utf-8") if error_path.exists() else "no output"
+            print(f"GumTree failed on pair {index}: {message}")
+            responses.append(None)
+            continue
+        responses.append(parse_response(result_path.read_bytes()))
+    return responses
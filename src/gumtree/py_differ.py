@@ -0,0 +1,164 @@
+import difflib
+import io
+import keyword
+import tokenize
+from dataclasses import dataclass
+
+from gumtree.cache import cached_run_GumTree, cached_run_GumTree_batch, get_cache
+from gumtree.pool import GumTreePool
+from models.gumtree import Action, GumTreeResponse, Match
+
+# これ以下の行数のhunkはJVMを使わずに差分をとる
+MAX_FAST_PATH_LINES = 5
+
+# GumTreeのラベル付きリーフに相当するトークンの種類
+LABELED_KINDS = ("identifier", "integer", "float", "string")
+
+@dataclass
+class _Token:
+    kind: str
+    text: str
+    start: int
+    end: int
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return self.kind, self.text
+
+    def node(self) -> str:
+        """GumTree(tree-sitter)のJSON出力と同じ形式のノード表記"""
+        if self.kind == "string":
+            return f"string [{self.start},{self.end}]"
+        return f"{self.kind}: {self.text} [{self.start},{self.end}]"
+
+
+def _number_kind(text: str) -> str:
+    lowered = text.lower()
+    if lowered.startswith(("0x", "0o", "0b")):
+        return "integer"
+    if any(c in lowered for c in ".ej"):
+        return "float"
+    return "integer"
+
+
+def _tokenize(code: list[str]) -> list[_Token] | None:
+    """コードをトークン化し，GumTreeと同じ文字オフセットを付与する．扱えない入力ならNone"""
+    joined_code = "\n".join(code)
+    line_starts = [0]
+    for line in code:
+        line_starts.append(line_starts[-1] + len(line) + 1)
+
+    tokens: list[_Token] = []
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(joined_code).readline):
+            if tok.type == tokenize.ERRORTOKEN or tokenize.tok_name[tok.type].startswith("FSTRING"):
+                return None
+            if tok.type == tokenize.NAME:
+                kind = "keyword" if keyword.iskeyword(tok.string) else "identifier"
+            elif tok.type == tokenize.NUMBER:
+                kind = _number_kind(tok.string)
+            elif tok.type == tokenize.STRING:
+                kind = "string"
+            elif tok.type == tokenize.OP:
+                kind = "symbol"
+            else:
+                continue
+
+            start = line_starts[tok.start[0] - 1] + tok.start[1]
+            end = line_starts[tok.end[0] - 1] + tok.end[1]
+            tokens.append(_Token(kind, tok.string, start, end))
+    except tokenize.TokenError as e:
+        # hunkは文の途中で切れていることが多いので，括弧の閉じ忘れだけは許容する
+        if "EOF in multi-line statement" not in str(e):
+            return None
+    except (SyntaxError, IndentationError):
+        return None
+
+    return tokens
+
+
+def diff_python(src_code: list[str], dest_code: list[str]) -> GumTreeResponse | None:
+    """tokenizeとdifflibでGumTreeのtextdiffを近似する
+
+    一致したラベル付きトークン(identifier/integer/float/string)をMatchとし，
+    同じ長さの置換区間で種類が同じトークンの組をupdate-nodeのActionとする．
+    長さの異なる置換区間の両側にラベル付きトークンがある場合は対応付けが曖昧なためNoneを返す．
+
+    Returns:
+        GumTreeResponse | None: 近似できない入力の場合はNone(GumTreeへフォールバックする)
+    """
+    src_tokens = _tokenize(src_code)
+    dest_tokens = _tokenize(dest_code)
+    if src_tokens is None or dest_tokens is None:
+        return None
+
+    matches: list[Match] = []
+    actions: list[Action] = []
+
+    sm = difflib.SequenceMatcher(
+        None, [token.key for token in src_tokens], [token.key for token in dest_tokens], autojunk=False
+    )
+    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        src_block = src_tokens[i1:i2]
+        dest_block = dest_tokens[j1:j2]
+
+        if tag == "equal":
+            for src, dest in zip(src_block, dest_block):
+                if src.kind in LABELED_KINDS:
+                    matches.append(Match(src=src.node(), dest=dest.node()))
+
+        elif tag == "replace":
+            if len(src_block) != len(dest_block):
+                if any(t.kind in LABELED_KINDS for t in src_block) and any(
+                    t.kind in LABELED_KINDS for t in dest_block
+                ):
+                    return None
+                continue
+            for src, dest in zip(src_block, dest_block):
+                if src.kind != dest.kind:
+                    if src.kind in LABELED_KINDS and dest.kind in LABELED_KINDS:
+                        return None
+                    continue
+                if src.kind in LABELED_KINDS:
+                    matches.append(Match(src=src.node(), dest=dest.node()))
+                    actions.append(Action(action="update-node", tree=src.node(), label=dest.text))
+
+    return GumTreeResponse(matches=matches, actions=actions)
+
+
+def _is_small(src_code: list[str], dest_code: list[str]) -> bool:
+    return len(src_code) <= MAX_FAST_PATH_LINES and len(dest_code) <= MAX_FAST_PATH_LINES
+
+
+def run_tree_diff(src_code: list[str], dest_code: list[str], stage: str = "default") -> GumTreeResponse:
+    """小さなhunkはPythonで差分をとり，それ以外はGumTree(キャッシュ経由)で差分をとる"""
+    if _is_small(src_code, dest_code):
+        response = diff_python(src_code, dest_code)
+        if response is not None:
+            # GumTreeのキャッシュの統計と一緒に集計する(python src/gumtree/cache.pyで表示)
+            get_cache().record_fast_path(stage)
+            return response
+    return cached_run_GumTree(src_code, dest_code, stage)
+
+
+def run_tree_diff_batch(
+    pairs: list[tuple[list[str], list[str]]], stage: str = "default", pool: GumTreePool | None = None
+) -> list[GumTreeResponse | None]:
+    """run_tree_diffのバッチ版．Pythonで処理できなかったペアだけをGumTree(poolを指定すればプール)へまとめて渡す"""
+    responses: list[GumTreeResponse | None] = [
+        diff_python(src_code, dest_code) if _is_small(src_code, dest_code) else None for src_code, dest_code in pairs
+    ]
+    get_cache().record_fast_path(stage, sum(response is not None for response in responses))
+
+    fallback = [index for index, response in enumerate(responses) if response is None]
+    for index, response in zip(fallback, cached_run_GumTree_batch([pairs[index] for index in fallback], stage, pool)):
+        responses[index] = response
+    return responses
+
+
+if __name__ == "__main__":
+    condition = ["ASSERT_EQ(expected, actual);", "ASSERT_EQ(expected2, actual2);", "ASSERT_EQ(expected3, actual3);"]
+
+    consequent = ["EXPECT_EQ(expected, actual);", "EXPECT_EQ(expected2, actual2);", "EXPECT_EQ(expected3, actual3);"]
+
+    print(diff_python(condition, consequent))
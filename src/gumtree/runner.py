@@ -1,16 +1,54 @@
-import json
+import io
 import os
 import subprocess
 import uuid
 
 from constants import path
-from models.gumtree import Action, Match, GumTreeResponse
+from constants.gumtree import CLASSPATH, IMAGE, WORKER_CLASS
+from gumtree.protocol import encode_request, parse_response, read_batch, read_response, write_batch
+from models.gumtree import GumTreeResponse
 from utils.file_processor import remove_dir
 
 
-def run_GumTree(src_code: list, dest_code: list) -> GumTreeResponse:
+def container_name() -> str:
+    return f"gumtree-{uuid.uuid4().hex[:12]}"
+
+
+def docker_run(container: str | None = None, interactive: bool = False) -> list[str]:
+    """docker runのコマンドの先頭部分
+
+    --initでコンテナ内のJVMがシグナルを受け取れるようにし，名前をつけたコンテナはkill_containerで止められる
+    """
+    command = ["docker", "run", "--rm", "--init"]
+    if interactive:
+        command.append("-i")
+    if container is not None:
+        command.extend(["--name", container])
+    return command
+
+
+def kill_container(container: str) -> None:
+    """docker runのクライアントを止めてもコンテナ内のJVMは動き続けるため，コンテナごと止める"""
+    subprocess.run(["docker", "kill", container], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+
+
+def run_GumTree(
+    src_code: list, dest_code: list, timeout: float | None = None, transport: str = "file"
+) -> GumTreeResponse:
+    """1組の(src, dest)をGumTreeで差分する
+
+    Args:
+        transport (str): "file"は一時ディレクトリにファイルを書き出して渡す．
+            "pipe"はワーカーの標準入力へ直接流し込み，ディレクトリを一切作らない
+    """
+    if transport == "pipe":
+        return _run_GumTree_via_pipe(src_code, dest_code, timeout)
+    if transport != "file":
+        raise ValueError(f"Unknown transport: {transport}")
+
     id: str = str(uuid.uuid4())
     TMP_DIR = path.TMP/id
+    container = container_name()
 
     try:
         os.makedirs(TMP_DIR, exist_ok=True)
@@ -26,12 +64,10 @@ def run_GumTree(src_code: list, dest_code: list) -> GumTreeResponse:
 
         # dockerコンテナ内でgumtreeを処理させる用
         command = [
-            "docker",
-            "run",
-            "--rm",
+            *docker_run(container),
             "-v",
             f"{TMP_DIR}:/tmp/{id}",
-            "tomoya0318/gumtree",
+            IMAGE,
             "gumtree",
             "textdiff",
             "-f",
@@ -40,12 +76,83 @@ def run_GumTree(src_code: list, dest_code: list) -> GumTreeResponse:
             f"/tmp/{id}/dest.py",
         ]
 
-        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-        response_dict = json.loads(output.stdout)
-        return GumTreeResponse(
-            matches=[Match(**match) for match in response_dict.get("matches", [])],
-            actions=[Action(**action) for action in response_dict.get("actions", [])],
+        output = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True, timeout=timeout
+        )
+        return parse_response(output.stdout)
+
+    except OSError as e:
+        raise OSError(f"Failed to create directory: {str(e)}")
+
+    except subprocess.CalledProcessError as e:
+        raise subprocess.SubprocessError(f"Docker command failed: {e.stderr}")
+
+    except subprocess.TimeoutExpired as e:
+        kill_container(container)
+        raise subprocess.SubprocessError(f"GumTree timed out after {e.timeout} seconds")
+
+    finally:
+        remove_dir(TMP_DIR)
+
+
+def _run_GumTree_via_pipe(src_code: list, dest_code: list, timeout: float | None) -> GumTreeResponse:
+    container = container_name()
+    command = [*docker_run(container, interactive=True), IMAGE, "java", "-cp", CLASSPATH, WORKER_CLASS, "serve"]
+    try:
+        output = subprocess.run(
+            command,
+            input=encode_request(src_code, dest_code),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            timeout=timeout,
         )
+        return read_response(io.BytesIO(output.stdout))
+
+    except (EOFError, RuntimeError) as e:
+        raise subprocess.SubprocessError(f"GumTree worker failed: {str(e)}")
+
+    except subprocess.CalledProcessError as e:
+        raise subprocess.SubprocessError(f"Docker command failed: {e.stderr}")
+
+    except subprocess.TimeoutExpired as e:
+        kill_container(container)
+        raise subprocess.SubprocessError(f"GumTree timed out after {e.timeout} seconds")
+
+
+def run_GumTree_batch(
+    pairs: list[tuple[list[str], list[str]]], timeout: float | None = None
+) -> list[GumTreeResponse | None]:
+    """複数の(src, dest)ペアをGumTreeの1回の起動でまとめて処理する
+
+    Returns:
+        list[GumTreeResponse | None]: 入力順の結果．差分計算に失敗したペアはNone
+    """
+    if not pairs:
+        return []
+
+    id: str = str(uuid.uuid4())
+    TMP_DIR = path.TMP/id
+    container = container_name()
+
+    try:
+        write_batch(TMP_DIR, pairs)
+
+        # dockerコンテナ内でまとめてgumtreeを処理させる用
+        command = [
+            *docker_run(container),
+            "-v",
+            f"{TMP_DIR}:/tmp/{id}",
+            IMAGE,
+            "java",
+            "-cp",
+            CLASSPATH,
+            WORKER_CLASS,
+            "batch",
+            f"/tmp/{id}",
+        ]
+        subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True, timeout=timeout)
+        return read_batch(TMP_DIR, len(pairs))
 
     except OSError as e:
         raise OSError(f"Failed to create directory: {str(e)}")
@@ -53,6 +160,10 @@ def run_GumTree(src_code: list, dest_code: list) -> GumTreeResponse:
     except subprocess.CalledProcessError as e:
         raise subprocess.SubprocessError(f"Docker command failed: {e.stderr}")
 
+    except subprocess.TimeoutExpired as e:
+        kill_container(container)
+        raise subprocess.SubprocessError(f"GumTree timed out after {e.timeout} seconds")
+
     finally:
         remove_dir(TMP_DIR)
 
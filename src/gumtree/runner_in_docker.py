@@ -1,14 +1,29 @@
-import json
+import io
 import os
 import subprocess
 import uuid
 
 from constants import path
-from models.gumtree import Action, Match, GumTreeResponse
+from constants.gumtree import CLASSPATH, WORKER_CLASS
+from gumtree.protocol import encode_request, parse_response, read_batch, read_response, write_batch
+from models.gumtree import GumTreeResponse
 from utils.file_processor import remove_dir
 
 
-def run_GumTree(src_code: list, dest_code: list) -> GumTreeResponse:
+def run_GumTree(
+    src_code: list, dest_code: list, timeout: float | None = None, transport: str = "file"
+) -> GumTreeResponse:
+    """1組の(src, dest)をGumTreeで差分する
+
+    Args:
+        transport (str): "file"は一時ディレクトリにファイルを書き出して渡す．
+            "pipe"はワーカーの標準入力へ直接流し込み，ディレクトリを一切作らない
+    """
+    if transport == "pipe":
+        return _run_GumTree_via_pipe(src_code, dest_code, timeout)
+    if transport != "file":
+        raise ValueError(f"Unknown transport: {transport}")
+
     id: str = str(uuid.uuid4())
     TMP_DIR = path.TMP/id
 
@@ -33,12 +48,67 @@ def run_GumTree(src_code: list, dest_code: list) -> GumTreeResponse:
             dest_path
         ]
 
-        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-        response_dict = json.loads(output.stdout)
-        return GumTreeResponse(
-            matches=[Match(**match) for match in response_dict.get("matches", [])],
-            actions=[Action(**action) for action in response_dict.get("actions", [])],
+        output = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True, timeout=timeout
+        )
+        return parse_response(output.stdout)
+
+    except OSError as e:
+        raise OSError(f"Failed to create directory: {str(e)}")
+
+    except subprocess.CalledProcessError as e:
+        raise subprocess.SubprocessError(f"Docker command failed: {e.stderr}")
+
+    except subprocess.TimeoutExpired as e:
+        raise subprocess.SubprocessError(f"GumTree timed out after {e.timeout} seconds")
+
+    finally:
+        remove_dir(TMP_DIR)
+
+
+def _run_GumTree_via_pipe(src_code: list, dest_code: list, timeout: float | None) -> GumTreeResponse:
+    command = ["java", "-cp", CLASSPATH, WORKER_CLASS, "serve"]
+    try:
+        output = subprocess.run(
+            command,
+            input=encode_request(src_code, dest_code),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            timeout=timeout,
         )
+        return read_response(io.BytesIO(output.stdout))
+
+    except (EOFError, RuntimeError) as e:
+        raise subprocess.SubprocessError(f"GumTree worker failed: {str(e)}")
+
+    except subprocess.CalledProcessError as e:
+        raise subprocess.SubprocessError(f"Docker command failed: {e.stderr}")
+
+    except subprocess.TimeoutExpired as e:
+        raise subprocess.SubprocessError(f"GumTree timed out after {e.timeout} seconds")
+
+
+def run_GumTree_batch(
+    pairs: list[tuple[list[str], list[str]]], timeout: float | None = None
+) -> list[GumTreeResponse | None]:
+    """複数の(src, dest)ペアをGumTreeの1回の起動でまとめて処理する
+
+    Returns:
+        list[GumTreeResponse | None]: 入力順の結果．差分計算に失敗したペアはNone
+    """
+    if not pairs:
+        return []
+
+    id: str = str(uuid.uuid4())
+    TMP_DIR = path.TMP/id
+
+    try:
+        write_batch(TMP_DIR, pairs)
+
+        command = ["java", "-cp", CLASSPATH, WORKER_CLASS, "batch", str(TMP_DIR)]
+        subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True, timeout=timeout)
+        return read_batch(TMP_DIR, len(pairs))
 
     except OSError as e:
         raise OSError(f"Failed to create directory: {str(e)}")
@@ -46,11 +116,15 @@ def run_GumTree(src_code: list, dest_code: list) -> GumTreeResponse:
     except subprocess.CalledProcessError as e:
         raise subprocess.SubprocessError(f"Docker command failed: {e.stderr}")
 
+    except subprocess.TimeoutExpired as e:
+        raise subprocess.SubprocessError(f"GumTree timed out after {e.timeout} seconds")
+
     finally:
         remove_dir(TMP_DIR)
 
+
 if __name__ == "__main__":
     condition = ['@exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())']
     consequent = ["@wrap_exception()"]
     response = run_GumTree(condition, consequent)
-    print(response)
\ No newline at end of file
+    print(response)
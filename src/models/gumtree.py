@@ -2,6 +2,8 @@ from dataclasses import dataclass, field
 
 from dataclasses_json import DataClassJsonMixin, dataclass_json
 
+from models.diff import DiffHunk
+
 
 @dataclass
 class Match:
@@ -29,3 +31,13 @@ class GumTreeResponse(DataClassJsonMixin):
 class UpdateChange:
     before: str
     after: str
+
+
+@dataclass
+class AbstractionResult:
+    """抽象化後のhunkと，抽象化に使ったGumTreeの入力・出力"""
+
+    diff_hunk: DiffHunk
+    # GumTreeに渡したhunk(関数名のみ抽象化済み)．responseの位置情報はこちらを基準とする
+    source: DiffHunk
+    response: GumTreeResponse
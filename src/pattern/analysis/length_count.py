@@ -1,4 +1,3 @@
-import itertools
 from collections import defaultdict
 from pathlib import Path
 
@@ -6,7 +5,7 @@ from joblib import Parallel, delayed
 
 from constants import path
 from models.pattern import PatternWithSupport
-from utils.file_processor import stream_json_patterns
+from utils.pattern_store import PATTERN_SUFFIX, iter_pattern_chunks, scan_patterns
 
 
 def process_chunk(chunk: list[dict]) -> dict[int, int]:
@@ -26,9 +25,8 @@ def parallel_count_token_length(file_path: Path, chunk_size: int = 1000, n_jobs:
     """並列処理によるトークン長カウント"""
     total_counts = defaultdict(int)
 
-    items = stream_json_patterns(file_path)
     results = Parallel(n_jobs=n_jobs, verbose=10)(
-        delayed(process_chunk)(chunk) for chunk in iter(lambda: list(itertools.islice(items, chunk_size)), []) if chunk
+        delayed(process_chunk)(chunk) for chunk in iter_pattern_chunks(file_path, chunk_size)
     )
 
     for chunk_result in results:
@@ -38,13 +36,17 @@ def parallel_count_token_length(file_path: Path, chunk_size: int = 1000, n_jobs:
     return dict(total_counts)
 
 
+def count_token_length(file_path: Path, min_support: int | None = None) -> dict[int, int]:
+    """トークン長ごとのパターン数．Parquetではlength列だけを読むため，パターン本体を読み込まない"""
+    counts = scan_patterns(file_path, min_support=min_support).group_by("length").len().collect()
+    return dict(zip(counts["length"].to_list(), counts["len"].to_list()))
+
+
 if __name__ == "__main__":
-    input_path = path.RESULTS / "openstack_s10_t15" / "all" / "pre_filtered_nova.json"
+    input_path = path.RESULTS / "openstack_s10_t15" / "all" / f"pre_filtered_nova{PATTERN_SUFFIX}"
     print("処理開始...")
     try:
-        result = parallel_count_token_length(
-            input_path, chunk_size=2000, n_jobs=-1  # メモリ使用量と処理速度のバランスを調整
-        )
+        result = count_token_length(input_path)
         print("\n処理結果:")
         for length in sorted(result):
             print(f"長さ {length}: {result[length]}件")
@@ -5,7 +5,7 @@ from dataclasses_json import DataClassJsonMixin, dataclass_json
 from joblib import Parallel, delayed
 
 from models.diff import DiffHunk
-from pattern.parallel_diff import parallel_extract_diff
+from pattern.parallel_diff import GUMTREE_CONCURRENCY, parallel_extract_diff
 from utils.diff_handler import DiffDataHandler
 from utils.file_processor import load_from_json
 
@@ -21,8 +21,7 @@ def parallel_calc_confidence(pattern_path: Path, diff_path: Path) -> list[Confid
     pattern_data_list = load_from_json(pattern_path)
     patterns: list[list[str]] = [data["pattern"] for data in pattern_data_list]
 
-    data_list = DiffDataHandler.load_from_json(diff_path)
-    diff_data = parallel_extract_diff(data_list)
+    diff_data = parallel_extract_diff(DiffDataHandler.stream(diff_path), gumtree_concurrency=GUMTREE_CONCURRENCY)
     diff_hunks: list[DiffHunk] = [diff[1] for diff in diff_data]
 
     result = Parallel(n_jobs=-1, verbose=10)(
@@ -74,4 +73,4 @@ def is_actually_change(pattern: list[str], consequent: list[str] | str) -> bool:
         if change not in after_code:
             return False
 
-    return True
\ No newline at end of file
+    return True
@@ -1,74 +1,90 @@
-import os
-import tokenize
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 from typing import Generator
 
 
 import difflib
-from codetokenizer.tokenizer import TokeNizer
 
-from abstractor.abstraction import abstract_code
-from exception import TokenizationError
-from gumtree.extractor import extract_update_code_changes
+from abstractor.abstraction import abstract_code_batch, abstract_code_with_response
+from gumtree.pool import GumTreePool
+from gumtree.py_differ import run_tree_diff
+from gumtree.extractor import derive_update_code_changes, extract_update_code_changes
 from models.diff import DiffHunk
-from models.gumtree import UpdateChange
+from models.gerrit import DiffData
+from models.gumtree import AbstractionResult, UpdateChange
 from utils.diff_handler import DiffDataHandler
 from utils.lang_identifiyer import identify_lang_from_file
+from utils.token_cache import tokenize_line
 
-if os.path.isfile("/.dockerenv"):
-    from gumtree.runner_in_docker import run_GumTree
-else:
-    from gumtree.runner import run_GumTree
+# GumTreePoolを使う場合に，1回にまとめて抽象化するdiffの数
+GUMTREE_CHUNK_SIZE = 256
 
 
-def extract_diff(file_path: Path) -> Generator[tuple[datetime, str, DiffHunk], None, None]:
-    """JSONファイルから，変更前と変更後のペアを抽出する"""
+def extract_diff(
+    file_path: Path, reuse_response: bool = True, gumtree_concurrency: int | None = None
+) -> Generator[tuple[datetime, str, DiffHunk], None, None]:
+    """diffのファイルから，変更前と変更後のペアを抽出する．diffは1件ずつ読み込む
+
+    reuse_responseがTrueなら，変更行は抽象化時のGumTreeの結果から導出する．
+    gumtree_concurrencyを指定すると，GUMTREE_CHUNK_SIZE件ずつまとめて，
+    その数のワーカーを常駐させたGumTreePoolで抽象化する(結果の順序は変わらない)
+    """
 
     DH = DiffDataHandler
-    for item in DH.load_from_json(file_path):
-        try:
-            language = identify_lang_from_file(item.file_name)
-            # Pythonファイルのみに対応
-            if language != "Python":
-                continue
-        except ValueError as e:
-            print(e)
-            continue
-        else:
-            condition = item.diff_hunk.condition
-            consequent = item.diff_hunk.consequent
-
-            abstracted_diff = abstract_code(DiffHunk(condition, consequent))
-            if len(abstracted_diff.condition) > 5 or len(abstracted_diff.consequent) > 5:
-                continue
-
-            elif (
-                len(abstracted_diff.condition) != len(abstracted_diff.consequent)
-                or len(abstracted_diff.condition) == 1
-            ):
-                token_diff = DiffHunk(abstracted_diff.condition, abstracted_diff.consequent)
+    targets = ((item, language) for item in DH.stream(file_path) if (language := _python_language(item)) is not None)
+    if gumtree_concurrency is None:
+        for item, language in targets:
+            result = abstract_code_with_response(DiffHunk(item.diff_hunk.condition, item.diff_hunk.consequent))
+            for token_diff in _token_diffs(result, reuse_response):
                 yield item.merged_at, language, token_diff
-
-            else:
-                response = run_GumTree(abstracted_diff.condition, abstracted_diff.consequent)
-                changes: list[UpdateChange] = extract_update_code_changes(
-                    abstracted_diff.condition, abstracted_diff.consequent, response.actions
-                )
-                for change in changes:
-                    token_diff = DiffHunk([change.before], [change.after])
+        return
+
+    with GumTreePool(concurrency=gumtree_concurrency) as pool:
+        for chunk in iter(lambda: list(islice(targets, GUMTREE_CHUNK_SIZE)), []):
+            results = abstract_code_batch(
+                [DiffHunk(item.diff_hunk.condition, item.diff_hunk.consequent) for item, _ in chunk], pool
+            )
+            for (item, language), result in zip(chunk, results):
+                # GumTreeが失敗したhunkは飛ばす
+                if result is None:
+                    continue
+                for token_diff in _token_diffs(result, reuse_response):
                     yield item.merged_at, language, token_diff
 
 
+def _python_language(item: DiffData) -> str | None:
+    try:
+        language = identify_lang_from_file(item.file_name)
+    except ValueError as e:
+        print(e)
+        return None
+    # Pythonファイルのみに対応
+    return language if language == "Python" else None
+
+
+def _token_diffs(result: AbstractionResult, reuse_response: bool) -> list[DiffHunk]:
+    """抽象化したhunkから，トークン列の差分をとる変更前後のペアを取り出す"""
+    abstracted_diff = result.diff_hunk
+    if len(abstracted_diff.condition) > 5 or len(abstracted_diff.consequent) > 5:
+        return []
+
+    if len(abstracted_diff.condition) != len(abstracted_diff.consequent) or len(abstracted_diff.condition) == 1:
+        return [DiffHunk(abstracted_diff.condition, abstracted_diff.consequent)]
+
+    if reuse_response:
+        changes: list[UpdateChange] = derive_update_code_changes(result)
+    else:
+        response = run_tree_diff(abstracted_diff.condition, abstracted_diff.consequent, stage="update_extraction")
+        changes = extract_update_code_changes(abstracted_diff.condition, abstracted_diff.consequent, response.actions)
+    return [DiffHunk([change.before], [change.after]) for change in changes]
+
+
 def _tokenize_diff(language: str, code: list[str]):
-    TN = TokeNizer(language)
     tokenized_code = []
-    try:
-        for line in code:
-            tokenized_code.extend(TN.getPureTokens(line))
-        return tokenized_code
-    except tokenize.TokenError as e:
-        raise TokenizationError(f"Failed to tokenize code: {str(e)}") from e
+    for line in code:
+        tokenized_code.extend(tokenize_line(language, line, stage="token_diff"))
+    return tokenized_code
 
 
 def compute_token_diff(language: str, diff_hunk: DiffHunk) -> list[str]:
@@ -127,4 +143,4 @@ def merge_consecutive_tokens(diff: list[str]) -> list[str]:
 if __name__ == "__main__":
     condition = ['a = a + b']
     consequent = ['a += b']
-    print(compute_token_diff("Python", DiffHunk(condition, consequent)))
\ No newline at end of file
+    print(compute_token_diff("Python", DiffHunk(condition, consequent)))
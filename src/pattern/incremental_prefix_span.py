@@ -0,0 +1,227 @@
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from models.pattern import PatternWithSupport
+from pattern.prefix_span import PrefixSpan
+from pattern.vocabulary import EncodedCorpus, Vocabulary
+from utils.file_processor import dump_to_json, load_from_json
+
+
+class IncrementalPrefixSpan:
+    """系列を追加するたびに，それまでの全ての系列での頻出パターンを更新するPrefixSpan
+
+    これまでの系列・頻出パターンのsupport・各頻出パターンの境界(下記)・追加した期間を状態として保持し，JSONへ保存・復元できる．
+    同じ期間を2回追加するとsupportを二重に数えるため，追加済みの期間はValueErrorとする．
+    追加した系列に現れないパターンのsupportは変わらないため，追加した系列に現れる接頭辞だけを探索し直す．
+    結果は全ての系列でPrefixSpanをやり直した場合と，パターン・support・順序とも一致する．
+
+    頻出パターンPの境界は，頻出でない拡張P+[item]のうちsupportがborder_support以上のものの正確なsupportと，
+    それ以外の拡張のsupportの上限の組．追加した系列での拡張のsupportを足しても境界から頻出になりえないと分かる間は，
+    以前の系列を走査しない．判定できない場合だけPの投影DBを以前の系列まで作り直して数え，境界を更新する．
+    """
+
+    def __init__(self, min_support, max_sequence_length: int | None = 15, border_support: int | None = None):
+        # 長すぎる系列の除外はPrefixSpanと同じ条件で，追加した系列ごとに行う
+        self.miner = PrefixSpan(min_support, None, max_sequence_length=max_sequence_length)
+        if border_support is None:
+            border_support = max(1, min_support // 2)
+        if not 1 <= border_support <= min_support:
+            raise ValueError("border_support must be between 1 and min_support")
+        self.min_support = min_support
+        self.max_sequence_length = max_sequence_length
+        self.border_support = border_support
+        self.sequences: list[list[str]] = []
+        self.supports: dict[tuple[str, ...], int] = {}
+        self.borders: dict[tuple[str, ...], tuple[dict[str, int], int]] = {}
+        # 追加した期間(addのstart_year)
+        self.windows: list[int] = []
+
+    @classmethod
+    def load(cls, state_path: Path) -> "IncrementalPrefixSpan":
+        state = load_from_json(state_path)
+        incremental = cls(state["min_support"], state["max_sequence_length"], state["border_support"])
+        incremental.sequences = state["sequences"]
+        incremental.supports = {tuple(item["pattern"]): item["support"] for item in state["patterns"]}
+        incremental.borders = {
+            tuple(item["pattern"]): (item["extensions"], item["bound"]) for item in state["borders"]
+        }
+        incremental.windows = state.get("windows", [])
+        return incremental
+
+    def save(self, state_path: Path) -> None:
+        state = {
+            "min_support": self.min_support,
+            "max_sequence_length": self.max_sequence_length,
+            "border_support": self.border_support,
+            "windows": self.windows,
+            "sequences": self.sequences,
+            "patterns": [pattern.to_dict() for pattern in self.patterns()],
+            "borders": [
+                {"pattern": list(pattern), "extensions": extensions, "bound": bound}
+                for pattern, (extensions, bound) in self.borders.items()
+            ],
+        }
+        dump_to_json(state, state_path)
+
+    def add(self, sequences, start_year) -> list[PatternWithSupport]:
+        """系列を追加し，これまでの全ての系列での頻出パターンを返す
+
+        Args:
+            sequences: 追加する系列
+            start_year: 追加する期間．除外した長すぎる系列の出力先のファイル名にも使う
+        """
+        if start_year in self.windows:
+            raise ValueError(f"sequences of {start_year} have already been added")
+        if not all(isinstance(seq, (list, tuple)) for seq in sequences):
+            raise ValueError("All sequences must be lists or tuples")
+
+        self.miner.start_year = start_year
+        new_sequences = [list(sequence) for sequence in self.miner.partition_sequences(sequences)]
+        self.windows.append(start_year)
+        if not new_sequences:
+            return self.patterns()
+
+        # 追加した系列はコーパスの末尾に置くため，delta_start以降の位置が追加した系列になる
+        all_sequences = self.sequences + new_sequences
+        vocabulary = Vocabulary.from_sequences(all_sequences)
+        corpus = EncodedCorpus.from_sequences(vocabulary, all_sequences)
+        delta_start = corpus.starts[len(self.sequences)]
+
+        ids = vocabulary.ids
+        supports = {tuple(ids[token] for token in pattern): support for pattern, support in self.supports.items()}
+        borders = {
+            tuple(ids[token] for token in pattern): ({ids[token]: s for token, s in extensions.items()}, bound)
+            for pattern, (extensions, bound) in self.borders.items()
+        }
+        self._update(corpus, delta_start, supports, borders)
+
+        tokens = vocabulary.tokens
+        self.supports = {tuple(vocabulary.decode(pattern)): support for pattern, support in supports.items()}
+        self.borders = {
+            tuple(vocabulary.decode(pattern)): ({tokens[item]: s for item, s in extensions.items()}, bound)
+            for pattern, (extensions, bound) in borders.items()
+        }
+        self.sequences = all_sequences
+        return self.patterns()
+
+    def _update(
+        self,
+        corpus: EncodedCorpus,
+        delta_start: int,
+        supports: dict[tuple[int, ...], int],
+        borders: dict[tuple[int, ...], tuple[dict[int, int], int]],
+    ) -> None:
+        """追加した系列に現れる接頭辞を深さ優先でたどり，supportsとbordersをその場で更新する
+
+        スタックの各要素は[接頭辞, 追加した系列での投影DB, 以前の系列での投影DB(必要になるまでNone), 子の反復子]．
+        """
+        view = corpus.view
+        ends = corpus.ends
+        min_support = self.min_support
+        self.miner.corpus = corpus
+        project = self.miner.build_projected_db
+
+        def _count(projected_db: array) -> dict[int, int]:
+            items: dict[int, int] = {}
+            for begin in projected_db:
+                for item in set(view[begin : ends[begin]]):
+                    items[item] = items.get(item, 0) + 1
+            return items
+
+        def _old_db(depth: int) -> array:
+            # 以前の系列での投影DBは，持っている最も深い祖先から順に作る
+            start = depth
+            while stack[start][2] is None:
+                start -= 1
+            for d in range(start + 1, depth + 1):
+                stack[d][2] = project(stack[d - 1][2], stack[d][0][-1])
+            return stack[depth][2]
+
+        def _children(depth: int) -> list[tuple[int, bool]]:
+            """追加した系列に現れる頻出な拡張のsupportを更新し，(アイテム, 新たに頻出になったか)を返す"""
+            prefix = stack[depth][0]
+            delta = _count(stack[depth][1])
+            border = borders.get(prefix)
+            if border is not None:
+                extensions, bound = border
+                if any(
+                    bound + delta_support >= min_support
+                    for item, delta_support in delta.items()
+                    if prefix + (item,) not in supports and item not in extensions
+                ):
+                    border = None
+
+            union: dict[int, int] = {}
+            if border is None:
+                # 境界では判定できないので，以前の系列も数えて境界を作り直す
+                old = _count(_old_db(depth))
+                for item in old.keys() | delta.keys():
+                    union[item] = old.get(item, 0) + delta.get(item, 0)
+                borders[prefix] = (
+                    {item: s for item, s in union.items() if self.border_support <= s < min_support},
+                    self.border_support - 1,
+                )
+            else:
+                extensions, bound = border
+                uncached = 0
+                for item, delta_support in delta.items():
+                    child = prefix + (item,)
+                    if child in supports:
+                        union[item] = supports[child] + delta_support
+                    elif item in extensions:
+                        union[item] = extensions[item] + delta_support
+                        if union[item] < min_support:
+                            extensions[item] = union[item]
+                        else:
+                            del extensions[item]
+                    else:
+                        uncached = max(uncached, delta_support)
+                borders[prefix] = (extensions, bound + uncached)
+
+            children = []
+            for item, support in union.items():
+                if support >= min_support and delta.get(item, 0) > 0:
+                    child = prefix + (item,)
+                    children.append((item, child not in supports))
+                    supports[child] = support
+            return children
+
+        initial_db = corpus.initial_positions()
+        split = bisect_left(initial_db, delta_start)
+        stack: list[list] = [[(), initial_db[split:], initial_db[:split], None]]
+        stack[0][3] = iter(_children(0))
+        while stack:
+            prefix, new_db, _, children = stack[-1]
+            for item, is_new in children:
+                new_projected_db = project(new_db, item)
+                # 新たに頻出になったパターンは，追加した系列に続きがなくても境界を作る必要がある
+                if new_projected_db or is_new:
+                    stack.append([prefix + (item,), new_projected_db, None, None])
+                    stack[-1][3] = iter(_children(len(stack) - 1))
+                    break
+            else:
+                stack.pop()
+
+    def patterns(self) -> list[PatternWithSupport]:
+        """保持しているsupportから，PrefixSpanと同じ探索順でパターンを並べる
+
+        頻出パターンの接頭辞は全て頻出なのでsupportの表は接頭辞木になる．各節点の子をsupportの降順・トークンの文字列順
+        (PrefixSpanのIDの順)に並べて深さ優先でたどると，PrefixSpanの列挙順になる．
+        """
+        children: dict[tuple[str, ...], list[tuple[str, ...]]] = {}
+        for pattern in self.supports:
+            children.setdefault(pattern[:-1], []).append(pattern)
+        for siblings in children.values():
+            siblings.sort(key=lambda pattern: (-self.supports[pattern], pattern[-1]))
+
+        result: list[PatternWithSupport] = []
+        stack = [iter(children.get((), []))]
+        while stack:
+            for pattern in stack[-1]:
+                result.append(PatternWithSupport(list(pattern), self.supports[pattern]))
+                stack.append(iter(children.get(pattern, [])))
+                break
+            else:
+                stack.pop()
+        return result
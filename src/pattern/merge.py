@@ -1,11 +1,17 @@
-from itertools import chain, groupby
+import heapq
+import tempfile
+from itertools import groupby, islice
 from pathlib import Path
-
-from joblib import Parallel, delayed
+from typing import Callable, Iterable, Iterator
 
 from constants import path
 from models.pattern import PatternWithSupport
-from utils.file_processor import load_from_json, dump_to_json
+from pattern.vocabulary import Vocabulary
+from utils.file_processor import dump_to_jsonl, stream_jsonl
+from utils.pattern_store import PATTERN_SUFFIX, PatternWriter, iter_patterns, load_patterns
+
+# 外部ソートで1つのランにまとめてメモリ上でソートするパターン数
+SORT_CHUNK_SIZE = 1_000_000
 
 
 def load_single_repo_year(input_path: Path) -> list[PatternWithSupport]:
@@ -13,50 +19,101 @@ def load_single_repo_year(input_path: Path) -> list[PatternWithSupport]:
         print(f"{input_path} is not exist")
         return []
 
-    pattern_data_list = [
-        PatternWithSupport.from_dict(item) for item in load_from_json(input_path)
-    ]
-
-    return pattern_data_list
+    return load_patterns(input_path)
 
 
 def merge_pattern_results(pattern_data_list: list[PatternWithSupport]) -> list[PatternWithSupport]:
     """全ての結果を統合し、同一パターンのsupportを合算"""
-    # パターンでソート（パターンが同じものを隣接させる）
-    sorted_patterns = sorted(pattern_data_list, key=lambda x: tuple(x.pattern))
+    # トークンを文字列順のIDに置き換えて比較する(ID列の順序は文字列のリストの順序と一致する)
+    vocabulary = Vocabulary.from_sequences(x.pattern for x in pattern_data_list)
+    encoded = sorted((tuple(vocabulary.encode(x.pattern)), x.support) for x in pattern_data_list)
 
     # 同じパターンのsupportを合算
     merged_patterns = []
-    for pattern, group in groupby(sorted_patterns, key=lambda x: tuple(x.pattern)):
-        total_support = sum(g.support for g in group)
-        merged_patterns.append(PatternWithSupport(list(pattern), total_support))
+    for pattern, group in groupby(encoded, key=lambda x: x[0]):
+        total_support = sum(support for _, support in group)
+        merged_patterns.append(PatternWithSupport(vocabulary.decode(pattern), total_support))
 
     # supportで降順ソート
     return sorted(merged_patterns, key=lambda x: x.support, reverse=True)
 
 
-def process_all_patterns_parallel(owner: str, repo: str, start_year: int, end_year: int):
+def pattern_key(item: dict) -> list[str]:
+    """年ごとのパターンのファイルを並べる順序(パターンのトークン列の辞書順)"""
+    return item["pattern"]
+
+
+def support_key(item: dict) -> tuple[int, list[str]]:
+    """統合結果を並べる順序．merge_pattern_resultsと同じくsupportの降順で，同じsupportならパターンの辞書順"""
+    return -item["support"], item["pattern"]
+
+
+def external_sort(
+    items: Iterable[dict], key: Callable, chunk_size: int = SORT_CHUNK_SIZE
+) -> Iterator[dict]:
+    """chunk_size個ずつソートしたランを一時ファイルへ書き出し，ランをk-wayマージして順に返す
+
+    メモリに持つのは1つのランと各ランの先頭だけ．同じキーの要素は入力の順を保つ
+    """
+    iterator = iter(items)
+    path.INTERMEDIATE.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=path.INTERMEDIATE) as tmp_dir:
+        run_paths = []
+        for chunk in iter(lambda: list(islice(iterator, chunk_size)), []):
+            chunk.sort(key=key)
+            run_path = Path(tmp_dir) / f"run_{len(run_paths)}.jsonl"
+            dump_to_jsonl(chunk, run_path)
+            run_paths.append(run_path)
+        # heapq.mergeは同じキーなら前の入力から返すため，ランの順序がそのまま入力の順になる
+        yield from heapq.merge(*(stream_jsonl(run_path) for run_path in run_paths), key=key)
+
+
+def sort_pattern_file(input_path: Path, chunk_size: int = SORT_CHUNK_SIZE) -> None:
+    """パターンのファイルをpattern_keyの順に並べ直す(外部ソートなので全パターンをメモリに持たない)"""
+    sorted_path = input_path.with_name(f"sorting_{input_path.name}")
+    with PatternWriter(sorted_path) as writer:
+        for item in external_sort(iter_patterns(input_path), pattern_key, chunk_size):
+            writer.write(item)
+    sorted_path.replace(input_path)
+
+
+def stream_sorted_patterns(input_path: Path) -> Iterator[dict]:
+    """pattern_keyの順に並んだパターンのファイルを読み込む．順序が崩れていればValueError"""
+    if not input_path.exists():
+        print(f"{input_path} is not exist")
+        return
+    previous = None
+    for item in iter_patterns(input_path):
+        if previous is not None and item["pattern"] < previous:
+            raise ValueError(f"{input_path} is not sorted by pattern; run sort_pattern_file first")
+        previous = item["pattern"]
+        yield item
+
+
+def merge_sorted_pattern_files(input_paths: list[Path]) -> Iterator[dict]:
+    """pattern_keyの順に並んだ複数のファイルをk-wayマージし，同じパターンのsupportを合算しながら順に返す"""
+    merged = heapq.merge(*(stream_sorted_patterns(input_path) for input_path in input_paths), key=pattern_key)
+    for pattern, group in groupby(merged, key=pattern_key):
+        yield {"pattern": pattern, "support": sum(item["support"] for item in group)}
+
+
+def process_all_patterns_parallel(
+    owner: str, repo: str, start_year: int, end_year: int, chunk_size: int = SORT_CHUNK_SIZE
+):
+    """年ごとのパターンのファイルを統合し，supportの降順でmerged_{owner}.jsonへ保存する
+
+    年ごとのファイルはパターンの順に並べて書き出してある(pattern.parallel_diff.single_process)ため，
+    k-wayマージで合算し，supportの順への並べ替えは外部ソートで行う．結果はmerge_pattern_resultsと同じ
+    """
     # 全ての入力パスを生成
     input_paths = [
-        path.RESULTS / owner / f"{year}to{year + 1}" / f"{repo}.json"
+        path.RESULTS / owner / f"{year}to{year + 1}" / f"{repo}{PATTERN_SUFFIX}"
         for year in range(start_year, end_year)
     ]
 
-    # 並列処理で各ファイルを処理
-    results = Parallel(n_jobs=-1, verbose=10)(
-        delayed(load_single_repo_year)(input_path)
-        for input_path in input_paths
-    )
-
-    # 平坦化: 二次元リストから要素を取り出して一次元にする
-    flat_results:list[PatternWithSupport] = list(chain.from_iterable(results)) # type: ignore
-
-    # 結果を統合
-    merged_results = merge_pattern_results(flat_results)
-
-    # 結果を保存
-    output_path = path.RESULTS / owner / "all" / f"merged_{owner}.json"
-    dump_to_json(
-        [result.to_dict() for result in merged_results],
-        output_path
-    )
+    # 結果を統合し，supportの順に並べながら保存
+    merged_results = merge_sorted_pattern_files(input_paths)
+    output_path = path.RESULTS / owner / "all" / f"merged_{owner}{PATTERN_SUFFIX}"
+    with PatternWriter(output_path) as writer:
+        for item in external_sort(merged_results, support_key, chunk_size):
+            writer.write(item)
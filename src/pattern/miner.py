@@ -0,0 +1,12 @@
+from pattern.prefix_span import PrefixSpan
+from pattern.spade import Spade
+
+# 系列パターンマイニングのエンジン．どれもfit(sequences)で同じ形式・同じ順序の結果を返す
+ENGINES: dict[str, type[PrefixSpan]] = {"prefixspan": PrefixSpan, "spade": Spade}
+
+
+def create_miner(engine: str, min_support, start_year, **kwargs) -> PrefixSpan:
+    """エンジン名からマイナーを作る．kwargsはエンジンのコンストラクタへそのまま渡す"""
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of {tuple(ENGINES)}")
+    return ENGINES[engine](min_support, start_year, **kwargs)
@@ -1,68 +1,179 @@
 import gc
 import logging
+import os
+from itertools import islice
 from pathlib import Path
+from typing import Iterable
 
 from joblib import Parallel, delayed
 
-from abstractor.abstraction import abstract_code
+from abstractor.abstraction import abstract_code_batch, abstract_code_with_response
 from constants import path
-from gumtree.extractor import extract_update_code_changes
-from gumtree.runner_in_docker import run_GumTree
+from gumtree.extractor import derive_update_code_changes, extract_update_code_changes
+from gumtree.pool import GumTreePool
+from gumtree.py_differ import run_tree_diff, run_tree_diff_batch
 from models.diff import DiffHunk
 from models.gerrit import DiffData
-from models.gumtree import UpdateChange
-from models.pattern import PatternWithSupport
+from models.gumtree import AbstractionResult, GumTreeResponse, UpdateChange
 from pattern.diff2sequence import compute_token_diff
-from pattern.merge import process_all_patterns_parallel
-from pattern.prefix_span import PrefixSpan
+from pattern.incremental_prefix_span import IncrementalPrefixSpan
+from pattern.merge import pattern_key, process_all_patterns_parallel, sort_pattern_file
+from pattern.miner import create_miner
 from rq1.filter import parallel_process
-from rq1.term import contains_all_bracket_pairs, is_all_symbols
 from utils.diff_handler import DiffDataHandler
 from utils.discord import send_discord_notification
-from utils.file_processor import dump_to_json, load_from_json
+from utils.file_processor import load_from_json
 from utils.lang_identifiyer import identify_lang_from_file
+from utils.pattern_store import PATTERN_SUFFIX, write_patterns
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# GumTreeのプールを使う場合に同時に動かすJVMの数と，1回にプールへ渡すdiffの数
+GUMTREE_CONCURRENCY = os.cpu_count() or 1
+GUMTREE_CHUNK_SIZE = 256
 
-def extract_diff_single(item: DiffData):
-    results = []
+
+def _target_language(item: DiffData) -> str | None:
+    """抽出対象のdiffであれば言語名を返す"""
     try:
         language = identify_lang_from_file(item.file_name)
         if language != "Python":
-            return []  # 空リストを返す
+            return None
     except ValueError:
+        return None
+
+    if not item.diff_hunk.condition or not item.diff_hunk.consequent:
+        return None
+
+    return language
+
+
+def _is_too_long(abstracted_diff: DiffHunk) -> bool:
+    return len(abstracted_diff.condition) > 5 or len(abstracted_diff.consequent) > 5
+
+
+def _requires_update_extraction(abstracted_diff: DiffHunk) -> bool:
+    """同じ行数の複数行hunkは，GumTreeのupdate-nodeから変更行を取り出す"""
+    return len(abstracted_diff.condition) == len(abstracted_diff.consequent) and len(abstracted_diff.condition) != 1
+
+
+def _to_update_results(language: str, changes: list[UpdateChange]) -> list[tuple[str, DiffHunk]]:
+    return [(language, DiffHunk([change.before], [change.after])) for change in changes]
+
+
+def _update_changes_from_response(abstracted_diff: DiffHunk, response: GumTreeResponse) -> list[UpdateChange]:
+    return extract_update_code_changes(abstracted_diff.condition, abstracted_diff.consequent, response.actions)
+
+
+def extract_diff_single(item: DiffData, reuse_response: bool = True):
+    """1つのdiffから抽象化済みのhunkを抽出する
+
+    Args:
+        item (DiffData): 対象のdiff
+        reuse_response (bool): Trueなら変更行を抽象化時のGumTreeの結果から導出し，
+            抽象化後のコードに対する2回目のGumTreeを省略する
+    """
+    language = _target_language(item)
+    if language is None:
         return []  # 空リストを返す
 
     condition = item.diff_hunk.condition
     consequent = item.diff_hunk.consequent
 
-    if not condition or not consequent:
-        return []
-
-    abstracted_diff = abstract_code(DiffHunk(condition, consequent))
+    result: AbstractionResult = abstract_code_with_response(DiffHunk(condition, consequent))
+    abstracted_diff = result.diff_hunk
 
-    if len(abstracted_diff.condition) > 5 or len(abstracted_diff.consequent) > 5:
+    if _is_too_long(abstracted_diff):
         return []
 
-    if len(abstracted_diff.condition) != len(abstracted_diff.consequent) or len(abstracted_diff.condition) == 1:
+    if not _requires_update_extraction(abstracted_diff):
         token_diff = DiffHunk(abstracted_diff.condition, abstracted_diff.consequent)
-        results.append((language, token_diff))
-    else:
-        response = run_GumTree(abstracted_diff.condition, abstracted_diff.consequent)
-        changes: list[UpdateChange] = extract_update_code_changes(
-            abstracted_diff.condition, abstracted_diff.consequent, response.actions
-        )
-        for change in changes:
-            token_diff = DiffHunk([change.before], [change.after])
-            results.append((language, token_diff))
+        return [(language, token_diff)]
+
+    if reuse_response:
+        return _to_update_results(language, derive_update_code_changes(result))
+
+    response = run_tree_diff(abstracted_diff.condition, abstracted_diff.consequent, stage="update_extraction")
+    return _to_update_results(language, _update_changes_from_response(abstracted_diff, response))
 
-    return results
 
+def extract_diff_chunk(
+    items: list[DiffData], reuse_response: bool = True, pool: GumTreePool | None = None
+) -> list[tuple[str, DiffHunk]]:
+    """extract_diff_singleのチャンク版．GumTreeの起動は抽象化と変更行抽出でそれぞれ1回ずつ
 
-def parallel_extract_diff(data_list: list[DiffData]) -> list[tuple[str, DiffHunk]]:
-    diff_item_list = list(Parallel(n_jobs=-1, verbose=10)(delayed(extract_diff_single)(item) for item in data_list))
+    poolを指定した場合は，GumTreeへ渡すペアをプールのワーカーで並行に処理する
+    """
+    targets = [(language, item) for item in items if (language := _target_language(item)) is not None]
+    abstraction_results = abstract_code_batch(
+        [DiffHunk(item.diff_hunk.condition, item.diff_hunk.consequent) for _, item in targets], pool
+    )
+
+    # 入力順を保つため，hunkごとの結果を枠として用意しておく
+    results: list[list[tuple[str, DiffHunk]]] = [[] for _ in targets]
+    pending: list[tuple[int, str, DiffHunk]] = []
+    for index, ((language, _), result) in enumerate(zip(targets, abstraction_results)):
+        if result is None or _is_too_long(result.diff_hunk):
+            continue
+        abstracted_diff = result.diff_hunk
+        if not _requires_update_extraction(abstracted_diff):
+            results[index].append((language, DiffHunk(abstracted_diff.condition, abstracted_diff.consequent)))
+        elif reuse_response:
+            results[index].extend(_to_update_results(language, derive_update_code_changes(result)))
+        else:
+            pending.append((index, language, abstracted_diff))
+
+    responses = run_tree_diff_batch(
+        [(diff.condition, diff.consequent) for _, _, diff in pending], stage="update_extraction", pool=pool
+    )
+    for (index, language, abstracted_diff), response in zip(pending, responses):
+        if response is None:
+            continue
+        results[index].extend(_to_update_results(language, _update_changes_from_response(abstracted_diff, response)))
+
+    return [result for item_results in results for result in item_results]
+
+
+def parallel_extract_diff(
+    data_list: Iterable[DiffData],
+    chunk_size: int | None = None,
+    reuse_response: bool = True,
+    gumtree_concurrency: int | None = None,
+) -> list[tuple[str, DiffHunk]]:
+    """diffを並列に抽出する
+
+    Args:
+        data_list (Iterable[DiffData]): 抽出対象のdiff．DiffDataHandler.streamの結果を渡すと，
+            ワーカーへ渡す分だけを順に読み込む
+        chunk_size (int | None): 指定した場合はこの件数ずつまとめてGumTreeに渡す
+        reuse_response (bool): 変更行を抽象化時のGumTreeの結果から導出するか
+        gumtree_concurrency (int | None): 指定した場合は，この数のGumTreeワーカーを常駐させたGumTreePoolを使う．
+            チャンク(chunk_sizeを省略するとGUMTREE_CHUNK_SIZE件)は親プロセスで順に処理し，
+            各チャンクのGumTreeの処理をプールのワーカーへ並行に割り振る(JVMの数はgumtree_concurrencyに収まる)
+
+    Returns:
+        list[tuple[str, DiffHunk]]: (言語, 抽象化済みのhunk)のリスト
+    """
+    items = iter(data_list)
+    if gumtree_concurrency is not None:
+        size = chunk_size or GUMTREE_CHUNK_SIZE
+        with GumTreePool(concurrency=gumtree_concurrency) as pool:
+            diff_item_list = [
+                extract_diff_chunk(chunk, reuse_response, pool)
+                for chunk in iter(lambda: list(islice(items, size)), [])
+            ]
+    elif chunk_size is None:
+        diff_item_list = list(
+            Parallel(n_jobs=-1, verbose=10)(delayed(extract_diff_single)(item, reuse_response) for item in items)
+        )
+    else:
+        diff_item_list = list(
+            Parallel(n_jobs=-1, verbose=10)(
+                delayed(extract_diff_chunk)(chunk, reuse_response)
+                for chunk in iter(lambda: list(islice(items, chunk_size)), [])
+            )
+        )
 
     # 平坦化: 二次元リストから要素を取り出して一次元にする
     diff_items: list[tuple[str, DiffHunk]] = [x for sublist in diff_item_list for x in sublist]  # type: ignore
@@ -85,54 +196,91 @@ def parallel_compute_diff(diff_data: list[tuple[str, DiffHunk]]) -> list[list[st
 
 
 def parallel_extract_and_token_diff(file_path: Path) -> list[list[str]]:
-    data_list = DiffDataHandler.load_from_json(file_path)
-
-    diff_data = parallel_extract_diff(data_list)
+    diff_data = parallel_extract_diff(DiffDataHandler.stream(file_path), gumtree_concurrency=GUMTREE_CONCURRENCY)
     return parallel_compute_diff(diff_data)
 
 
-def _has_change_pattern(pattern: list[str]) -> bool:
-    return len(pattern) > 1 and any(token.startswith(("+", "-")) for token in pattern)
-
-
-def single_process(year: int):
+def single_process(
+    year: int,
+    n_jobs: int = -1,
+    top_k: int | None = None,
+    engine: str = "prefixspan",
+    memory_budget: int | None = None,
+):
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
 
     tmp_path = path.INTERMEDIATE / "openstack" / f"{year}to{year + 1}" / "nova.json"
-    output_path = path.RESULTS / "openstack_s10_t15" / f"{year}to{year + 1}" / f"nova.json"
+    output_path = path.RESULTS / "openstack_s10_t15" / f"{year}to{year + 1}" / f"nova{PATTERN_SUFFIX}"
+
+    if memory_budget is not None:
+        # 系列を逐次読み込み，投影DBの合計がmemory_budget(バイト)を超えたら一時ファイルへ退避し，
+        # パターンは見つけた順に書き出す(全コアで並列に探索しない・top_kは使えない)
+        logger.info(f"create pattern from {tmp_path} within {memory_budget} bytes of projected databases")
+        prefix_span = create_miner(
+            "prefixspan", 10, year, min_pattern_length=2, require_change=True, memory_budget=memory_budget
+        )
+        total = prefix_span.fit_file(tmp_path, output_path)
+        # 年ごとの結果はk-wayマージできるようパターンの順に並べておく
+        sort_pattern_file(output_path)
+        send_discord_notification(f"{year}to{year + 1}のパターン抽出が完了しました。\n パターン数: {total}")
+        return
 
     logger.info(f"create pattern from {tmp_path}")
     sequences: list[list[str]] = load_from_json(tmp_path)
     logger.info("sequences: loaded")
-    filtered_sequences = []
-    print(f"filtering")
-    for sequence in sequences:
-        if is_all_symbols(sequence):
-            continue
-        if not contains_all_bracket_pairs(sequence):
-            continue
-        filtered_sequences.append(sequence)
     min_support = 10
-    prefix_span = PrefixSpan(min_support, year)
-    pattern_data_list = prefix_span.fit(sequences)
-
-    logger.info("filter pattern")
-    filtered_pattern_data = [
-        PatternWithSupport(pattern_data.pattern, pattern_data.support)
-        for pattern_data in pattern_data_list
-        if _has_change_pattern(pattern_data.pattern)
-    ]
+    # 変更トークンを含まないパターンは，マイニング中に枝刈りする
+    # 1トークンのパターンは出力しない(top_kの上位k個を1トークンのパターンが占めないよう，マイニング中に除く)
+    # 括弧の対応はrq1.filterで部分パターンを除いた後に判定するため，ここでは絞らない
+    # top_kを指定すると，supportの大きい上位top_k個のパターンだけを求める
+    # engine="spade"は縦型のエンジンで同じ結果を求める(n_jobs・top_kは未対応)
+    options = {"n_jobs": n_jobs, "top_k": top_k} if engine == "prefixspan" else {}
+    miner = create_miner(engine, min_support, year, min_pattern_length=2, require_change=True, **options)
+    pattern_data_list = miner.fit(sequences)
 
-    result = [
-        PatternWithSupport(pattern_data.pattern, pattern_data.support).to_dict()
-        for pattern_data in filtered_pattern_data
-    ]
+    result = [pattern_data.to_dict() for pattern_data in pattern_data_list]
 
     logger.info("dump pattern")
+    # 年ごとの結果はk-wayマージできるようパターンの順に並べておく(pattern.merge.process_all_patterns_parallel)
+    result.sort(key=pattern_key)
     total = len(result)
     send_discord_notification(f"{year}to{year + 1}のパターン抽出が完了しました。\n パターン数: {total}")
-    dump_to_json(result, output_path)
+    write_patterns(result, output_path)
+
+
+def incremental_process(year: int):
+    """{year}to{year + 1}の系列を保存済みの状態に追加し，それまでの全期間の頻出パターンを更新する
+
+    以前の年をマイニングし直さずに，全期間の系列でPrefixSpanをやり直した場合と同じパターンが得られる．
+    既に追加した年は，supportを二重に数えないよう飛ばす
+    """
+    state_path = path.INTERMEDIATE / "openstack" / "nova_incremental_state.json"
+    tmp_path = path.INTERMEDIATE / "openstack" / f"{year}to{year + 1}" / "nova.json"
+    output_path = path.RESULTS / "openstack_s10_t15" / "all" / f"incremental_nova_until_{year + 1}{PATTERN_SUFFIX}"
+
+    min_support = 10
+    if state_path.exists():
+        incremental = IncrementalPrefixSpan.load(state_path)
+    else:
+        incremental = IncrementalPrefixSpan(min_support)
+    if year in incremental.windows:
+        logger.info(f"{year}to{year + 1} has already been added to {state_path}")
+        return
+
+    logger.info(f"add sequences from {tmp_path}")
+    pattern_data_list = incremental.add(load_from_json(tmp_path), year)
+    incremental.save(state_path)
+
+    # 状態には後の追加で必要になる全ての頻出パターンを残すため，single_processと同じ条件は出力時に適用する
+    result = [
+        pattern_data.to_dict()
+        for pattern_data in pattern_data_list
+        if len(pattern_data.pattern) > 1
+        and any(token.startswith(("+", "-")) for token in pattern_data.pattern)
+    ]
+    logger.info("dump pattern")
+    write_patterns(result, output_path)
 
 
 def main():
@@ -140,8 +288,9 @@ def main():
     start_year = 2016
     end_year = 2025
     try:
-        # パターン作成
-        Parallel(n_jobs=2, verbose=10)(delayed(single_process)(year) for year in range(start_year, end_year))
+        # パターン作成．年ごとのマイニングの中で全コアを使うため，年は順に処理する
+        for year in range(start_year, end_year):
+            single_process(year)
         send_discord_notification("パターン作成終了")
         # 単純なマージ
         process_all_patterns_parallel("openstack_s10_t15", "nova", start_year, end_year)
@@ -1,7 +1,8 @@
 import numpy as np
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from constants import path
-from utils.file_processor import load_from_json, extract_project_name
+from utils.file_processor import extract_project_name
+from utils.pattern_store import iter_patterns
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -59,7 +60,7 @@ def calculate_match_rate(min_support2, filtered_patterns1, patterns2):
 
 if __name__ == "__main__":
     owner = "numpy"
-    dir_path = f"{path.INTERMEDIATE}/pattern/{owner}"
+    dir_path = path.INTERMEDIATE / "pattern" / owner
     # projects = ["numpy_numpy_Python_master.json", "numpy_numpy-financial_Python_master.json"]
     projects = ["numpy_numpydoc_master.json", "numpy_numpy.org_Python_master.json"]
     project_name = [extract_project_name(project, owner) for project in projects]
@@ -70,10 +71,10 @@ if __name__ == "__main__":
 
     for index, proj1 in enumerate(projects[:-1]):
         print(f"loading {proj1}")
-        patterns1 = load_from_json(f"{dir_path}/{proj1}")
+        patterns1 = list(iter_patterns(dir_path / proj1))
         for proj2 in projects[index:]:
             print(f"loading {proj2}")
-            patterns2 = load_from_json(f"{dir_path}/{proj2}")
+            patterns2 = list(iter_patterns(dir_path / proj2))
             for min_support1 in tqdm(support_values, desc="support1", leave=False):
                 filtered_patterns1 = filter_patterns_by_support(patterns1, min_support1)
                 with ProcessPoolExecutor() as executor:
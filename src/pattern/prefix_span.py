@@ -1,15 +1,126 @@
+import heapq
+import logging
+import tempfile
+from array import array
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+
 from constants import path
 from models.pattern import PatternWithSupport
-from utils.file_processor import dump_to_json
+from pattern.vocabulary import POSITION_TYPECODE, EncodedCorpus, Vocabulary
+from utils.file_processor import dump_to_jsonl, stream_json_patterns
+from utils.pattern_store import PatternWriter
+
+logger = logging.getLogger(__name__)
+
+# all: 全ての頻出パターン，closed: 同じsupportの上位パターンを持たないもの，maximal: 頻出な上位パターンを持たないもの
+MODES = ("all", "closed", "maximal")
+BRACKET_PAIRS = {"(": ")", "{": "}", "[": "]"}
+# 退避した投影DBを読むときに1度にリストへ戻す位置の数
+SPILL_CHUNK_SIZE = 1 << 16
 
 
 class PrefixSpan:
-    def __init__(self, min_support, start_year):
+    """PrefixSpanによる系列パターンマイニング
+
+    投影DBは接尾辞をコピーせず，共有のコーパス上の接尾辞の開始位置の配列で表す．
+    max_sequence_lengthより長い系列はマイニングの前に除外し，
+    INTERMEDIATE/{start_year}_too_long_sequences.jsonlへ出現回数とあわせて1回だけ書き出す(Noneなら除外しない)．
+    n_jobsが1以外なら，1番目の頻出アイテムごとの部分問題をプロセスプールで並列に探索する．
+
+    modeがclosed/maximalの場合はBIDEの方法で閉じた(極大な)パターンだけを出力する．
+    maximalの出力は，全パターンを求めてからrq1.term.remove_subset_patternsで部分パターンを除いた結果と集合として一致し，
+    出力順も全パターンの列挙順を保つため，remove_subset_patternsに通すと同じリストになる．
+
+    制約は探索中の枝刈りとして扱い，条件を満たすパターンを含みえない部分木は展開しない．
+    出力は制約なしの結果から条件を満たすパターンだけを残したものと一致する．
+    maximalとは組み合わせられない(制約を満たすパターンの中での極大性は，1アイテムの拡張だけでは判定できない)．
+        max_pattern_length: パターンの最大長
+        min_pattern_length: パターンの最小長．短いパターンは出力しないが，展開はする(top_kの上位k個にも入れない)
+        require_change: "+"か"-"のトークンを1つ以上含むパターンだけを出力する
+        balanced_brackets: 括弧の対応がとれたパターンだけを出力する(rq1.term.contains_all_bracket_pairsと同じ判定)
+        max_gap: パターン中の連続するアイテムの間に入ってよいトークン数の上限．
+            全ての出現位置を投影DBに持つ必要があるため，modeがallの場合のみ指定できる
+
+    top_kを指定すると，出力するパターンのうちsupportの大きい上位top_k個だけを返す(同じsupportなら列挙順の早いもの)．
+    上位k個がそろった後はk番目のsupportをmin_supportの代わりに使って枝刈りするため，min_supportを決めずに
+    1回の探索で済み，保持するパターンもk個に収まる．返す順序は列挙順．
+
+    memory_budgetを指定すると，探索中のスタックが持つ投影DBの合計がmemory_budget(バイト)を超える場合に，
+    新しい投影DBをINTERMEDIATE上の一時ファイルへ退避してnumpy.memmapで読む．
+    fit_fileと組み合わせると，系列の読み込み・パターンの書き出しもファイルから逐次に行う．
+    並列化・top_k・mode="all"以外とは組み合わせられない．
+    """
+
+    def __init__(
+        self,
+        min_support,
+        start_year,
+        max_sequence_length: int | None = 15,
+        n_jobs: int = 1,
+        mode: str = "all",
+        max_pattern_length: int | None = None,
+        min_pattern_length: int = 1,
+        require_change: bool = False,
+        balanced_brackets: bool = False,
+        max_gap: int | None = None,
+        top_k: int | None = None,
+        memory_budget: int | None = None,
+    ):
         if not isinstance(min_support, int) or min_support < 1:
             raise ValueError("min_support must be a positive integer")
+        if max_sequence_length is not None and max_sequence_length < 1:
+            raise ValueError("max_sequence_length must be a positive integer or None")
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        if max_pattern_length is not None and max_pattern_length < 1:
+            raise ValueError("max_pattern_length must be a positive integer or None")
+        if not isinstance(min_pattern_length, int) or min_pattern_length < 1:
+            raise ValueError("min_pattern_length must be a positive integer")
+        if mode == "maximal" and (
+            max_pattern_length is not None or min_pattern_length > 1 or require_change or balanced_brackets
+        ):
+            # 制約なしで極大なパターンを条件で絞ると，条件で絞ってから部分パターンを除いた結果と一致しない
+            raise ValueError(
+                "mode='maximal' cannot be combined with max_pattern_length, min_pattern_length, "
+                "require_change or balanced_brackets"
+            )
+        if max_gap is not None and max_gap < 0:
+            raise ValueError("max_gap must be a non-negative integer or None")
+        if max_gap is not None and mode != "all":
+            raise ValueError("max_gap can only be used with mode='all'")
+        if top_k is not None and top_k < 1:
+            raise ValueError("top_k must be a positive integer or None")
+        if memory_budget is not None and memory_budget < 1:
+            raise ValueError("memory_budget must be a positive integer or None")
+        if memory_budget is not None and (n_jobs != 1 or mode != "all" or top_k is not None):
+            raise ValueError("memory_budget can only be used with n_jobs=1, mode='all' and top_k=None")
         self.min_support = min_support
         self.start_year = start_year
+        self.max_sequence_length = max_sequence_length
+        self.n_jobs = n_jobs
+        self.mode = mode
+        self.max_pattern_length = max_pattern_length
+        self.min_pattern_length = min_pattern_length
+        self.require_change = require_change
+        self.balanced_brackets = balanced_brackets
+        self.max_gap = max_gap
+        self.top_k = top_k
+        self.memory_budget = memory_budget
+        self.top_patterns: TopKPatterns | None = None
+        # 指定されていれば，見つけたパターンをリストに貯めずにこの関数へ渡す
+        self.pattern_sink = None
         self.frequent_patterns: list[PatternWithSupport] = []
+        self.vocabulary = Vocabulary()
+
+    def __getstate__(self):
+        # ワーカーへはコーパスと設定だけを渡し，系列のリストなどのキャッシュは必要になったときに作り直す
+        state = self.__dict__.copy()
+        state.update(_sequences=None, _item_positions=None, frequent_patterns=[], top_patterns=None, pattern_sink=None)
+        return state
 
     def fit(self, sequences) -> list[PatternWithSupport]:
         if not sequences:
@@ -17,47 +128,562 @@ class PrefixSpan:
         if not all(isinstance(seq, (list, tuple)) for seq in sequences):
             raise ValueError("All sequences must be lists or tuples")
 
-        self.sequences = [tuple(seq) for seq in sequences]
-        self.prefix_span([], self.sequences)
+        self.build_corpus(sequences)
+        encoded_patterns = self.mine()
+
+        decode = self.vocabulary.decode
+        self.frequent_patterns.extend(
+            PatternWithSupport(decode(prefix), support) for prefix, support in encoded_patterns
+        )
         return self.frequent_patterns
 
-    def prefix_span(self, prefix, projected_db):
-        if not projected_db:
-            return
+    def fit_file(self, sequence_path: Path, output_path: Path, min_pattern_length: int = 1) -> int:
+        """系列のJSONファイルを逐次読み込んでマイニングし，パターンを見つけた順にoutput_pathへ書き出す
+
+        出力の形式はoutput_pathの拡張子で決まる(utils.pattern_store)．
+        同じ系列は読み込みながらまとめるため，元の系列のリストも全パターンのリストもメモリに持たない．
+        出力はfitの結果のうちmin_pattern_length以上の長さのパターンをto_dictしたものと一致する．
+
+        Returns:
+            int: 書き出したパターン数
+        """
+        if self.n_jobs != 1 or self.top_k is not None:
+            raise ValueError("fit_file can only be used with n_jobs=1 and top_k=None")
+        self.build_corpus(stream_json_patterns(sequence_path))
+        decode = self.vocabulary.decode
+
+        with PatternWriter(output_path) as writer:
+
+            def _write(pattern: tuple[list[int], int]) -> None:
+                prefix, support = pattern
+                if len(prefix) >= min_pattern_length:
+                    writer.write({"pattern": decode(prefix), "support": support})
 
-        freq_patterns = self.get_frequent_items(projected_db)
+            self.pattern_sink = _write
+            try:
+                # pattern_sinkを使わない探索(mode="all"以外・Spade)の結果は，返り値として受け取って書き出す
+                for pattern in self.mine():
+                    _write(pattern)
+            finally:
+                self.pattern_sink = None
+        return writer.count
 
-        for item, support in freq_patterns:
-            new_prefix = prefix + [item]
-            self.frequent_patterns.append(PatternWithSupport(new_prefix, support))
-            new_projected_db = self.build_projected_db(projected_db, item)
-            if new_projected_db:  # 空の投影DBをスキップ
-                self.prefix_span(new_prefix, new_projected_db)
+    def build_corpus(self, sequences) -> None:
+        """長すぎる系列を除いて同じ系列をまとめ，self.vocabularyとself.corpusを作る"""
+        # 同じ系列は1つにまとめ，出現回数を重みとしてsupportを数える
+        unique_sequences, weights = deduplicate_sequences(self.partition_sequences(sequences))
+        logger.info(f"deduplicated {sum(weights)} sequences into {len(unique_sequences)} unique sequences")
+
+        # トークンは文字列順に振った整数IDで扱い，出力時にだけ文字列へ戻す
+        self.vocabulary = Vocabulary.from_sequences(unique_sequences)
+        self.corpus = EncodedCorpus.from_sequences(self.vocabulary, unique_sequences, weights)
+        self._sequences = None
+        self._item_positions = None
+
+    def mine(self) -> list[tuple[list[int], int]]:
+        """self.corpusから頻出パターンをID列のまま列挙する"""
+        self.prepare_constraints()
+        self.start_top_k()
+        if self.n_jobs != 1:
+            encoded_patterns = self.parallel_prefix_span()
+            if self.top_patterns is not None:
+                # ワーカーごとの上位k個を列挙順に連結してから，全体の上位k個を選び直す
+                self.top_patterns.extend(encoded_patterns)
+                encoded_patterns = self.top_patterns.patterns()
+            return encoded_patterns
+
+        initial_db = self.corpus.initial_positions()
+        encoded_patterns = []
+        for item, support in self.get_frequent_items(initial_db):
+            encoded_patterns.extend(self.mine_subtree(item, support, self.first_level_db(initial_db, item)))
+        if self.top_patterns is not None:
+            encoded_patterns = self.top_patterns.patterns()
+        return encoded_patterns
+
+    def partition_sequences(self, sequences):
+        """長すぎる系列を除いた系列を順に返し，除外した系列は最後に出現回数とあわせてJSONLへ書き出す
+
+        入力を1度だけ走査するジェネレータなので，ファイルから逐次読み込んだ系列もそのまま渡せる
+        """
+        if self.max_sequence_length is None:
+            yield from sequences
+            return
 
-    def get_frequent_items(self, sequences):
-        items = {}
-        too_long_sequences = []
+        too_long_sequences: Counter[tuple[str, ...]] = Counter()
         for sequence in sequences:
-            if not sequence:
-                continue
-            if len(sequence) > 15:
-                too_long_sequences.append(sequence)
+            if len(sequence) > self.max_sequence_length:
+                too_long_sequences[tuple(sequence)] += 1
+            else:
+                yield sequence
+
+        output_path = path.INTERMEDIATE / f"{self.start_year}_too_long_sequences.jsonl"
+        dump_to_jsonl(
+            ({"sequence": list(sequence), "count": count} for sequence, count in too_long_sequences.most_common()),
+            output_path,
+        )
+        logger.info(
+            f"excluded {too_long_sequences.total()} sequences ({len(too_long_sequences)} unique) "
+            f"longer than {self.max_sequence_length} tokens: {output_path}"
+        )
+
+    def prefix_span(self, prefix: list[int], support: int, projected_db: array) -> list[tuple[list[int], int]]:
+        """prefixとそれを接頭辞とするパターンを深さ優先で列挙する
+
+        再帰の代わりに(接頭辞, 投影DB, 未処理の頻出アイテム)のスタックを使うため，系列が長くても再帰の上限に当たらない．
+        列挙の順序は再帰で書いた場合と同じになる．max_gapを指定した場合，投影DBはprefixの全ての出現の末尾の位置になる．
+        """
+        patterns: list[tuple[list[int], int]] = []
+        if self.top_patterns is not None:
+            emit = self.top_patterns.append
+        elif self.pattern_sink is not None:
+            emit = self.pattern_sink
+        else:
+            emit = patterns.append
+        constrained = self.has_constraints()
+
+        def _visit(prefix: list[int], support: int, projected_db: array):
+            state = None
+            if constrained:
+                state = self._constraint_state(prefix)
+                if state is None:
+                    return None
+            if state is None or self._should_emit(prefix, state):
+                emit((prefix, support))
+
+            if self.max_gap is None:
+                items = self.get_frequent_items(projected_db)
+                child_dbs = None
+            else:
+                items, child_dbs = self.get_gap_frequent_items(projected_db)
+            if not items:
+                return None
+            if constrained:
+                # 間隔の制約があると，後ろの方のアイテムは今の窓に入っていなくても出現しうるため，アイテムでは絞れない
+                known_items = [item for item, _ in items] if self.max_gap is None else None
+                if not self._can_extend(prefix, state, known_items):
+                    return None
+            if self.memory_budget is not None and isinstance(projected_db, array):
+                resident = sum(len(frame[1]) for frame in stack if isinstance(frame[1], array))
+                if (resident + len(projected_db)) * projected_db.itemsize > self.memory_budget:
+                    projected_db = self.spill(projected_db)
+            return prefix, projected_db, child_dbs, iter(items)
+
+        stack: list[tuple] = []
+        frame = _visit(prefix, support, projected_db)
+        if frame:
+            stack.append(frame)
+        while stack:
+            prefix, projected_db, child_dbs, items = stack[-1]
+            for item, support in items:
+                if support < self.support_threshold():
+                    continue
+                if child_dbs is None:
+                    new_projected_db = self.build_projected_db(projected_db, item)
+                else:
+                    new_projected_db = child_dbs[item]
+                frame = _visit(prefix + [item], support, new_projected_db)
+                if frame:
+                    stack.append(frame)
+                    break
+            else:
+                stack.pop()
+        return patterns
+
+    def spill(self, projected_db: array) -> np.memmap:
+        """投影DBを名前のない一時ファイルへ書き出し，memmapとして返す(参照がなくなるとファイルも消える)"""
+        path.INTERMEDIATE.mkdir(parents=True, exist_ok=True)
+        spilled = np.memmap(
+            tempfile.TemporaryFile(dir=path.INTERMEDIATE), dtype=np.int64, mode="w+", shape=(len(projected_db),)
+        )
+        spilled[:] = np.frombuffer(projected_db, dtype=np.int64)
+        spilled.flush()
+        return spilled
+
+    def parallel_prefix_span(self) -> list[tuple[list[int], int]]:
+        """1番目の頻出アイテムごとに投影DBを作ってプロセスプールへ渡し，結果を元の順序で連結する"""
+        initial_db = self.corpus.initial_positions()
+        first_items = self.get_frequent_items(initial_db)
+        if not first_items:
+            return []
+
+        # supportの大きいアイテムほど部分木も大きいので，偏らないよう順に振り分ける
+        n_chunks = min(len(first_items), effective_n_jobs(self.n_jobs) * 2)
+        chunks = [list(range(i, len(first_items), n_chunks)) for i in range(n_chunks)]
+
+        def _tasks(indices: list[int]) -> list[tuple[int, int, array]]:
+            return [
+                (first_items[i][0], first_items[i][1], self.first_level_db(initial_db, first_items[i][0]))
+                for i in indices
+            ]
+
+        results = Parallel(n_jobs=self.n_jobs, verbose=10)(
+            delayed(_mine_subtrees)(self, _tasks(indices)) for indices in chunks
+        )
+
+        subtrees: list[list[tuple[list[int], int]]] = [[] for _ in first_items]
+        for indices, chunk_patterns in zip(chunks, results):  # type: ignore
+            for i, patterns in zip(indices, chunk_patterns):
+                subtrees[i] = patterns
+        return [pattern for patterns in subtrees for pattern in patterns]
+
+    def first_level_db(self, initial_db: array, item: int) -> array:
+        """1番目のアイテムの部分問題に渡すDB
+
+        modeがallなら投影DB(max_gapを指定した場合はitemの全ての出現位置)，それ以外はitemが最初に現れた位置のDB
+        """
+        if self.max_gap is not None:
+            return self.item_positions()[item]
+        if self.mode == "all":
+            return self.build_projected_db(initial_db, item)
+
+        ends = self.corpus.ends
+        data = self.corpus.data
+        instance_db = array(POSITION_TYPECODE)
+        for begin in initial_db:
+            try:
+                instance_db.append(data.index(item, begin, ends[begin]))
+            except ValueError:
                 continue
-            unique_items = set(sequence)
-            for item in unique_items:
-                items[item] = items.get(item, 0) + 1
+        return instance_db
+
+    def mine_subtree(self, item: int, support: int, db: array) -> list[tuple[list[int], int]]:
+        """[item]とそれを接頭辞とするパターンを列挙する(top_kを指定した場合はtop_patternsへ入れて空のリストを返す)"""
+        if support < self.support_threshold():
+            return []
+        if self.mode == "all":
+            return self.prefix_span([item], support, db)
+        return self.closed_prefix_span(item, db)
+
+    def closed_prefix_span(self, item: int, instance_db: array) -> list[tuple[list[int], int]]:
+        """[item]を接頭辞とするパターンのうち，閉じた(maximalなら極大な)パターンを深さ優先で列挙する
+
+        instance_dbはitemを含む各系列での，itemが最初に現れた位置．
+        各接頭辞は，それを含む系列(接尾辞が空の系列も含む)・最初の出現の各アイテムの位置・系列の重みの組のリストで表す．
+        BIDEのBackScanで枝刈りできた接頭辞は，出力も展開もしない．
+        """
+        sequences = self._sequence_lists()
+        sids = self.corpus.sids
+        starts = self.corpus.starts
+        weights = self.corpus.weights
+        patterns: list[tuple[list[int], int]] = []
+        emit = patterns.append if self.top_patterns is None else self.top_patterns.append
+
+        def _visit(prefix: list[int], instances: list[tuple[list[int], list[int], int]]):
+            state = self._constraint_state(prefix)
+            support = sum(weight for _, _, weight in instances)
+            if state is None or self._can_prune(prefix, instances, support):
+                return None
+            suffix_items = [set(sequence[first[-1] + 1 :]) for sequence, first, _ in instances]
+            items: dict[int, int] = {}
+            for suffix, (_, _, weight) in zip(suffix_items, instances):
+                for suffix_item in suffix:
+                    items[suffix_item] = items.get(suffix_item, 0) + weight
+            if self._should_emit(prefix, state) and self._is_closed(prefix, instances, support, items):
+                emit((prefix, support))
+            threshold = self.support_threshold()
+            frequent_items = sorted(
+                [(suffix_item, support) for suffix_item, support in items.items() if support >= threshold],
+                key=lambda x: (-x[1], x[0]),
+            )
+            if not frequent_items or not self._can_extend(prefix, state, [item for item, _ in frequent_items]):
+                return None
+            return prefix, instances, suffix_items, iter(frequent_items)
+
+        root_instances = []
+        for position in instance_db:
+            sid = sids[position]
+            root_instances.append((sequences[sid], [position - starts[sid]], weights[sid]))
+        frame = _visit([item], root_instances)
+        stack = [frame] if frame else []
+        while stack:
+            prefix, instances, suffix_items, frequent_items = stack[-1]
+            for next_item, support in frequent_items:
+                if support < self.support_threshold():
+                    continue
+                new_instances = [
+                    (sequence, first + [sequence.index(next_item, first[-1] + 1)], weight)
+                    for (sequence, first, weight), suffix in zip(instances, suffix_items)
+                    if next_item in suffix
+                ]
+                frame = _visit(prefix + [next_item], new_instances)
+                if frame:
+                    stack.append(frame)
+                    break
+            else:
+                stack.pop()
+        return patterns
+
+    def start_top_k(self) -> None:
+        self.top_patterns = None if self.top_k is None else TopKPatterns(self.top_k)
+
+    def support_threshold(self) -> int:
+        """子を展開するのに必要なsupport．top_kを指定した場合は上位k個がそろうと引き上がる"""
+        if self.top_patterns is None:
+            return self.min_support
+        return max(self.min_support, self.top_patterns.threshold())
+
+    def prepare_constraints(self) -> None:
+        """制約の判定に使うトークンの種類をIDごとに求める"""
+        closing_brackets = {closing: opening for opening, closing in BRACKET_PAIRS.items()}
+        self._change_ids: set[int] = set()
+        self._opening_ids: dict[int, str] = {}
+        self._closing_ids: dict[int, str] = {}
+        self._closer_ids: dict[str, set[int]] = {closing: set() for closing in closing_brackets}
+        for token_id, token in enumerate(self.vocabulary.tokens):
+            if token.startswith(("+", "-")):
+                self._change_ids.add(token_id)
+            body = token[1:]
+            if body in BRACKET_PAIRS:
+                self._opening_ids[token_id] = BRACKET_PAIRS[body]
+            elif body in closing_brackets:
+                self._closing_ids[token_id] = body
+                self._closer_ids[body].add(token_id)
+
+    def has_constraints(self) -> bool:
+        """枝刈りに使う制約が1つでも指定されていればTrue(max_gapは投影DBの作り方で扱う)"""
+        return (
+            self.max_pattern_length is not None
+            or self.min_pattern_length > 1
+            or self.require_change
+            or self.balanced_brackets
+        )
+
+    def _constraint_state(self, prefix: list[int]) -> tuple[bool, list[str]] | None:
+        """prefixが変更トークンを含むかと，閉じていない括弧(に対応する閉じ括弧)のスタックを返す
+
+        末尾にアイテムを足しても直らない括弧の対応の誤りがあればNone
+        """
+        has_change = not self.require_change or any(item in self._change_ids for item in prefix)
+        brackets: list[str] = []
+        if self.balanced_brackets:
+            for item in prefix:
+                if item in self._opening_ids:
+                    brackets.append(self._opening_ids[item])
+                elif item in self._closing_ids:
+                    if not brackets or brackets.pop() != self._closing_ids[item]:
+                        return None
+        return has_change, brackets
+
+    def _should_emit(self, prefix: list[int], state: tuple[bool, list[str]]) -> bool:
+        has_change, brackets = state
+        return has_change and not brackets and len(prefix) >= self.min_pattern_length
+
+    def _can_extend(self, prefix: list[int], state: tuple[bool, list[str]], items: list[int] | None) -> bool:
+        """prefixを展開して出力できるパターンが得られる可能性があればTrue
+
+        itemsはprefixの投影DBでの頻出アイテム．子孫のパターンに足されるアイテムは全てこの中にある(不明ならNone)
+        """
+        has_change, brackets = state
+        remaining = None if self.max_pattern_length is None else self.max_pattern_length - len(prefix)
+        if remaining is not None and remaining < max(len(brackets), 1):
+            return False
+        if items is None:
+            return True
+        if not has_change and not any(item in self._change_ids for item in items):
+            return False
+        for closing in set(brackets):
+            if not any(item in self._closer_ids[closing] for item in items):
+                return False
+        return True
+
+    def _sequence_lists(self) -> list[list[int]]:
+        """閉じたパターンの判定では系列を前後に走査するため，系列ごとのリストを1度だけ作る"""
+        if getattr(self, "_sequences", None) is None:
+            data = self.corpus.data
+            starts = self.corpus.starts
+            self._sequences = [data[start:end].tolist() for start, end in zip(starts, starts[1:])]
+        return self._sequences
+
+    def _can_prune(self, prefix: list[int], instances, support: int) -> bool:
+        """BackScan: k番目のsemi-maximum periodに全系列で現れるアイテムがあれば，この接頭辞から閉じたパターンは作れない"""
+        anchors = [first[-1] for _, first, _ in instances]
+        return self._has_period_item(prefix, instances, anchors, support, support)
+
+    def _is_closed(self, prefix: list[int], instances, support: int, items: dict[int, int]) -> bool:
+        """前方・後方への1アイテムの拡張で，同じsupport(maximalなら頻出)の上位パターンが作れなければTrue"""
+        threshold = support if self.mode == "closed" else self.min_support
+        if any(count >= threshold for count in items.values()):
+            return False
+
+        # k番目のアイテムの直前に挿入できるのは，k番目のmaximum period(最も右にある出現を基準にした区間)に現れるアイテム
+        anchors = [_rindex(sequence, prefix[-1], len(sequence)) for sequence, _, _ in instances]
+        return not self._has_period_item(prefix, instances, anchors, support, threshold)
+
+    def _has_period_item(self, prefix: list[int], instances, anchors: list[int], support: int, threshold: int) -> bool:
+        """あるkについて，k番目の区間に現れる系列の重みの合計がthreshold以上になるアイテムがあればTrue
+
+        k番目の区間は，最初の出現のk-1番目の直後から，anchorsを末尾のアイテムの位置として
+        各アイテムをできるだけ右に寄せた出現のk番目の直前まで(anchorsが最初の出現の末尾ならsemi-maximum period，
+        最も右にある出現の末尾ならmaximum period)．右に寄せた位置はkを減らしながら系列ごとに必要な分だけ求める
+        """
+        n = len(prefix)
+        anchors = list(anchors)
+        anchor_k = [n - 1] * len(instances)
+        for k in range(n - 1, -1, -1):
+            common: set[int] | None = None
+            counts: dict[int, int] = {}
+            for i, (sequence, first, weight) in enumerate(instances):
+                while anchor_k[i] > k:
+                    anchor_k[i] -= 1
+                    anchors[i] = _rindex(sequence, prefix[anchor_k[i]], anchors[i])
+                period = set(sequence[first[k - 1] + 1 if k else 0 : anchors[i]])
+
+                if threshold == support:
+                    # 全系列に現れる必要があるので，共通部分が空になった時点で打ち切る
+                    common = period if common is None else common & period
+                    if not common:
+                        break
+                else:
+                    for item in period:
+                        counts[item] = counts.get(item, 0) + weight
+                        if counts[item] >= threshold:
+                            return True
+            if common:
+                return True
+        return False
+
+    def get_frequent_items(self, projected_db: array) -> list[tuple[int, int]]:
+        ends = self.corpus.ends
+        view = self.corpus.view
+        sids = self.corpus.sids
+        weights = self.corpus.weights
+        items: dict[int, int] = {}
+        for begin in _positions(projected_db):
+            weight = weights[sids[begin]]
+            for item in set(view[begin : ends[begin]]):
+                items[item] = items.get(item, 0) + weight
 
-        dump_to_json(too_long_sequences, path.INTERMEDIATE / f"{self.start_year}_too_long_sequences.json")
         return sorted(
-            [(item, support) for item, support in items.items() if support >= self.min_support],
+            [(item, support) for item, support in items.items() if support >= self.support_threshold()],
             key=lambda x: (-x[1], x[0]),
         )
 
-    def build_projected_db(self, projected_db, item):
-        new_projected_db = []
-        for sequence in projected_db:
-            for i, current_item in enumerate(sequence):
-                if current_item == item and i + 1 < len(sequence):
-                    new_projected_db.append(sequence[i + 1 :])
-                    break
+    def get_gap_frequent_items(self, end_positions: array) -> tuple[list[tuple[int, int]], dict[int, array]]:
+        """各出現の末尾からmax_gap + 1個先までの窓に現れるアイテムを，系列ごとに1回ずつ数える
+
+        頻出アイテムとあわせて，それを末尾に足したパターンの全ての出現の末尾の位置(子の投影DB)を返す
+        """
+        data = self.corpus.data
+        ends = self.corpus.ends
+        sids = self.corpus.sids
+        weights = self.corpus.weights
+        width = self.max_gap + 2
+        positions: dict[int, array] = {}
+        supports: dict[int, int] = {}
+        last_sids: dict[int, int] = {}
+        window_end = 0
+        for end_position in end_positions:
+            # 同じ系列の窓は重なりうるため，走査済みの位置は飛ばす(位置の重複もなくなる)
+            begin = max(end_position + 1, window_end)
+            window_end = min(end_position + width, ends[end_position])
+            for position in range(begin, window_end):
+                item = data[position]
+                if item not in positions:
+                    positions[item] = array(POSITION_TYPECODE)
+                positions[item].append(position)
+                sid = sids[position]
+                if last_sids.get(item) != sid:
+                    last_sids[item] = sid
+                    supports[item] = supports.get(item, 0) + weights[sid]
+
+        items = sorted(
+            [(item, support) for item, support in supports.items() if support >= self.support_threshold()],
+            key=lambda x: (-x[1], x[0]),
+        )
+        return items, {item: positions[item] for item, _ in items}
+
+    def item_positions(self) -> dict[int, array]:
+        """アイテムごとの全ての出現位置"""
+        if self._item_positions is None:
+            self._item_positions = {}
+            for position, item in enumerate(self.corpus.data):
+                if item not in self._item_positions:
+                    self._item_positions[item] = array(POSITION_TYPECODE)
+                self._item_positions[item].append(position)
+        return self._item_positions
+
+    def build_projected_db(self, projected_db: array, item: int) -> array:
+        """各接尾辞でitemが最初に現れた位置の次を指す位置を集める"""
+        ends = self.corpus.ends
+        data = self.corpus.data
+        new_projected_db = array(POSITION_TYPECODE)
+        for begin in _positions(projected_db):
+            end = ends[begin]
+            try:
+                i = data.index(item, begin, end)
+            except ValueError:
+                continue
+            if i + 1 < end:
+                new_projected_db.append(i + 1)
         return new_projected_db
+
+
+def _positions(projected_db):
+    """投影DBの位置を順に返す．退避したmemmapは少しずつPythonのintのリストへ戻して読む"""
+    if isinstance(projected_db, array):
+        return projected_db
+    return (
+        position
+        for start in range(0, len(projected_db), SPILL_CHUNK_SIZE)
+        for position in projected_db[start : start + SPILL_CHUNK_SIZE].tolist()
+    )
+
+
+def _rindex(sequence: list[int], item: int, stop: int) -> int:
+    """sequence[:stop]でitemが最後に現れる位置"""
+    if stop <= 0:
+        raise ValueError(f"{item} is not in sequence")
+    return stop - 1 - sequence[stop - 1 :: -1].index(item)
+
+
+def deduplicate_sequences(sequences) -> tuple[list[tuple[str, ...]], list[int]]:
+    """同じ系列を1つにまとめ，最初に現れた順の系列とその出現回数を返す"""
+    counts = Counter(tuple(sequence) for sequence in sequences)
+    return list(counts), list(counts.values())
+
+
+class TopKPatterns:
+    """supportの大きい上位k個のパターンを保持するヒープ
+
+    (support, -列挙順)が最小の要素を根に置くため，同じsupportなら後から列挙されたパターンから外れる
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.heap: list[tuple[int, int, list[int]]] = []
+        self.count = 0
+
+    def append(self, pattern: tuple[list[int], int]) -> None:
+        prefix, support = pattern
+        entry = (support, -self.count, prefix)
+        self.count += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def extend(self, patterns: list[tuple[list[int], int]]) -> None:
+        for pattern in patterns:
+            self.append(pattern)
+
+    def threshold(self) -> int:
+        """新たに上位k個に入るのに必要なsupport(後から列挙されるパターンは同点では入れない)"""
+        if len(self.heap) < self.k:
+            return 0
+        return self.heap[0][0] + 1
+
+    def patterns(self) -> list[tuple[list[int], int]]:
+        """保持しているパターンを列挙順に返す"""
+        return [(prefix, support) for support, _, prefix in sorted(self.heap, key=lambda entry: -entry[1])]
+
+
+def _mine_subtrees(miner: PrefixSpan, tasks: list[tuple[int, int, array]]) -> list[list[tuple[list[int], int]]]:
+    """ワーカー側: 1番目のアイテムごとに，そのアイテムから始まるパターンを列挙する"""
+    miner.start_top_k()
+    results = [miner.mine_subtree(item, support, db) for item, support, db in tasks]
+    if miner.top_patterns is not None:
+        # 上位k個はワーカー内の部分木で共有して選ぶので，最後に1番目のアイテムごとに分け直す
+        task_index = {item: i for i, (item, _, _) in enumerate(tasks)}
+        for prefix, support in miner.top_patterns.patterns():
+            results[task_index[prefix[0]]].append((prefix, support))
+    return results
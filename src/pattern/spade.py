@@ -0,0 +1,114 @@
+import numpy as np
+
+from pattern.prefix_span import PrefixSpan
+
+
+class Spade(PrefixSpan):
+    """SPADEと同じ縦型(id-list)の表現で頻出パターンを列挙するエンジン
+
+    アイテムごとに全ての出現位置(コーパス上の位置．系列番号の順に並ぶ)をNumPy配列で持ち，
+    パターンは各系列での最初の出現の末尾の位置の配列(id-list)で表す．P+[item]のid-listは，
+    Pのid-listの各位置より後ろにあるitemの最初の出現をnp.searchsortedで一括に求めて作る．
+    子の候補は親の頻出な子のアイテムに限る(P+[x]+[item]が頻出ならP+[item]も頻出)．
+
+    系列の前処理(長すぎる系列の除外・重複の集約)・制約・出力(パターン・support・順序)はPrefixSpanのmode="all"と同じ．
+    短い系列が密に集まったコーパスでは，投影DBを作り直すより速いことがある．
+    """
+
+    def __init__(
+        self,
+        min_support,
+        start_year,
+        max_sequence_length: int | None = 15,
+        max_pattern_length: int | None = None,
+        min_pattern_length: int = 1,
+        require_change: bool = False,
+        balanced_brackets: bool = False,
+    ):
+        super().__init__(
+            min_support,
+            start_year,
+            max_sequence_length=max_sequence_length,
+            max_pattern_length=max_pattern_length,
+            min_pattern_length=min_pattern_length,
+            require_change=require_change,
+            balanced_brackets=balanced_brackets,
+        )
+
+    def mine(self) -> list[tuple[list[int], int]]:
+        self.prepare_constraints()
+        data = np.frombuffer(self.corpus.data, dtype=np.int32)
+        if not len(data):
+            return []
+        self.ends = np.frombuffer(self.corpus.ends, dtype=np.int64)
+        sids = np.frombuffer(self.corpus.sids, dtype=np.int32)
+        # 位置ごとに，その位置を含む系列の重み
+        self.position_weights = np.frombuffer(self.corpus.weights, dtype=np.int64)[sids]
+
+        # アイテムごとの出現位置．安定ソートなので各アイテムの中では位置の昇順になる
+        order = np.argsort(data, kind="stable")
+        boundaries = np.cumsum(np.bincount(data))
+        self.occurrences = np.split(order, boundaries[:-1])
+
+        first_items = []
+        for item, positions in enumerate(self.occurrences):
+            if not len(positions):
+                continue
+            # 系列ごとの最初の出現
+            item_sids = sids[positions]
+            id_list = positions[np.concatenate(([True], item_sids[1:] != item_sids[:-1]))]
+            support = int(self.position_weights[id_list].sum())
+            if support >= self.min_support:
+                first_items.append((item, support, id_list))
+        first_items.sort(key=lambda x: (-x[1], x[0]))
+
+        patterns: list[tuple[list[int], int]] = []
+        constrained = self.has_constraints()
+
+        def _visit(prefix: list[int], support: int, id_list: np.ndarray, candidates: list[int]):
+            # 制約の扱いはPrefixSpan.prefix_spanと同じ
+            state = None
+            if constrained:
+                state = self._constraint_state(prefix)
+                if state is None:
+                    return None
+            if state is None or self._should_emit(prefix, state):
+                patterns.append((prefix, support))
+            if self.max_pattern_length is not None and len(prefix) >= self.max_pattern_length:
+                return None
+
+            children = self.extend(id_list, candidates)
+            child_items = [item for item, _, _ in children]
+            if not children or (constrained and not self._can_extend(prefix, state, child_items)):
+                return None
+            return prefix, child_items, iter(children)
+
+        stack = [([], [item for item, _, _ in first_items], iter(first_items))]
+        while stack:
+            prefix, candidates, children = stack[-1]
+            for item, support, id_list in children:
+                frame = _visit(prefix + [item], support, id_list, candidates)
+                if frame:
+                    stack.append(frame)
+                    break
+            else:
+                stack.pop()
+        return patterns
+
+    def extend(self, id_list: np.ndarray, candidates: list[int]) -> list[tuple[int, int, np.ndarray]]:
+        """id_listで表すパターンの後ろに候補のアイテムを足し，頻出なものを(アイテム, support, id-list)で返す"""
+        ends = self.ends[id_list]
+        children = []
+        for item in candidates:
+            positions = self.occurrences[item]
+            # 各系列で，パターンの末尾より後ろにあるitemの最初の出現
+            index = np.searchsorted(positions, id_list, side="right")
+            found = index < len(positions)
+            next_positions = positions[np.minimum(index, len(positions) - 1)]
+            found &= next_positions < ends
+            new_id_list = next_positions[found]
+            support = int(self.position_weights[new_id_list].sum())
+            if support >= self.min_support:
+                children.append((item, support, new_id_list))
+        children.sort(key=lambda x: (-x[1], x[0]))
+        return children
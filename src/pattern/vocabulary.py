@@ -0,0 +1,95 @@
+from array import array
+from typing import Iterable, Sequence
+
+# 符号付きトークンのIDを格納する配列の型(C言語のint)
+TYPECODE = "i"
+# コーパス上の位置を格納する配列の型
+POSITION_TYPECODE = "q"
+
+
+class Vocabulary:
+    """符号付きトークン("-x", "+x", "=x")と整数IDの対応表
+
+    from_sequencesで作った場合，IDはトークンの文字列順に振られるため，
+    ID列の大小比較・ソートの結果は文字列のリストの場合と一致する．
+    """
+
+    def __init__(self, tokens: Iterable[str] = ()):
+        self.tokens: list[str] = []
+        self.ids: dict[str, int] = {}
+        for token in tokens:
+            self.intern(token)
+
+    @classmethod
+    def from_sequences(cls, sequences: Iterable[Sequence[str]]) -> "Vocabulary":
+        """系列に含まれる全トークンを文字列順にIDへ対応づける"""
+        return cls(sorted({token for sequence in sequences for token in sequence}))
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.ids
+
+    def intern(self, token: str) -> int:
+        """トークンのIDを返す．未登録なら末尾のIDを振る(この場合は文字列順と一致しない)"""
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return token_id
+
+    def encode(self, sequence: Iterable[str]) -> array:
+        return array(TYPECODE, [self.intern(token) for token in sequence])
+
+    def encode_all(self, sequences: Iterable[Sequence[str]]) -> list[array]:
+        return [self.encode(sequence) for sequence in sequences]
+
+    def decode(self, ids: Iterable[int]) -> list[str]:
+        tokens = self.tokens
+        return [tokens[token_id] for token_id in ids]
+
+
+class EncodedCorpus:
+    """全系列のIDを1つの配列へ連結して保持する読み取り専用のコーパス
+
+    sid番目の系列はdata[starts[sid]:starts[sid + 1]]にある．sids[pos]・ends[pos]は位置posを含む系列の番号と終端で，
+    接尾辞は開始位置1つだけで表せるため，投影DBはコーパス上の位置の配列で済む(系列番号とオフセットの組と等価)．
+    weights[sid]はsid番目の系列の重み(同じ系列をまとめた場合の出現回数)で，supportは重みの合計として数える．
+    """
+
+    def __init__(self, data: array, starts: array, weights: array | None = None):
+        self.data = data
+        self.starts = starts
+        if weights is None:
+            weights = array(POSITION_TYPECODE, [1]) * (len(starts) - 1)
+        self.weights = weights
+        self.view = memoryview(data)
+        self.sids = array(TYPECODE)
+        self.ends = array(POSITION_TYPECODE)
+        for sid, (start, end) in enumerate(zip(starts, starts[1:])):
+            self.sids.extend([sid] * (end - start))
+            self.ends.extend([end] * (end - start))
+
+    @classmethod
+    def from_sequences(
+        cls, vocabulary: Vocabulary, sequences: Iterable[Sequence[str]], weights: Iterable[int] | None = None
+    ) -> "EncodedCorpus":
+        data = array(TYPECODE)
+        starts = array(POSITION_TYPECODE, [0])
+        for sequence in sequences:
+            data.extend(vocabulary.intern(token) for token in sequence)
+            starts.append(len(data))
+        return cls(data, starts, None if weights is None else array(POSITION_TYPECODE, weights))
+
+    def __reduce__(self):
+        # memoryviewはpickleできないため，プロセス間では元の配列だけを渡して作り直す
+        return self.__class__, (self.data, self.starts, self.weights)
+
+    def __len__(self) -> int:
+        return len(self.starts) - 1
+
+    def initial_positions(self) -> array:
+        """空でない各系列の先頭位置．全系列をそのまま投影DBとした場合に相当する"""
+        starts = self.starts
+        return array(POSITION_TYPECODE, [start for start, end in zip(starts, starts[1:]) if start < end])
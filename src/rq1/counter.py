@@ -7,6 +7,7 @@ from tqdm import tqdm
 from constants import path
 from pattern.prefix_span import PrefixSpan
 from pattern.diff2sequence import compute_token_diff, extract_diff
+from utils.diff_handler import resolve_diff_path
 
 
 def create_combination(sequence):
@@ -65,6 +66,6 @@ def load_token_diff(diff_path: Path, save_path: Path):
     plt.savefig(save_path)
 
 # 関数の呼び出し例
-diff_path = path.RESOURCE/"openstack"/"2013to2014"/"neutron.json"  # JSONファイルのパスを指定
+diff_path = resolve_diff_path(path.RESOURCE/"openstack"/"2013to2014", "neutron")  # diffのファイルを指定
 save_path = path.RESULTS/"openstack.png"
 load_token_diff(diff_path, save_path)
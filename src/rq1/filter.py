@@ -1,4 +1,4 @@
-from itertools import chain, islice
+from itertools import chain
 from pathlib import Path
 
 from joblib import Parallel, delayed
@@ -6,18 +6,24 @@ from joblib import Parallel, delayed
 from constants import path
 from models.pattern import PatternWithSupport
 from pattern.merge import merge_pattern_results
-from rq1.term import contains_all_bracket_pairs, is_all_symbols, is_change_pattern, remove_subset_patterns
+from rq1.term import (
+    contains_all_bracket_pairs,
+    is_all_symbols,
+    is_change_pattern,
+    remove_subset_patterns,
+    remove_subset_patterns_sharded,
+)
 from utils.discord import send_discord_notification
-from utils.file_processor import dump_to_json, load_from_json, stream_json_patterns
+from utils.file_processor import load_from_json
+from utils.pattern_store import PATTERN_SUFFIX, iter_pattern_chunks, load_patterns, write_patterns
 
 
 def single_pre_process(base_path: Path, year: int) -> list[PatternWithSupport]:
-    input_path = base_path / f"{year}to{year + 1}" / "nova.json"
-    output_path = base_path / f"{year}to{year + 1}" / "filtered_nova.json"
+    input_path = base_path / f"{year}to{year + 1}" / f"nova{PATTERN_SUFFIX}"
+    output_path = base_path / f"{year}to{year + 1}" / f"filtered_nova{PATTERN_SUFFIX}"
 
     # パターンの読み込み
-    data = load_from_json(input_path)
-    patterns = [PatternWithSupport.from_dict(item) for item in data]
+    patterns = load_patterns(input_path)
 
     # 変更パターン以外を削除
     # changed_pattern = [pattern for pattern in patterns if is_change_pattern(pattern.pattern)]
@@ -25,8 +31,7 @@ def single_pre_process(base_path: Path, year: int) -> list[PatternWithSupport]:
     unique_patterns = remove_subset_patterns(patterns)
 
     # 保存
-    unique_data = [pattern.to_dict() for pattern in unique_patterns]
-    dump_to_json(unique_data, output_path)
+    write_patterns(unique_patterns, output_path)
 
     return unique_patterns
 
@@ -47,11 +52,8 @@ def process_chunk_filter(chunk: list[dict]) -> list[PatternWithSupport]:
 
 
 def parallel_filtering(file_path: Path, chunk_size: int = 1000, n_jobs: int = -1) -> list[PatternWithSupport]:
-    patterns = stream_json_patterns(file_path)
     filtered_chunks = Parallel(n_jobs=n_jobs, verbose=10)(
-        delayed(process_chunk_filter)(chunk)
-        for chunk in iter(lambda: list(islice(patterns, chunk_size)), [])
-        if chunk  # 空チャンクをスキップ
+        delayed(process_chunk_filter)(chunk) for chunk in iter_pattern_chunks(file_path, chunk_size)
     )
     filtered_patterns = list(chain.from_iterable(filtered_chunks))  # type: ignore
     return filtered_patterns
@@ -78,17 +80,15 @@ def parallel_process(base_path: Path, start_year: int, end_year: int):
     """"""
 
     def _subset_filter(year: int) -> list[PatternWithSupport]:
-        input_path = base_path / f"{year}to{year + 1}" / "nova.json"
+        input_path = base_path / f"{year}to{year + 1}" / f"nova{PATTERN_SUFFIX}"
 
-        data = load_from_json(input_path)
-        patterns = [PatternWithSupport.from_dict(item) for item in data]
+        patterns = load_patterns(input_path)
 
         # 部分パターン削除
         subset_patterns = remove_subset_patterns(patterns)
         # 保存
-        subset_path = base_path / f"{year}to{year + 1}" / "subset_nova.json"
-        subset_patterns_dict = [pattern.to_dict() for pattern in subset_patterns]
-        dump_to_json(subset_patterns_dict, subset_path)
+        subset_path = base_path / f"{year}to{year + 1}" / f"subset_nova{PATTERN_SUFFIX}"
+        write_patterns(subset_patterns, subset_path)
 
         return subset_patterns
 
@@ -97,7 +97,8 @@ def parallel_process(base_path: Path, start_year: int, end_year: int):
     send_discord_notification("年ごとの重複削除完了")
 
     merged_patterns = merge_pattern_results(flat_results)
-    not_subset = remove_subset_patterns(merged_patterns)
+    # 全期間の部分パターン削除は候補をシャードに分けて全コアで行う
+    not_subset = remove_subset_patterns_sharded(merged_patterns)
 
     # 構造エラーのものを削除
     custom_filtered_patterns = []
@@ -108,8 +109,8 @@ def parallel_process(base_path: Path, start_year: int, end_year: int):
             continue
         custom_filtered_patterns.append(pattern)
 
-    custom_path = base_path / "all" / "filtered_now_nova.json"
-    dump_to_json(custom_filtered_patterns, custom_path)
+    custom_path = base_path / "all" / f"filtered_now_nova{PATTERN_SUFFIX}"
+    write_patterns(custom_filtered_patterns, custom_path)
     send_discord_notification(
         f"カスタムフィルタリング完全終了\n 構造エラーの数: {len(merged_patterns) - len(custom_filtered_patterns)}"
     )
@@ -117,8 +118,8 @@ def parallel_process(base_path: Path, start_year: int, end_year: int):
     # 変更パターン以外削除
     no_change_patterns = [pattern for pattern in not_subset if is_change_pattern(pattern.pattern)]
 
-    no_change_path = base_path / "all" / "pre_filtered_full_nova.json"
-    dump_to_json(no_change_patterns, no_change_path)
+    no_change_path = base_path / "all" / f"pre_filtered_full_nova{PATTERN_SUFFIX}"
+    write_patterns(no_change_patterns, no_change_path)
     send_discord_notification("従来研究のフィルタリング終了")
 
 
@@ -1,6 +1,12 @@
+import multiprocessing
 import string
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence
+
+from joblib import effective_n_jobs
 
 from models.pattern import PatternWithSupport
+from pattern.vocabulary import Vocabulary
 
 
 def is_longer_pattern(pattern: list[str], length: int) -> bool:
@@ -13,7 +19,7 @@ def is_all_symbols(pattern: list[str]) -> bool:
     return all(token[1:] in string.punctuation for token in pattern)
 
 
-def is_subsequence(sub: list[str], seq: list[str]) -> bool:
+def is_subsequence(sub: Sequence, seq: Sequence) -> bool:
     """`sub` が `seq` の順序を保った部分列であるかを確認"""
     it = iter(seq)
     return all(token in it for token in sub)
@@ -57,13 +63,137 @@ def is_change_pattern(pattern: list[str]):
 
 
 def remove_subset_patterns(patterns: list[PatternWithSupport]) -> list[PatternWithSupport]:
-    """順序を考慮して部分的に重複するパターンを削除"""
+    """順序を考慮して部分的に重複するパターンを削除
+
+    残したパターンについてトークンから番号への転置索引を持ち，候補の全てのトークンを含む残したパターンだけを
+    部分列の判定にかける．結果は残した全てのパターンと比べる場合と同じ
+    """
     # パターンを長さ順に降順ソート
     patterns.sort(key=lambda x: sum(len(token) for token in x.pattern), reverse=True)
 
-    unique_patterns = []
+    # 部分列の判定はトークンを整数IDに置き換えて行う
+    vocabulary = Vocabulary.from_sequences(pattern.pattern for pattern in patterns)
+
     print("start remove")
-    for pattern in patterns:
-        if not any(is_subsequence(pattern.pattern, other.pattern) for other in unique_patterns):
-            unique_patterns.append(PatternWithSupport(pattern.pattern, pattern.support))
-    return unique_patterns
+    encoded = [tuple(vocabulary.encode(pattern.pattern)) for pattern in patterns]
+    return [
+        PatternWithSupport(patterns[index].pattern, patterns[index].support)
+        for index in _kept_indices(encoded, len(vocabulary))
+    ]
+
+
+def remove_subset_patterns_sharded(patterns: list[PatternWithSupport], n_jobs: int = -1) -> list[PatternWithSupport]:
+    """remove_subset_patternsと同じ結果を，候補をシャードに分けて並列に求める
+
+    パターンが消えるのは，並べた順でそれより前の異なるパターンの部分列である場合で，部分列の関係は推移的なので
+    他のどのパターンの部分列でもない(極大な)パターンのいずれかの部分列である場合と同じになる．
+    1. 候補を最も出現の少ないトークンで分け，シャードごとにremove_subset_patternsと同じ処理で残るものを求める．
+       極大なパターンは自分のシャードでも必ず残る
+    2. 1で残ったパターンの転置索引を共有し，1で残った各パターンを他のシャードのものも含めて判定し直す
+    索引はforkしたワーカーへinitializerで渡し，各シャードからは残るパターンの番号だけを受け取る．
+    """
+    patterns.sort(key=lambda x: sum(len(token) for token in x.pattern), reverse=True)
+    vocabulary = Vocabulary.from_sequences(pattern.pattern for pattern in patterns)
+
+    # 同じパターンは最初のものだけが残る
+    distinct: dict[tuple[int, ...], int] = {}
+    for index, pattern in enumerate(patterns):
+        distinct.setdefault(tuple(vocabulary.encode(pattern.pattern)), index)
+    encoded = list(distinct)
+
+    document_frequency = [0] * len(vocabulary)
+    for tokens in encoded:
+        for token in set(tokens):
+            document_frequency[token] += 1
+    shards: dict[int, list[int]] = {}
+    for pattern_id, tokens in enumerate(encoded):
+        rarest = min(tokens, key=document_frequency.__getitem__, default=-1)
+        shards.setdefault(rarest, []).append(pattern_id)
+
+    n_workers = min(effective_n_jobs(n_jobs), len(shards))
+    if n_workers <= 1:
+        survivors = _kept_indices(encoded, len(vocabulary))
+    else:
+        # 大きいシャードから，候補の合計が最も少ないタスクへ振り分ける(タスク内は並べた順を保つ)
+        tasks: list[list[int]] = [[] for _ in range(n_workers * 2)]
+        for shard in sorted(shards.values(), key=len, reverse=True):
+            min(tasks, key=len).extend(shard)
+        tasks = [sorted(task) for task in tasks if task]
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(
+            n_workers, mp_context=context, initializer=_init_subset_index, initargs=(encoded, len(vocabulary))
+        ) as executor:
+            local_survivors = sorted(
+                pattern_id for result in executor.map(_shard_survivors, tasks) for pattern_id in result
+            )
+
+        postings: list[set[int]] = [set() for _ in range(len(vocabulary))]
+        for pattern_id in local_survivors:
+            for token in encoded[pattern_id]:
+                postings[token].add(pattern_id)
+        chunks = [local_survivors[i :: n_workers * 2] for i in range(n_workers * 2)]
+        with ProcessPoolExecutor(
+            n_workers, mp_context=context, initializer=_init_subset_index, initargs=(encoded, postings)
+        ) as executor:
+            survivors = sorted(
+                pattern_id for result in executor.map(_global_survivors, chunks) for pattern_id in result
+            )
+
+    # 異なるパターンの番号は，並べた順で最初に現れた位置の順になっている
+    return [
+        PatternWithSupport(patterns[index].pattern, patterns[index].support)
+        for index in (distinct[encoded[pattern_id]] for pattern_id in survivors)
+    ]
+
+
+def _kept_indices(encoded: list[tuple[int, ...]], vocabulary_size: int) -> list[int]:
+    """並べた順に，それまでに残したパターンの部分列でないパターンを残し，その番号を返す"""
+    kept: list[int] = []
+    # トークンのIDごとに，そのトークンを含む残したパターンの番号
+    postings: list[set[int]] = [set() for _ in range(vocabulary_size)]
+    for index, pattern in enumerate(encoded):
+        tokens = set(pattern)
+        if tokens:
+            # 含むパターンの少ないトークンから積集合をとる
+            token_postings = sorted((postings[token] for token in tokens), key=len)
+            candidates = token_postings[0].intersection(*token_postings[1:])
+        else:
+            candidates = set(kept)
+        if not any(is_subsequence(pattern, encoded[other]) for other in candidates):
+            for token in tokens:
+                postings[token].add(index)
+            kept.append(index)
+    return kept
+
+
+# ワーカーが読む(異なるパターンのID列, 索引)．_init_subset_indexで設定する
+_subset_index: tuple[list[tuple[int, ...]], list[set[int]] | int] = ([], 0)
+
+
+def _init_subset_index(encoded: list[tuple[int, ...]], index: list[set[int]] | int) -> None:
+    global _subset_index
+    _subset_index = (encoded, index)
+
+
+def _shard_survivors(pattern_ids: list[int]) -> list[int]:
+    """シャードの中だけで部分パターンを除き，残ったパターンの番号を返す"""
+    encoded, vocabulary_size = _subset_index
+    kept = _kept_indices([encoded[pattern_id] for pattern_id in pattern_ids], vocabulary_size)  # type: ignore
+    return [pattern_ids[index] for index in kept]
+
+
+def _global_survivors(pattern_ids: list[int]) -> list[int]:
+    """索引にある他のどのパターンの部分列でもないパターンの番号を返す"""
+    encoded, postings = _subset_index
+    survivors = []
+    for pattern_id in pattern_ids:
+        pattern = encoded[pattern_id]
+        tokens = set(pattern)
+        if tokens:
+            token_postings = sorted((postings[token] for token in tokens), key=len)  # type: ignore
+            candidates = token_postings[0].intersection(*token_postings[1:])
+        else:
+            candidates = set().union(*postings)  # type: ignore
+        if not any(other != pattern_id and is_subsequence(pattern, encoded[other]) for other in candidates):
+            survivors.append(pattern_id)
+    return survivors
@@ -10,7 +10,7 @@ from constants import path
 from models.diff import DiffHunk
 from pattern.confidence import is_actually_change, is_trigger_sequence
 from models.gerrit import DiffData
-from utils.diff_handler import DiffDataHandler
+from utils.diff_handler import DiffDataHandler, resolve_diff_path
 from utils.discord import send_discord_notification
 
 
@@ -31,10 +31,8 @@ def extract_change_time(item: DiffData, pattern: list[str]) -> datetime | None:
 
 
 def parallel_extract_change_time(diff_path: Path, pattern: list[str]) -> list[datetime]:
-    data_list = DiffDataHandler.load_from_json(diff_path)
-
     merged_time_list = Parallel(n_jobs=-1, verbose=10)(
-        delayed(extract_change_time)(item, pattern) for item in data_list
+        delayed(extract_change_time)(item, pattern) for item in DiffDataHandler.stream(diff_path)
     )
 
     return list(filter(None, merged_time_list))
@@ -96,7 +94,7 @@ if __name__ == "__main__":
 
     change_times = []
     for year in range(start_year, end_year):
-        diff_path = path.RESOURCE / owner / f"{year}to{year + 1}" / f"{repo}.json"
+        diff_path = resolve_diff_path(path.RESOURCE / owner / f"{year}to{year + 1}", repo)
         change_times.extend(parallel_extract_change_time(diff_path, pattern))
 
     change_times.sort()
@@ -1,12 +1,53 @@
 import json
-
+import sys
 from pathlib import Path
+from typing import Iterable, Iterator
+
+import ijson
+import orjson
 
 from models.gerrit import DiffData
 
+try:
+    import zstandard
+except ImportError:  # zstd圧縮したファイルを扱う場合だけ必要
+    zstandard = None
+
+# 取得したdiffを追記していくファイルの拡張子
+DIFF_SUFFIX = ".jsonl"
+
+
+def resolve_diff_path(directory: Path, repo: str) -> Path:
+    """directoryにある{repo}のdiffのファイルを返す
+
+    {repo}.jsonl・{repo}.jsonl.zst・変換前の{repo}.jsonの順に探し，どれもなければ{repo}.jsonlを返す
+    """
+    for suffix in (DIFF_SUFFIX, f"{DIFF_SUFFIX}.zst", ".json"):
+        file_path = directory / f"{repo}{suffix}"
+        if file_path.exists():
+            return file_path
+    return directory / f"{repo}{DIFF_SUFFIX}"
+
+
+def _is_zstd(file_path: Path) -> bool:
+    return file_path.suffix == ".zst"
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstandard is required to read or write .zst files")
+    return zstandard
+
 
 #将来的にデータベースに移行
 class DiffDataHandler:
+    """diffのファイルの読み書き．拡張子で形式を切り替える
+
+    .json: 全件のJSON配列(追記のたびに全体を読み直して書き直す)
+    .jsonl: 1行1件のJSON Lines．追記はファイルの末尾に足すだけ
+    .jsonl.zst: 追記ごとに独立したzstdのフレームを足したJSON Lines(zstandardが必要)
+    """
+
     @staticmethod
     def load_from_json(file_path: Path) -> list[DiffData]:
         if not file_path.exists():
@@ -43,3 +84,79 @@ class DiffDataHandler:
         except OSError as e:
             raise OSError(f"Failed to save file: {str(e)}")
 
+    @staticmethod
+    def append(data: list[DiffData], output_path: Path) -> None:
+        """diffをファイルの末尾に追記する．.jsonの場合はdump_to_jsonと同じ"""
+        if output_path.suffix == ".json":
+            DiffDataHandler.dump_to_json(data, output_path)
+            return
+        DiffDataHandler._append_rows((d.to_dict() for d in data), output_path)
+
+    @staticmethod
+    def _append_rows(rows: Iterable[dict], output_path: Path) -> None:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        lines = b"".join(orjson.dumps(row) + b"\n" for row in rows)
+        if not lines:
+            return
+        if _is_zstd(output_path):
+            # フレームを連結したファイルは，read_across_framesで1つのストリームとして読める
+            lines = _require_zstandard().ZstdCompressor().compress(lines)
+        try:
+            with open(output_path, "ab") as f:
+                f.write(lines)
+        except OSError as e:
+            raise OSError(f"Failed to save file: {str(e)}")
+
+    @staticmethod
+    def stream(file_path: Path) -> Iterator[DiffData]:
+        """diffを1件ずつ読み込む．全件をメモリに持たない"""
+        for row in DiffDataHandler._stream_rows(file_path):
+            yield DiffData.from_dict(row)
+
+    @staticmethod
+    def _stream_rows(file_path: Path) -> Iterator[dict]:
+        if not file_path.exists():
+            raise FileNotFoundError(f"File not found: {file_path}")
+        with open(file_path, "rb") as f:
+            if file_path.suffix == ".json":
+                yield from ijson.items(f, "item", use_float=True)
+            elif _is_zstd(file_path):
+                reader = _require_zstandard().ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                for line in _read_lines(reader):
+                    yield orjson.loads(line)
+            else:
+                for line in f:
+                    yield orjson.loads(line)
+
+    @staticmethod
+    def load(file_path: Path) -> list[DiffData]:
+        """拡張子に応じて全件を読み込む"""
+        return list(DiffDataHandler.stream(file_path))
+
+    @staticmethod
+    def convert(input_path: Path, output_path: Path) -> None:
+        """既存のJSON配列のファイルを，JSON Lines(output_pathが.zstならzstd圧縮)へ変換する"""
+        if output_path.exists():
+            raise FileExistsError(f"File already exists: {output_path}")
+        rows = DiffDataHandler._stream_rows(input_path)
+        # 一定件数ごとに追記するため，大きなファイルもメモリに収まる
+        while chunk := [row for _, row in zip(range(10000), rows)]:
+            DiffDataHandler._append_rows(chunk, output_path)
+        print(f"Converted {input_path} to {output_path}")
+
+
+def _read_lines(reader) -> Iterator[bytes]:
+    """バイナリのストリームから改行区切りの行を返す"""
+    buffer = b""
+    while chunk := reader.read(1 << 20):
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        yield from (line for line in lines if line)
+    if buffer:
+        yield buffer
+
+
+if __name__ == "__main__":
+    # $ python src/utils/diff_handler.py [変換元の.json] [変換先の.jsonl(.zst)]
+    source = Path(sys.argv[1])
+    DiffDataHandler.convert(source, Path(sys.argv[2]) if len(sys.argv) > 2 else source.with_suffix(DIFF_SUFFIX))
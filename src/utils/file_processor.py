@@ -3,7 +3,7 @@ import os
 import re
 import shutil
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Iterable
 
 import ijson
 import orjson
@@ -92,6 +92,62 @@ def dump_to_json(data, file_path: Path):
         f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2).decode("utf-8"))
 
 
+def dump_to_jsonl(rows: Iterable, file_path: Path):
+    """
+    データを1行1要素のJSON Lines形式で逐次書き出す関数。
+
+    Args:
+        rows (Iterable): 保存するデータ(1要素が1行になる)
+        file_path (Path): JSONLファイルへのパス
+    """
+    ensure_dir_exists(file_path)
+    with open(file_path, "wb") as f:
+        for row in rows:
+            f.write(orjson.dumps(row))
+            f.write(b"\n")
+
+
+def stream_jsonl(file_path: Path) -> Generator:
+    """JSON Lines形式のファイルから1行ずつ要素を読み込む
+
+    Args:
+        file_path (Path): JSONLファイルへのパス
+    """
+    with open(file_path, "rb") as f:
+        for line in f:
+            yield orjson.loads(line)
+
+
+class JSONArrayWriter:
+    """要素を1つずつJSON配列としてファイルへ書き出す
+
+    全要素をメモリに持たずに書き出せる．出力はload_from_json・stream_json_patternsでそのまま読める．
+
+    Example:
+        with JSONArrayWriter(file_path) as writer:
+            writer.write({"pattern": ["+a"], "support": 10})
+    """
+
+    def __init__(self, file_path: Path):
+        self.file_path = file_path
+        self.count = 0
+
+    def __enter__(self) -> "JSONArrayWriter":
+        ensure_dir_exists(self.file_path)
+        self.file = open(self.file_path, "wb")
+        self.file.write(b"[")
+        return self
+
+    def write(self, item) -> None:
+        self.file.write(b"\n  " if self.count == 0 else b",\n  ")
+        self.file.write(orjson.dumps(item))
+        self.count += 1
+
+    def __exit__(self, *exc_info) -> None:
+        self.file.write(b"\n]\n" if self.count else b"]\n")
+        self.file.close()
+
+
 def list_files_in_directory(directory):
     """指定されたディレクトリ内のすべてのファイル名を取得する関数
 
@@ -0,0 +1,170 @@
+"""パターン(pattern: トークンのリスト, support)のファイルの読み書き
+
+拡張子で形式を切り替える．
+    .parquet: pattern(list<str>)・support・length(トークン数)の列を持つParquet(zstd圧縮)．
+        文字列は辞書エンコードされ，行グループごとの統計からsupport・lengthの条件で読み飛ばせる
+    .json: これまでのJSON配列
+"""
+
+import tempfile
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import polars as pl
+
+from models.pattern import PatternWithSupport
+from utils.file_processor import JSONArrayWriter, ensure_dir_exists, stream_json_patterns
+
+# パイプラインが書き出すパターンのファイルの拡張子
+PATTERN_SUFFIX = ".parquet"
+# Parquetの1つの行グループの行数．逐次読み込みもこの行数ずつ行う
+ROW_GROUP_SIZE = 100_000
+# List列を作るときにトークンを連結する区切り文字(トークンには現れない制御文字)
+TOKEN_SEPARATOR = "\x1f"
+
+
+def _check_suffix(file_path: Path) -> str:
+    if file_path.suffix not in (".parquet", ".json"):
+        raise ValueError(f"unsupported pattern file: {file_path}")
+    return file_path.suffix
+
+
+def _to_dict(item) -> dict:
+    if isinstance(item, PatternWithSupport):
+        return {"pattern": item.pattern, "support": item.support}
+    return item
+
+
+def _to_frame(rows: list[dict]) -> pl.DataFrame:
+    # 入れ子のリストからList列を作るのは遅いため，区切り文字で連結した文字列の列を作ってからpolars側で分割する
+    frame = pl.DataFrame(
+        {
+            "joined": [TOKEN_SEPARATOR.join(row["pattern"]) for row in rows],
+            "support": [row["support"] for row in rows],
+            "length": [len(row["pattern"]) for row in rows],
+        },
+        schema={"joined": pl.String, "support": pl.Int64, "length": pl.UInt32},
+    )
+    return frame.select(
+        pattern=pl.when(pl.col("length") > 0)
+        .then(pl.col("joined").str.split(TOKEN_SEPARATOR))
+        .otherwise(pl.lit([], dtype=pl.List(pl.String))),
+        support="support",
+        length="length",
+    )
+
+
+class PatternWriter:
+    """パターンを1つずつファイルへ書き出す
+
+    Parquetの場合はROW_GROUP_SIZE行ずつ一時ファイルへ書き出し，閉じるときにストリーミングで1つのファイルへまとめる．
+    どちらの形式でも全パターンをメモリに持たない
+    """
+
+    def __init__(self, file_path: Path):
+        self.suffix = _check_suffix(file_path)
+        self.file_path = file_path
+        self.count = 0
+
+    def __enter__(self) -> "PatternWriter":
+        ensure_dir_exists(self.file_path)
+        if self.suffix == ".json":
+            self.json_writer = JSONArrayWriter(self.file_path).__enter__()
+        else:
+            self.tmp_dir = tempfile.TemporaryDirectory(dir=self.file_path.parent)
+            self.parts: list[Path] = []
+            self.rows: list[dict] = []
+        return self
+
+    def write(self, item) -> None:
+        self.count += 1
+        if self.suffix == ".json":
+            self.json_writer.write(_to_dict(item))
+            return
+        self.rows.append(_to_dict(item))
+        if len(self.rows) >= ROW_GROUP_SIZE:
+            self._flush()
+
+    def _flush(self) -> None:
+        part_path = Path(self.tmp_dir.name) / f"part_{len(self.parts)}.parquet"
+        _to_frame(self.rows).write_parquet(part_path, compression="zstd")
+        self.parts.append(part_path)
+        self.rows = []
+
+    def __exit__(self, *exc_info) -> None:
+        if self.suffix == ".json":
+            self.json_writer.__exit__(*exc_info)
+            return
+        try:
+            if self.rows or not self.parts:
+                self._flush()
+            pl.scan_parquet(self.parts).sink_parquet(
+                self.file_path, compression="zstd", row_group_size=ROW_GROUP_SIZE, maintain_order=True
+            )
+        finally:
+            self.tmp_dir.cleanup()
+
+
+def write_patterns(patterns: Iterable, file_path: Path) -> int:
+    """パターン(dictまたはPatternWithSupport)を書き出し，書き出した数を返す"""
+    with PatternWriter(file_path) as writer:
+        for pattern in patterns:
+            writer.write(pattern)
+    return writer.count
+
+
+def scan_patterns(file_path: Path, min_support: int | None = None, max_length: int | None = None) -> pl.LazyFrame:
+    """pattern・support・lengthの列を持つLazyFrameを返す．Parquetなら条件は読み込み時に適用される"""
+    if _check_suffix(file_path) == ".parquet":
+        frame = pl.scan_parquet(file_path)
+    else:
+        frame = _to_frame(list(stream_json_patterns(file_path))).lazy()
+    return _filter(frame, min_support, max_length)
+
+
+def _filter(frame: pl.LazyFrame, min_support: int | None, max_length: int | None) -> pl.LazyFrame:
+    if min_support is not None:
+        frame = frame.filter(pl.col("support") >= min_support)
+    if max_length is not None:
+        frame = frame.filter(pl.col("length") <= max_length)
+    return frame
+
+
+def iter_patterns(
+    file_path: Path, min_support: int | None = None, max_length: int | None = None
+) -> Iterator[dict]:
+    """パターンを{"pattern", "support"}のdictとしてファイルの順に1つずつ返す
+
+    Parquetは書き出し時の行グループの大きさ(ROW_GROUP_SIZE行)ずつ，範囲ごとに条件をかけたスキャンで読むため，
+    メモリに持つのは1つの範囲の行だけになる(条件を満たす行がない範囲は行グループの統計で読み飛ばされる)
+    """
+    if _check_suffix(file_path) == ".json":
+        for item in stream_json_patterns(file_path):
+            if min_support is not None and item["support"] < min_support:
+                continue
+            if max_length is not None and len(item["pattern"]) > max_length:
+                continue
+            yield item
+        return
+
+    # 行数はフッタのメタデータから求まる
+    total = pl.scan_parquet(file_path).select(pl.len()).collect().item()
+    for offset in range(0, total, ROW_GROUP_SIZE):
+        frame = _filter(pl.scan_parquet(file_path).slice(offset, ROW_GROUP_SIZE), min_support, max_length)
+        yield from frame.select("pattern", "support").collect().iter_rows(named=True)
+
+
+def iter_pattern_chunks(file_path: Path, chunk_size: int, **conditions) -> Iterator[list[dict]]:
+    """iter_patternsの結果をchunk_size個ずつのリストにまとめて返す(並列処理へ渡す単位)"""
+    patterns = iter_patterns(file_path, **conditions)
+    return iter(lambda: list(islice(patterns, chunk_size)), [])
+
+
+def load_patterns(
+    file_path: Path, min_support: int | None = None, max_length: int | None = None
+) -> list[PatternWithSupport]:
+    return [
+        PatternWithSupport(item["pattern"], item["support"])
+        for item in iter_patterns(file_path, min_support, max_length)
+    ]
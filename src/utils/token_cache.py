@@ -0,0 +1,175 @@
+import atexit
+import os
+import sqlite3
+import time
+import tokenize
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+from codetokenizer.tokenizer import TokeNizer
+
+from constants import path
+from exception import TokenizationError
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_STATS_PATH = path.INTERMEDIATE / "token_cache_stats.sqlite3"
+
+# 言語ごとのトークナイザ．プロセス内で使い回す(joblibのワーカーでは各プロセスで1回ずつ作られる)
+_tokenizers: dict[str, TokeNizer] = {}
+
+
+def get_tokenizer(language: str) -> TokeNizer:
+    """言語ごとに1つのTokeNizerを使い回す"""
+    tokenizer = _tokenizers.get(language)
+    if tokenizer is None:
+        tokenizer = _tokenizers[language] = TokeNizer(language)
+    return tokenizer
+
+
+class TokenCache:
+    """1行分のコードとそのトークン列を対応づける，件数上限つきのLRUキャッシュ
+
+    抽象化(関数名の特定)とトークン差分の計算では同じ行を何度もトークン化するため，結果を使い回す．
+    hits/missesはステージごとに数え，hitsがトークン化を省略できた回数になる．
+
+    stats_pathを指定した場合は，joblibのワーカーごとの数をgumtree.cacheと同じようにSQLiteへ積算する．
+    数はメモリに貯め，FLUSH_INTERVAL回ごと・FLUSH_SECONDS秒ごと・プロセスの終了時にまとめて書き込む．
+    """
+
+    FLUSH_INTERVAL = 10_000
+    FLUSH_SECONDS = 5.0
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, stats_path: Path | None = None):
+        if max_entries < 1:
+            raise ValueError("max_entries must be a positive integer")
+        self.max_entries = max_entries
+        self.stats_path = stats_path
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+        self._entries: OrderedDict[tuple[str, str], tuple[str, ...]] = OrderedDict()
+        # まだDBに書き込んでいないステージごとの[ヒット数, ミス数]
+        self._pending: dict[str, list[int]] = {}
+        self._lookups = 0
+        self._flushed_at = time.monotonic()
+        self._pid = os.getpid()
+        self._conn: sqlite3.Connection | None = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def tokenize(self, language: str, code_line: str, stage: str = "default") -> tuple[str, ...]:
+        key = (language, code_line)
+        tokens = self._entries.get(key)
+        if tokens is not None:
+            self.hits[stage] += 1
+            self._entries.move_to_end(key)
+            self._record(stage, True)
+            return tokens
+
+        self.misses[stage] += 1
+        self._record(stage, False)
+        try:
+            tokens = tuple(get_tokenizer(language).getPureTokens(code_line))
+        except tokenize.TokenError as e:
+            raise TokenizationError(f"Failed to tokenize code: {str(e)}") from e
+
+        self._entries[key] = tokens
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return tokens
+
+    def _record(self, stage: str, hit: bool) -> None:
+        if self.stats_path is None:
+            return
+        if self._pid != os.getpid():
+            # forkで親から引き継いだ分は親が書き込むため捨てる
+            self._pending.clear()
+            self._conn = None
+            self._pid = os.getpid()
+        self._pending.setdefault(stage, [0, 0])[0 if hit else 1] += 1
+        self._lookups += 1
+        if self._lookups >= self.FLUSH_INTERVAL or time.monotonic() - self._flushed_at >= self.FLUSH_SECONDS:
+            self.flush()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            assert self.stats_path is not None
+            os.makedirs(self.stats_path.parent, exist_ok=True)
+            self._conn = sqlite3.connect(self.stats_path, timeout=60, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats "
+                "(stage TEXT PRIMARY KEY, hits INTEGER NOT NULL, misses INTEGER NOT NULL)"
+            )
+        return self._conn
+
+    def flush(self) -> None:
+        """貯めたヒット数・ミス数を1つのトランザクションでDBに積算する"""
+        self._lookups = 0
+        self._flushed_at = time.monotonic()
+        if self.stats_path is None or not self._pending:
+            return
+        self._connect().executemany(
+            "INSERT INTO stats (stage, hits, misses) VALUES (?, ?, ?) "
+            "ON CONFLICT(stage) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+            [(stage, *counts) for stage, counts in self._pending.items()],
+        )
+        self._pending.clear()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """ステージごとのヒット数・ミス数を返す
+
+        stats_pathを指定した場合は全プロセス分(他のプロセスがまだ書き込んでいない分は含まない)，
+        指定しない場合はこのプロセスでの数を返す
+        """
+        if self.stats_path is None:
+            return {
+                stage: {"hits": self.hits[stage], "misses": self.misses[stage]}
+                for stage in sorted(self.hits.keys() | self.misses.keys())
+            }
+        self.flush()
+        return {
+            stage: {"hits": hits, "misses": misses}
+            for stage, hits, misses in self._connect().execute("SELECT stage, hits, misses FROM stats ORDER BY stage")
+        }
+
+    def reset_stats(self) -> None:
+        self.hits.clear()
+        self.misses.clear()
+        self._pending.clear()
+        if self.stats_path is not None:
+            self._connect().execute("DELETE FROM stats")
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits.clear()
+        self.misses.clear()
+
+
+_cache = TokenCache(stats_path=DEFAULT_STATS_PATH)
+
+
+def get_token_cache() -> TokenCache:
+    return _cache
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    """joblibのワーカーの終了時に，貯めているヒット数・ミス数を書き込む"""
+    if _cache._pid == os.getpid():
+        _cache.flush()
+
+
+def tokenize_line(language: str, code_line: str, stage: str = "default") -> tuple[str, ...]:
+    """キャッシュを確認してから1行をトークン化する"""
+    return _cache.tokenize(language, code_line, stage)
+
+
+if __name__ == "__main__":
+    for line in ["a = a + b", "a += b", "a = a + b"]:
+        print(tokenize_line("Python", line, stage="example"))
+
+    for stage, counts in get_token_cache().stats().items():
+        total = counts["hits"] + counts["misses"]
+        rate = counts["hits"] / total if total else 0.0
+        print(f"{stage}: hits={counts['hits']} misses={counts['misses']} saved={rate:.1%}")
@@ -0,0 +1,74 @@
+from abstractor.abstraction import apply_abstraction, replace_name
+from models.diff import DiffHunk
+from models.gumtree import GumTreeResponse, Match
+
+
+def test_apply_abstraction_assigns_placeholders_in_match_order():
+    diff_hunk = DiffHunk(['x = foo("a", 12)'], ['x = bar("b", 12, y)'])
+    response = GumTreeResponse(
+        matches=[
+            Match(src="identifier: x [0,1]", dest="identifier: x [0,1]"),
+            Match(src="identifier: foo [4,7]", dest="identifier: bar [4,7]"),
+            Match(src="string [8,11]", dest="string [8,11]"),
+            Match(src="integer: 12 [13,15]", dest="integer: 12 [13,15]"),
+        ]
+    )
+
+    assert apply_abstraction(diff_hunk, response) == DiffHunk(
+        ["VAR_1 = VAR_2(STRING_1, NUBER_1)"], ["VAR_1 = VAR_3(STRING_2, NUBER_1, y)"]
+    )
+
+
+def test_apply_abstraction_does_not_touch_other_identifiers():
+    diff_hunk = DiffHunk(["image_meta = {}"], ["image_meta = objects.from_dict(self.test_image_meta)"])
+    response = GumTreeResponse(
+        matches=[Match(src="identifier: image_meta [0,10]", dest="identifier: image_meta [0,10]")]
+    )
+
+    assert apply_abstraction(diff_hunk, response) == DiffHunk(
+        ["VAR_1 = {}"], ["VAR_1 = objects.from_dict(self.test_image_meta)"]
+    )
+
+
+def test_apply_abstraction_preserves_common_names():
+    diff_hunk = DiffHunk(["d.get(k)"], ["d.pop(k)"])
+    response = GumTreeResponse(
+        matches=[
+            Match(src="identifier: d [0,1]", dest="identifier: d [0,1]"),
+            Match(src="identifier: get [2,5]", dest="identifier: pop [2,5]"),
+        ]
+    )
+
+    assert apply_abstraction(diff_hunk, response) == DiffHunk(["VAR_1.get(k)"], ["VAR_1.pop(k)"])
+
+
+def test_apply_abstraction_keeps_string_prefix_with_literal():
+    # f"..."・rb"..."は接頭辞を含めて1つの文字列として置き換え，接頭辞だけを識別子として扱わない
+    diff_hunk = DiffHunk(['log(f"a{x}", bu)'], ['log(rb"a", bu)'])
+    response = GumTreeResponse(
+        matches=[
+            Match(src="string [4,11]", dest="string [4,9]"),
+            Match(src="identifier: bu [13,15]", dest="identifier: bu [11,13]"),
+        ]
+    )
+
+    assert apply_abstraction(diff_hunk, response) == DiffHunk(["log(STRING_1, VAR_1)"], ["log(STRING_2, VAR_1)"])
+
+
+def test_apply_abstraction_skips_names_inside_other_literals():
+    # 他の文字列リテラルの中の識別子や，より長い数値の一部は置き換えない
+    diff_hunk = DiffHunk(['x = 1', 'log("x", 1.5)'], ["x = 2"])
+    response = GumTreeResponse(
+        matches=[
+            Match(src="identifier: x [0,1]", dest="identifier: x [0,1]"),
+            Match(src="integer: 1 [4,5]", dest="integer: 2 [4,5]"),
+        ]
+    )
+
+    assert apply_abstraction(diff_hunk, response) == DiffHunk(
+        ["VAR_1 = NUBER_1", 'log("x", 1.5)'], ["VAR_1 = NUBER_2"]
+    )
+
+
+def test_replace_name_is_anchored():
+    assert replace_name("def func(func_a)", "func", "FUNCTION_1") == "def FUNCTION_1(func_a)"
@@ -0,0 +1,40 @@
+"""GumTreePoolのテスト用に，DiffWorkerのserveと同じプロトコルで応答する偽のワーカー
+
+srcの内容で動作を切り替える．
+    hang: 応答しない
+    crash: 応答せずに終了する
+    crash_once:{path}: pathがなければ作ってから終了し，あれば通常どおり応答する
+    error: ERRを返す
+それ以外は，srcをtree，"{dest} {pid}"をlabelに持つupdate-nodeを1つ返す
+"""
+
+import json
+import os
+import sys
+import time
+
+stdin = sys.stdin.buffer
+stdout = sys.stdout.buffer
+
+while header := stdin.readline():
+    src_size, dest_size = map(int, header.split())
+    src = stdin.read(src_size).decode("utf-8")
+    dest = stdin.read(dest_size).decode("utf-8")
+
+    if src == "hang":
+        time.sleep(3600)
+    if src == "crash":
+        sys.exit(1)
+    if src.startswith("crash_once:"):
+        marker = src.split(":", 1)[1]
+        if not os.path.exists(marker):
+            open(marker, "w").close()
+            sys.exit(1)
+
+    if src == "error":
+        status, body = "ERR", b"failed to parse"
+    else:
+        action = {"action": "update-node", "tree": src, "label": f"{dest} {os.getpid()}"}
+        status, body = "OK", json.dumps({"matches": [], "actions": [action]}).encode("utf-8")
+    stdout.write(f"{status} {len(body)}\n".encode("utf-8") + body)
+    stdout.flush()
@@ -0,0 +1,72 @@
+import gumtree.cache as cache_module
+from gumtree.cache import GumTreeCache
+from models.gumtree import Action, GumTreeResponse, Match
+
+
+def _response(label: str) -> GumTreeResponse:
+    return GumTreeResponse(
+        matches=[Match(src="identifier: a [0,1]", dest="identifier: b [0,1]")],
+        actions=[Action(action="update-node", tree="identifier: a [0,1]", label=label)],
+    )
+
+
+def test_cache_round_trip_and_counters(tmp_path):
+    cache = GumTreeCache(tmp_path / "cache.sqlite3")
+    key = cache.make_key(["a = 1"], ["b = 1"])
+
+    assert cache.get(key, "abstraction") is None
+    cache.put(key, _response("b"))
+    assert cache.get(key, "abstraction") == _response("b")
+
+    assert cache.stats() == {"abstraction": {"hits": 1, "misses": 1, "fast_path": 0}}
+
+
+def test_lookups_are_written_in_one_flush(tmp_path):
+    cache = GumTreeCache(tmp_path / "cache.sqlite3")
+    cache.put("key", _response("b"))
+    cache.conn.execute("UPDATE responses SET accessed = 0 WHERE key = 'key'")
+
+    # ヒットしても参照時刻・ヒット数はすぐには書き込まない
+    assert cache.get("key", "abstraction") == _response("b")
+    assert cache.get("missing", "abstraction") is None
+    reader = GumTreeCache(tmp_path / "cache.sqlite3")
+    assert reader.stats() == {}
+    assert reader.conn.execute("SELECT accessed FROM responses").fetchone()[0] == 0
+
+    cache.close()
+    assert reader.stats() == {"abstraction": {"hits": 1, "misses": 1, "fast_path": 0}}
+    assert reader.conn.execute("SELECT accessed FROM responses").fetchone()[0] > 0
+
+
+def test_cache_key_depends_on_line_boundaries(tmp_path):
+    cache = GumTreeCache(tmp_path / "cache.sqlite3")
+    assert cache.make_key(["a", "b"], ["c"]) != cache.make_key(["a"], ["b", "c"])
+
+
+def test_evict_oldest_entries(tmp_path):
+    cache = GumTreeCache(tmp_path / "cache.sqlite3", max_bytes=1)
+    cache.put("old", _response("x"))
+    cache.put("new", _response("y"))
+    cache.conn.execute("UPDATE responses SET accessed = 0 WHERE key = 'old'")
+
+    assert cache.evict() == 2
+    assert cache.get("old") is None
+
+
+def test_cached_batch_only_runs_missing_pairs(tmp_path, monkeypatch):
+    cache = GumTreeCache(tmp_path / "cache.sqlite3")
+    monkeypatch.setattr(cache_module, "get_cache", lambda: cache)
+    submitted = []
+
+    def fake_batch(pairs):
+        submitted.append(pairs)
+        return [_response(dest[0]) for _, dest in pairs]
+
+    monkeypatch.setattr(cache_module, "run_GumTree_batch", fake_batch)
+
+    pairs = [(["a"], ["b"]), (["c"], ["d"])]
+    first = cache_module.cached_run_GumTree_batch(pairs)
+    second = cache_module.cached_run_GumTree_batch(pairs + [(["e"], ["f"])])
+
+    assert second[:2] == first
+    assert submitted == [pairs, [(["e"], ["f"])]]
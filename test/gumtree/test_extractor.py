@@ -0,0 +1,36 @@
+from gumtree.extractor import derive_update_code_changes, extract_update_code_changes, find_update_lines
+from models.diff import DiffHunk
+from models.gumtree import AbstractionResult, Action, GumTreeResponse, UpdateChange
+
+
+def test_find_update_lines():
+    condition = ["ASSERT_EQ(expected, actual);", "ASSERT_EQ(expected2, actual2);"]
+    actions = [
+        Action(action="update-node", tree="identifier: ASSERT_EQ [0,9]", label="EXPECT_EQ"),
+        Action(action="insert-node", tree="identifier: x [3,4]"),
+        Action(action="update-node", tree="identifier: ASSERT_EQ [29,38]", label="EXPECT_EQ"),
+    ]
+    assert find_update_lines(condition, actions) == [0, 1]
+
+    consequent = ["EXPECT_EQ(expected, actual);", "EXPECT_EQ(expected2, actual2);"]
+    assert extract_update_code_changes(condition, consequent, actions) == [
+        UpdateChange(before=condition[0], after=consequent[0]),
+        UpdateChange(before=condition[1], after=consequent[1]),
+    ]
+
+
+def test_derive_update_code_changes_uses_abstraction_positions():
+    source = DiffHunk(["long_name = 1", "other = 2"], ["long_name = 3", "renamed = 2"])
+    result = AbstractionResult(
+        diff_hunk=DiffHunk(["VAR_1 = 1", "VAR_2 = 2"], ["VAR_1 = 3", "VAR_2 = 2"]),
+        source=source,
+        response=GumTreeResponse(
+            actions=[
+                Action(action="update-node", tree="integer: 1 [12,13]", label="3"),
+                Action(action="update-node", tree="identifier: other [14,19]", label="renamed"),
+            ]
+        ),
+    )
+
+    # 2行目は抽象化によって変更前後が同じになるため含まれない
+    assert derive_update_code_changes(result) == [UpdateChange(before="VAR_1 = 1", after="VAR_1 = 3")]
@@ -0,0 +1,107 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import gumtree.cache as cache_module
+import gumtree.pool as pool_module
+from gumtree.cache import GumTreeCache
+from gumtree.pool import GumTreePool
+
+FAKE_WORKER = [sys.executable, str(Path(__file__).parent / "fake_worker.py")]
+
+
+def _label(response) -> tuple[str, int]:
+    """偽のワーカーの応答から(dest, ワーカーのpid)を取り出す"""
+    dest, pid = response.actions[0].label.rsplit(" ", 1)
+    return dest, int(pid)
+
+
+def test_pool_keeps_order_within_concurrency():
+    pairs = [([f"a{i}"], [f"b{i}"]) for i in range(8)]
+
+    responses = GumTreePool(concurrency=2, command=FAKE_WORKER).run(pairs)
+
+    assert [_label(response)[0] for response in responses] == [f"b{i}" for i in range(8)]
+    assert len({_label(response)[1] for response in responses}) <= 2
+
+
+def test_pool_restarts_hanging_worker_after_timeout():
+    start = time.perf_counter()
+    with GumTreePool(concurrency=1, timeout=0.5, retries=0, backoff=0, command=FAKE_WORKER) as pool:
+        hung, ok = pool.run([(["hang"], ["x"]), (["a"], ["b"])])
+        # withの中ではrunをまたいで同じワーカーを使い回す
+        (again,) = pool.run([(["c"], ["d"])])
+
+    assert hung is None
+    assert _label(ok)[0] == "b"
+    assert _label(again)[1] == _label(ok)[1]
+    assert time.perf_counter() - start < 10
+
+
+def test_pool_retries_crashed_worker(tmp_path):
+    marker = tmp_path / "crashed"
+    pool = GumTreePool(concurrency=1, retries=1, backoff=0, command=FAKE_WORKER)
+
+    recovered, crashed = pool.run([([f"crash_once:{marker}"], ["x"]), (["crash"], ["y"])])
+
+    assert marker.exists()
+    assert _label(recovered)[0] == "x"
+    # 再試行しても落ち続ける場合はNone
+    assert crashed is None
+
+
+def test_pool_does_not_retry_worker_errors():
+    before, error, after = GumTreePool(concurrency=1, retries=2, backoff=0, command=FAKE_WORKER).run(
+        [(["a"], ["b"]), (["error"], ["x"]), (["c"], ["d"])]
+    )
+
+    assert error is None
+    # ERRはワーカーを止めずに返す
+    assert _label(before)[1] == _label(after)[1]
+
+
+def test_diff_many_bounds_pending_tasks(monkeypatch):
+    pool = GumTreePool(concurrency=1, max_pending=3, command=FAKE_WORKER)
+    in_flight = peak = 0
+
+    async def fake_diff(src_code, dest_code):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    monkeypatch.setattr(pool, "diff", fake_diff)
+    asyncio.run(pool.diff_many([(["a"], ["b"])] * 20))
+
+    assert peak == 3
+
+
+def test_kill_stops_docker_container(monkeypatch, tmp_path):
+    # docker runのクライアントだけでなく，コンテナもdocker killで止める
+    log_path = tmp_path / "docker.log"
+    docker = tmp_path / "docker"
+    docker.write_text(f"#!{sys.executable}\nimport sys\nopen({str(log_path)!r}, 'a').write(' '.join(sys.argv[1:]))\n")
+    docker.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{pool_module.os.environ['PATH']}")
+    monkeypatch.setattr(pool_module, "_worker_command", lambda: (FAKE_WORKER, "gumtree-test"))
+
+    responses = GumTreePool(concurrency=1, timeout=0.5, retries=0, backoff=0).run([(["hang"], ["x"])])
+
+    assert responses == [None]
+    assert log_path.read_text() == "kill gumtree-test"
+
+
+def test_cached_batch_runs_missing_pairs_on_pool(monkeypatch, tmp_path):
+    cache = GumTreeCache(tmp_path / "cache.sqlite3")
+    monkeypatch.setattr(cache_module, "get_cache", lambda: cache)
+    pairs = [(["a"], ["b"]), (["c"], ["d"])]
+
+    with GumTreePool(concurrency=2, command=FAKE_WORKER) as pool:
+        first = cache_module.cached_run_GumTree_batch(pairs, pool=pool)
+        second = cache_module.cached_run_GumTree_batch(pairs, pool=pool)
+
+    assert [_label(response)[0] for response in first] == ["b", "d"]
+    assert second == first
+    assert cache.stats() == {"default": {"hits": 2, "misses": 2, "fast_path": 0}}
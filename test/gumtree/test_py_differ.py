@@ -0,0 +1,59 @@
+import gumtree.py_differ as py_differ
+from gumtree.cache import GumTreeCache
+from gumtree.py_differ import diff_python, run_tree_diff
+from models.gumtree import Action, GumTreeResponse, Match
+
+
+def test_diff_python_matches_and_updates():
+    response = diff_python(['x = foo("a", 12)'], ['x = bar("b", 12, y)'])
+
+    assert response == GumTreeResponse(
+        matches=[
+            Match(src="identifier: x [0,1]", dest="identifier: x [0,1]"),
+            Match(src="identifier: foo [4,7]", dest="identifier: bar [4,7]"),
+            Match(src="string [8,11]", dest="string [8,11]"),
+            Match(src="integer: 12 [13,15]", dest="integer: 12 [13,15]"),
+        ],
+        actions=[
+            Action(action="update-node", tree="identifier: foo [4,7]", label="bar"),
+            Action(action="update-node", tree="string [8,11]", label='"b"'),
+        ],
+    )
+
+
+def test_diff_python_offsets_span_lines():
+    response = diff_python(["a = 1", "b = 2"], ["a = 1", "b = 3"])
+
+    assert response is not None
+    assert response.actions == [Action(action="update-node", tree="integer: 2 [10,11]", label="3")]
+
+
+def test_diff_python_allows_unclosed_brackets():
+    response = diff_python(["foo(a,"], ["foo(b,"])
+
+    assert response is not None
+    assert response.actions == [Action(action="update-node", tree="identifier: a [4,5]", label="b")]
+
+
+def test_diff_python_gives_up_on_ambiguous_replacements():
+    assert diff_python(["foo(x)"], ["bar.baz(x)"]) is None
+
+
+def test_run_tree_diff_falls_back_to_gumtree(monkeypatch, tmp_path):
+    calls = []
+    cache = GumTreeCache(tmp_path / "cache.sqlite3")
+    monkeypatch.setattr(py_differ, "get_cache", lambda: cache)
+
+    def fake_gumtree(src_code, dest_code, stage):
+        calls.append(stage)
+        return GumTreeResponse()
+
+    monkeypatch.setattr(py_differ, "cached_run_GumTree", fake_gumtree)
+
+    run_tree_diff(["a = 1"], ["a = 2"], stage="abstraction")
+    run_tree_diff(["foo(x)"], ["bar.baz(x)"], stage="abstraction")
+    run_tree_diff(["a = 1"] * 6, ["a = 2"] * 6, stage="abstraction")
+
+    assert calls == ["abstraction", "abstraction"]
+    # Pythonで差分をとれた数はキャッシュの統計として記録する
+    assert cache.stats() == {"abstraction": {"hits": 0, "misses": 0, "fast_path": 1}}
@@ -0,0 +1,42 @@
+import pytest
+
+from pattern.incremental_prefix_span import IncrementalPrefixSpan
+from pattern.prefix_span import PrefixSpan
+
+
+def test_add_matches_full_rerun():
+    years = [
+        [["=a", "-b", "+c"], ["=a", "+c"], ["-b", "=a"]],
+        [["=a", "-b"], ["+c", "-b", "+c"]],
+        [["-b", "+c"], ["=a", "-b", "+c"], ["=d"]],
+    ]
+
+    incremental = IncrementalPrefixSpan(2, max_sequence_length=None, border_support=1)
+    sequences = []
+    for year, new_sequences in enumerate(years, start=2020):
+        sequences += new_sequences
+        patterns = incremental.add(new_sequences, year)
+        assert patterns == PrefixSpan(2, year, max_sequence_length=None).fit(sequences)
+
+
+def test_state_round_trip(tmp_path):
+    state_path = tmp_path / "state.json"
+    first = [["=a", "-b", "+c"], ["=a", "+c"], ["=a", "-b"]]
+    second = [["-b", "+c"], ["-b", "+c", "=a"]]
+
+    incremental = IncrementalPrefixSpan(2, max_sequence_length=None)
+    incremental.add(first, 2020)
+    incremental.save(state_path)
+
+    patterns = IncrementalPrefixSpan.load(state_path).add(second, 2021)
+    assert patterns == PrefixSpan(2, 2021, max_sequence_length=None).fit(first + second)
+
+
+def test_same_window_is_not_added_twice(tmp_path):
+    state_path = tmp_path / "state.json"
+    incremental = IncrementalPrefixSpan(2, max_sequence_length=None)
+    incremental.add([["=a", "-b"], ["=a", "-b"]], 2020)
+    incremental.save(state_path)
+
+    with pytest.raises(ValueError):
+        IncrementalPrefixSpan.load(state_path).add([["=a", "-b"]], 2020)
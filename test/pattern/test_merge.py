@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from constants import path
+from models.pattern import PatternWithSupport
+from pattern.merge import merge_pattern_results, process_all_patterns_parallel, sort_pattern_file
+from utils.pattern_store import PATTERN_SUFFIX, load_patterns, write_patterns
+
+
+def test_streaming_merge_matches_in_memory_merge(monkeypatch, tmp_path):
+    # 出力先のディレクトリを作るときのchownが，環境変数に依存しないようにする
+    monkeypatch.setenv("HOST_UID", str(os.getuid()))
+    monkeypatch.setenv("HOST_GID", str(os.getgid()))
+    monkeypatch.setattr(path, "RESULTS", tmp_path / "results")
+    monkeypatch.setattr(path, "INTERMEDIATE", tmp_path / "intermediate")
+    yearly = [
+        [
+            {"pattern": ["=a", "+b"], "support": 3},
+            {"pattern": ["-c", "+d"], "support": 5},
+            {"pattern": ["+b"], "support": 1},
+        ],
+        [
+            {"pattern": ["+b"], "support": 2},
+            {"pattern": ["=a", "+b"], "support": 2},
+            {"pattern": ["=a"], "support": 4},
+        ],
+    ]
+    for year, items in zip([2016, 2017], yearly):
+        input_path = path.RESULTS / "owner" / f"{year}to{year + 1}" / f"repo{PATTERN_SUFFIX}"
+        input_path.parent.mkdir(parents=True)
+        write_patterns(items, input_path)
+        sort_pattern_file(input_path, chunk_size=2)
+
+    # 2018to2019のファイルはないので飛ばす
+    process_all_patterns_parallel("owner", "repo", 2016, 2019, chunk_size=2)
+
+    merged = load_patterns(path.RESULTS / "owner" / "all" / f"merged_owner{PATTERN_SUFFIX}")
+    assert merged == merge_pattern_results([PatternWithSupport.from_dict(item) for items in yearly for item in items])
+
+
+def test_streaming_merge_rejects_unsorted_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(path, "RESULTS", tmp_path / "results")
+    monkeypatch.setattr(path, "INTERMEDIATE", tmp_path / "intermediate")
+    input_path = path.RESULTS / "owner" / "2016to2017" / f"repo{PATTERN_SUFFIX}"
+    input_path.parent.mkdir(parents=True)
+    write_patterns([{"pattern": ["=b"], "support": 1}, {"pattern": ["=a"], "support": 1}], input_path)
+
+    with pytest.raises(ValueError):
+        process_all_patterns_parallel("owner", "repo", 2016, 2017)
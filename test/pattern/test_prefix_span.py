@@ -0,0 +1,150 @@
+import orjson
+import pytest
+
+from constants import path
+from models.pattern import PatternWithSupport
+from pattern.miner import create_miner
+from pattern.prefix_span import MODES, PrefixSpan
+from rq1.term import contains_all_bracket_pairs, remove_subset_patterns
+
+
+def test_fit_excludes_long_sequences_once(monkeypatch, tmp_path):
+    monkeypatch.setattr(path, "INTERMEDIATE", tmp_path)
+    long_sequence = ["=a", "-b", "+c", "=d"]
+    sequences = [["=a", "-b", "+c"], ["=a", "+c"], long_sequence, long_sequence]
+
+    patterns = PrefixSpan(2, 2020, max_sequence_length=3).fit(sequences)
+
+    assert patterns == [
+        PatternWithSupport(["+c"], 2),
+        PatternWithSupport(["=a"], 2),
+        PatternWithSupport(["=a", "+c"], 2),
+    ]
+    lines = (tmp_path / "2020_too_long_sequences.jsonl").read_bytes().splitlines()
+    assert [orjson.loads(line) for line in lines] == [{"sequence": long_sequence, "count": 2}]
+
+
+def test_fit_does_not_recurse_on_long_sequences():
+    patterns = PrefixSpan(1, 2020, max_sequence_length=None).fit([["=a"] * 2000])
+
+    assert len(patterns) == 2000
+    assert patterns[-1] == PatternWithSupport(["=a"] * 2000, 1)
+
+
+def test_parallel_fit_keeps_order():
+    sequences = [["=a", "-b", "+c"], ["=a", "+c", "-b"], ["-b", "+c"], ["=a", "-b"]]
+
+    parallel = PrefixSpan(2, 2020, max_sequence_length=None, n_jobs=2).fit(sequences)
+    assert parallel == PrefixSpan(2, 2020, max_sequence_length=None).fit(sequences)
+
+
+def test_maximal_mode_matches_subset_removal():
+    sequences = [["=a", "-b", "+c", "=d"], ["=a", "+c", "-b"], ["-b", "+c", "=d"], ["=a", "-b", "=d"], ["+c", "=a"]]
+
+    maximal = PrefixSpan(2, 2020, max_sequence_length=None, mode="maximal").fit(sequences)
+    patterns = PrefixSpan(2, 2020, max_sequence_length=None).fit(sequences)
+    assert remove_subset_patterns(maximal) == remove_subset_patterns(patterns)
+
+    with pytest.raises(ValueError):
+        PrefixSpan(2, 2020, mode="maximal", require_change=True)
+
+
+def test_closed_mode_keeps_patterns_without_same_support_superpattern():
+    sequences = [["=a", "-b", "+c"], ["=a", "-b", "+c"], ["=a", "+c"]]
+
+    closed = PrefixSpan(2, 2020, max_sequence_length=None, mode="closed").fit(sequences)
+    assert sorted(closed, key=lambda p: p.pattern) == [
+        PatternWithSupport(["=a", "+c"], 3),
+        PatternWithSupport(["=a", "-b", "+c"], 2),
+    ]
+
+
+def test_constraints_match_filtering_after_mining():
+    sequences = [["=f", "-(", "+(", "=x", "-)", "+)"], ["=f", "-(", "=x", "-)"], ["+(", "=x", "+)", "=f"]]
+
+    patterns = PrefixSpan(2, 2020, max_sequence_length=None).fit(sequences)
+    constrained = PrefixSpan(
+        2, 2020, max_sequence_length=None, max_pattern_length=3, require_change=True, balanced_brackets=True
+    ).fit(sequences)
+    assert constrained == [
+        pattern
+        for pattern in patterns
+        if len(pattern.pattern) <= 3
+        and any(token.startswith(("+", "-")) for token in pattern.pattern)
+        and contains_all_bracket_pairs(pattern.pattern)
+    ]
+
+
+def test_max_gap_counts_occurrences_within_gap():
+    sequences = [["=a", "=x", "=b"], ["=a", "=x", "=x", "=b"], ["=a", "=b", "=a", "=x", "=b"]]
+
+    patterns = PrefixSpan(2, 2020, max_sequence_length=None, max_gap=1).fit(sequences)
+    supports = {tuple(pattern.pattern): pattern.support for pattern in patterns}
+    # 3番目の系列では，最初の"=a"の後では間隔を満たさない"=x"も，2番目の"=a"の後なら満たす
+    assert supports[("=a", "=x", "=b")] == 3
+    # 2番目の系列では"=a"と"=b"の間に2トークンある
+    assert supports[("=a", "=b")] == 2
+
+
+def test_top_k_keeps_highest_support_in_mining_order():
+    sequences = [["=a", "-b", "+c"], ["=a", "-b"], ["=a", "+c"], ["-b", "+c"]]
+
+    patterns = PrefixSpan(1, 2020, max_sequence_length=None).fit(sequences)
+    top = PrefixSpan(1, 2020, max_sequence_length=None, top_k=4).fit(sequences)
+
+    # 同じsupportなら列挙順の早いものを残し，列挙順のまま返す
+    ranked = sorted(range(len(patterns)), key=lambda i: -patterns[i].support)[:4]
+    assert top == [patterns[i] for i in sorted(ranked)]
+    assert [pattern.support for pattern in top] == [3, 3, 2, 3]
+
+
+def test_top_k_counts_only_patterns_of_min_length():
+    sequences = [["=a", "-b", "+c"], ["=a", "-b"], ["=a", "+c"], ["-b", "+c"]]
+
+    patterns = PrefixSpan(1, 2020, max_sequence_length=None).fit(sequences)
+    top = PrefixSpan(1, 2020, max_sequence_length=None, min_pattern_length=2, top_k=3).fit(sequences)
+
+    # 1トークンのパターンはsupportが大きくても上位k個を占めない
+    long_patterns = [pattern for pattern in patterns if len(pattern.pattern) > 1]
+    ranked = sorted(range(len(long_patterns)), key=lambda i: -long_patterns[i].support)[:3]
+    assert len(top) == 3
+    assert all(len(pattern.pattern) > 1 for pattern in top)
+    assert top == [long_patterns[i] for i in sorted(ranked)]
+
+
+def test_duplicated_sequences_are_counted_by_weight():
+    sequences = [["=a", "-b", "+c"], ["=a", "+c"], ["-b", "+c"]]
+
+    for mode in MODES:
+        patterns = PrefixSpan(2, 2020, max_sequence_length=None, mode=mode).fit(sequences)
+        tripled = PrefixSpan(6, 2020, max_sequence_length=None, mode=mode).fit(sequences * 3)
+        assert tripled == [PatternWithSupport(pattern.pattern, pattern.support * 3) for pattern in patterns]
+
+
+def test_spade_engine_matches_prefix_span():
+    sequences = [["=f", "-(", "+(", "=x", "-)", "+)"], ["=f", "-(", "=x", "-)"], ["+(", "=x", "+)", "=f"]] * 2
+
+    for options in [
+        {},
+        {"max_pattern_length": 3, "require_change": True, "balanced_brackets": True},
+        {"min_pattern_length": 2, "require_change": True},
+    ]:
+        spade = create_miner("spade", 2, 2020, max_sequence_length=None, **options).fit(sequences)
+        assert spade == create_miner("prefixspan", 2, 2020, max_sequence_length=None, **options).fit(sequences)
+
+
+def test_fit_file_streams_patterns_within_memory_budget(monkeypatch, tmp_path):
+    # 退避先の一時ファイルをリポジトリの中に作らない
+    monkeypatch.setattr(path, "INTERMEDIATE", tmp_path)
+    sequences = [["=f", "-(", "+(", "=x", "-)", "+)"], ["=f", "-(", "=x", "-)"], ["+(", "=x", "+)", "=f"]] * 2
+    sequence_path = tmp_path / "sequences.json"
+    sequence_path.write_bytes(orjson.dumps(sequences))
+
+    patterns = PrefixSpan(2, 2020, max_sequence_length=None).fit(sequences)
+    # 予算が1バイトなので，全ての投影DBを一時ファイルへ退避する
+    miner = PrefixSpan(2, 2020, max_sequence_length=None, memory_budget=1)
+    count = miner.fit_file(sequence_path, tmp_path / "patterns.json", min_pattern_length=2)
+
+    expected = [pattern.to_dict() for pattern in patterns if len(pattern.pattern) >= 2]
+    assert orjson.loads((tmp_path / "patterns.json").read_bytes()) == expected
+    assert count == len(expected)
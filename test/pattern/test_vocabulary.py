@@ -0,0 +1,17 @@
+from pattern.vocabulary import Vocabulary
+
+
+def test_ids_follow_token_order():
+    sequences = [["=i", "-[", "+.get("], ["+)", "-[", "=STRING"]]
+    vocabulary = Vocabulary.from_sequences(sequences)
+
+    encoded = vocabulary.encode_all(sequences)
+    assert [vocabulary.decode(sequence) for sequence in encoded] == sequences
+    assert sorted(encoded) == [vocabulary.encode(sequence) for sequence in sorted(sequences)]
+
+
+def test_unknown_token_is_appended():
+    vocabulary = Vocabulary(["+a", "-a"])
+
+    assert vocabulary.intern("=a") == 2
+    assert vocabulary.decode([2, 0]) == ["=a", "+a"]
@@ -0,0 +1,44 @@
+from models.pattern import PatternWithSupport
+from rq1.term import is_subsequence, remove_subset_patterns, remove_subset_patterns_sharded
+
+
+def test_remove_subset_patterns_matches_scanning_all_kept_patterns():
+    patterns = [
+        PatternWithSupport(["=a", "-b"], 5),
+        PatternWithSupport(["=a", "-b", "+c"], 3),
+        PatternWithSupport(["-b", "=a"], 4),
+        PatternWithSupport(["+c", "+c"], 2),
+        PatternWithSupport(["=a", "+c", "-b", "+c"], 2),
+        PatternWithSupport(["=a", "-b"], 7),
+        PatternWithSupport(["=dd"], 1),
+    ]
+
+    # 従来の実装と同じく，文字数の降順に並べて残したパターンの部分列でないものを残す
+    expected: list[PatternWithSupport] = []
+    for pattern in sorted(patterns, key=lambda x: sum(len(token) for token in x.pattern), reverse=True):
+        if not any(is_subsequence(pattern.pattern, other.pattern) for other in expected):
+            expected.append(pattern)
+
+    assert remove_subset_patterns(list(patterns)) == expected
+    assert [pattern.pattern for pattern in expected] == [
+        ["=a", "+c", "-b", "+c"],
+        ["-b", "=a"],
+        ["=dd"],
+    ]
+
+
+def test_sharded_removal_matches_sequential_removal():
+    patterns = [
+        PatternWithSupport(["=a", "-b"], 5),
+        PatternWithSupport(["=a", "-b", "+c"], 3),
+        PatternWithSupport(["-b", "=a"], 4),
+        PatternWithSupport(["+c", "+c"], 2),
+        PatternWithSupport(["=a", "+c", "-b", "+c"], 2),
+        PatternWithSupport(["=a", "-b"], 7),
+        PatternWithSupport(["=dd"], 1),
+        PatternWithSupport(["=dd", "=e"], 1),
+    ]
+
+    expected = remove_subset_patterns(list(patterns))
+    for n_jobs in (1, 2):
+        assert remove_subset_patterns_sharded(list(patterns), n_jobs=n_jobs) == expected
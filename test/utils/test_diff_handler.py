@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import pytest
+
+from models.diff import DiffHunk
+from models.gerrit import DiffData, MetaData
+from utils.diff_handler import DiffDataHandler, resolve_diff_path
+
+
+def _diff(index: int) -> DiffData:
+    meta = MetaData(f"hash{index}", "committer", "subject", "メッセージ")
+    return DiffData(
+        f"I{index}", "master", "nova/a.py", datetime(2020, 1, index + 1), DiffHunk(["a = 1"], [f"a = {index}"]),
+        meta, meta,
+    )
+
+
+def test_append_streams_rows_in_order(tmp_path):
+    output_path = tmp_path / "2020to2021" / "nova.jsonl"
+    diffs = [_diff(i) for i in range(3)]
+
+    DiffDataHandler.append(diffs[:2], output_path)
+    DiffDataHandler.append([], output_path)
+    DiffDataHandler.append(diffs[2:], output_path)
+
+    assert list(DiffDataHandler.stream(output_path)) == diffs
+    assert len(output_path.read_bytes().splitlines()) == 3
+
+
+def test_convert_json_to_jsonl(tmp_path):
+    json_path = tmp_path / "nova.json"
+    diffs = [_diff(i) for i in range(3)]
+    DiffDataHandler.dump_to_json(diffs, json_path)
+
+    DiffDataHandler.convert(json_path, tmp_path / "nova.jsonl")
+
+    assert DiffDataHandler.load(tmp_path / "nova.jsonl") == DiffDataHandler.load_from_json(json_path) == diffs
+    with pytest.raises(FileExistsError):
+        DiffDataHandler.convert(json_path, tmp_path / "nova.jsonl")
+
+
+def test_zstd_frames_round_trip(tmp_path):
+    pytest.importorskip("zstandard")
+    output_path = tmp_path / "nova.jsonl.zst"
+    diffs = [_diff(i) for i in range(3)]
+
+    # 追記ごとに独立したフレームになるので，複数のフレームをまたいで読めることを確かめる
+    DiffDataHandler.append(diffs[:1], output_path)
+    DiffDataHandler.append(diffs[1:], output_path)
+    assert DiffDataHandler.load(output_path) == diffs
+
+    json_path = tmp_path / "nova.json"
+    DiffDataHandler.dump_to_json(diffs, json_path)
+    DiffDataHandler.convert(json_path, tmp_path / "converted.jsonl.zst")
+    assert DiffDataHandler.load(tmp_path / "converted.jsonl.zst") == diffs
+
+
+def test_resolve_diff_path_falls_back_to_json(tmp_path):
+    assert resolve_diff_path(tmp_path, "nova") == tmp_path / "nova.jsonl"
+    (tmp_path / "nova.json").write_text("[]")
+    assert resolve_diff_path(tmp_path, "nova") == tmp_path / "nova.json"
+    (tmp_path / "nova.jsonl").touch()
+    assert resolve_diff_path(tmp_path, "nova") == tmp_path / "nova.jsonl"
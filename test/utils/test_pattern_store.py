@@ -0,0 +1,65 @@
+import orjson
+import pytest
+
+from models.pattern import PatternWithSupport
+from utils import pattern_store
+from utils.pattern_store import iter_patterns, load_patterns, scan_patterns, write_patterns
+
+PATTERNS = [
+    {"pattern": ["=a", "-b", "+c"], "support": 12},
+    {"pattern": ["=a"], "support": 3},
+    {"pattern": [], "support": 20},
+    {"pattern": ["-b", "+c"], "support": 10},
+]
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".json"])
+def test_patterns_round_trip_with_conditions(monkeypatch, tmp_path, suffix):
+    # 複数の行グループに分かれても順序と内容が保たれることを確認する
+    monkeypatch.setattr(pattern_store, "ROW_GROUP_SIZE", 3)
+    file_path = tmp_path / f"patterns{suffix}"
+
+    assert write_patterns([PatternWithSupport.from_dict(item) for item in PATTERNS], file_path) == len(PATTERNS)
+
+    assert list(iter_patterns(file_path)) == PATTERNS
+    assert load_patterns(file_path, min_support=10, max_length=2) == [
+        PatternWithSupport([], 20),
+        PatternWithSupport(["-b", "+c"], 10),
+    ]
+    lengths = scan_patterns(file_path, min_support=10).select("length").collect()["length"].to_list()
+    assert lengths == [3, 0, 2]
+
+
+def test_json_store_stays_readable_as_json(tmp_path):
+    file_path = tmp_path / "patterns.json"
+    write_patterns(PATTERNS, file_path)
+
+    assert orjson.loads(file_path.read_bytes()) == PATTERNS
+
+
+def test_iter_patterns_reads_one_row_group_at_a_time(monkeypatch, tmp_path):
+    # メモリに持つ行数が行グループ1つ分に収まることを，読み込んだDataFrameの行数で確かめる
+    monkeypatch.setattr(pattern_store, "ROW_GROUP_SIZE", 100)
+    file_path = tmp_path / "patterns.parquet"
+    patterns = [{"pattern": ["=a"] * (i % 5 + 1), "support": i} for i in range(1000)]
+    write_patterns(patterns, file_path)
+
+    heights = []
+    collect = pattern_store.pl.LazyFrame.collect
+
+    def _collect(frame, *args, **kwargs):
+        result = collect(frame, *args, **kwargs)
+        heights.append(result.height)
+        return result
+
+    monkeypatch.setattr(pattern_store.pl.LazyFrame, "collect", _collect)
+
+    first = next(iter_patterns(file_path, min_support=10))
+    assert first == patterns[10]
+    assert sum(heights) <= 1 + 100
+
+    heights.clear()
+    assert list(iter_patterns(file_path, min_support=10, max_length=3)) == [
+        item for item in patterns if item["support"] >= 10 and len(item["pattern"]) <= 3
+    ]
+    assert max(heights) <= 100
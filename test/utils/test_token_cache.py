@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+from utils.token_cache import TokenCache, get_tokenizer
+
+
+def test_tokenize_counts_hits_per_stage():
+    cache = TokenCache()
+
+    assert cache.tokenize("Python", "a = a + b", stage="abstraction") == ("a", "=", "a", "+", "b")
+    cache.tokenize("Python", "a = a + b", stage="token_diff")
+    cache.tokenize("Python", "a += b", stage="token_diff")
+
+    assert cache.stats() == {
+        "abstraction": {"hits": 0, "misses": 1},
+        "token_diff": {"hits": 1, "misses": 1},
+    }
+
+
+def test_least_recently_used_line_is_evicted():
+    cache = TokenCache(max_entries=2)
+    cache.tokenize("Python", "a")
+    cache.tokenize("Python", "b")
+    cache.tokenize("Python", "a")
+    cache.tokenize("Python", "c")
+
+    cache.tokenize("Python", "a")
+    cache.tokenize("Python", "b")
+    assert len(cache) == 2
+    assert cache.stats() == {"default": {"hits": 2, "misses": 4}}
+
+
+def test_stats_are_summed_across_processes(tmp_path):
+    stats_path = tmp_path / "token_cache_stats.sqlite3"
+    parent = TokenCache(stats_path=stats_path)
+    parent.tokenize("Python", "a = b", stage="token_diff")
+    parent.tokenize("Python", "a = b", stage="token_diff")
+
+    # joblibのワーカーと同じく，別プロセスのキャッシュは終了時にだけ数を書き込む
+    worker = (
+        "import sys; from pathlib import Path; from utils import token_cache; "
+        "token_cache.get_token_cache().stats_path = Path(sys.argv[1]); "
+        "[token_cache.tokenize_line('Python', 'a = b', stage='token_diff') for _ in range(3)]"
+    )
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    subprocess.run([sys.executable, "-c", worker, str(stats_path)], check=True, env=env)
+
+    assert parent.stats() == {"token_diff": {"hits": 3, "misses": 2}}
+
+
+def test_tokenizer_is_reused_per_language():
+    assert get_tokenizer("Python") is get_tokenizer("Python")